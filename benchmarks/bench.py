@@ -0,0 +1,412 @@
+"""
+Benchmarks for the hot paths of intercessor: kernel start and calls,
+file watching, notebook parsing, and the driver command loop.
+
+Run from the project root:
+
+    python benchmarks/bench.py --output before.json
+    # ... make changes ...
+    python benchmarks/bench.py --output after.json --compare before.json
+
+--compare prints the ratio of the medians for each benchmark, and exits
+with status 1 if any of them got slower by more than --threshold.
+Benchmarks that depend on the number of cells in a notebook run with
+synthetic notebooks of each of --sizes cells.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from intercessor.kernel import Kernel, KernelPool
+from intercessor.serialize import get_serializer
+from intercessor.watch import BaseWatch, StatWatch, InotifyWatch, WatchAlarm, _libc
+from intercessor.notebook import NotebookParser, parse_notebook
+from intercessor.driver import BaseDriver
+from intercessor.cli import DummyCompleter
+
+
+BENCHMARKS = []
+
+
+def benchmark(function):
+    BENCHMARKS.append(function)
+    return function
+
+
+def measure(function, rounds, setup=None):
+    # setup (if given) runs before each round, untimed,
+    # and its return value is passed to function
+    times = []
+    for _ in range(rounds):
+        arg = setup() if setup else None
+        start = time.time()
+        if setup:
+            function(arg)
+        else:
+            function()
+        times.append(time.time() - start)
+    return times
+
+
+def summarize(times, **extra):
+    times = sorted(times)
+    n = len(times)
+    median = times[n // 2] if n % 2 else (times[n // 2 - 1] + times[n // 2]) / 2
+    rv = dict(
+        rounds=n, min=times[0], max=times[-1],
+        median=median, mean=sum(times) / n)
+    rv.update(extra)
+    return rv
+
+
+def make_notebook(cells):
+    # a synthetic notebook; every cell depends on the one before it
+    parts = ['#: cell 0\nx0 = 0\n']
+    for i in range(1, cells):
+        parts.append('#: cell {0}\nx{0} = x{1} + 1\nprint(x{0})\n'.format(i, i - 1))
+    return '\n'.join(parts)
+
+
+# kernel
+
+
+def make_echo():
+    def echo(value=None):
+        return value
+    return echo
+
+
+class Payload(object):
+
+    # pickles its data out of band (like numpy arrays do), if possible
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            import pickle
+            return Payload, (pickle.PickleBuffer(self.data), )
+        return Payload, (bytes(self.data), )
+
+
+@benchmark
+def kernel_start(args):
+    def start():
+        with Kernel(make_echo) as kernel:
+            kernel.wait_ready()
+    yield 'kernel.start', summarize(measure(start, args.rounds))
+
+    with KernelPool(make_echo, size=1) as pool:
+        times = []
+        for _ in range(args.rounds):
+            kernel = pool.get()
+            # let the next standby kernel start, like it would between
+            # restarts in the driver
+            time.sleep(.5)
+            times.append(kernel.handoff_time)
+            kernel.shutdown()
+    yield 'kernel.pool_handoff', summarize(times)
+
+
+@benchmark
+def kernel_calls(args):
+    calls = 1000
+    with Kernel(make_echo) as kernel:
+        kernel.wait_ready()
+
+        def call():
+            for i in range(calls):
+                kernel(i)
+        times = [t / calls for t in measure(call, args.rounds)]
+        yield 'kernel.call_latency', summarize(times)
+
+        for name, size, make in [
+                ('kernel.throughput_in_band', 64 * 1024 ** 2, bytes),
+                ('kernel.throughput_out_of_band', 64 * 1024 ** 2, Payload)]:
+            payload = make(b'x' * size)
+            times = measure(lambda: kernel(payload), args.rounds)
+            yield name, summarize(times, bytes=2 * size)
+
+
+# serializers
+
+
+SERIALIZERS = ['pickle', 'cloudpickle', 'pickle+zlib', 'pickle+lz4', 'cloudpickle+lz4']
+
+
+def serializer_payloads():
+    # name -> value; a cell reply, a lot of text (compresses well),
+    # random bytes (doesn't compress), and a mix of small objects
+    reply = dict(
+        error=None, cached=False, values={},
+        stats=dict(wall_time=.5, cpu_time=.4, max_rss=1024 ** 2))
+    text = ''.join('line {} of the output of some cell\n'.format(i) for i in range(100000))
+    records = [dict(id=i, name='row {}'.format(i), value=i * .5) for i in range(20000)]
+    return [
+        ('reply', reply),
+        ('text', text),
+        ('random', os.urandom(4 * 1024 ** 2)),
+        ('records', records),
+    ]
+
+
+@benchmark
+def serializers(args):
+    # Serializers that are not available (cloudpickle and lz4
+    # are optional) are skipped; throughput is of the pickled data,
+    # size is the serialized size (compressed, if at all).
+    payloads = serializer_payloads()
+    pickled_sizes = dict(
+        (name, len(get_serializer('pickle').dumps(payload))) for name, payload in payloads)
+    for spec in SERIALIZERS:
+        try:
+            serializer = get_serializer(spec)
+        except ValueError:
+            continue
+        for name, payload in payloads:
+            data = serializer.dumps(payload)
+
+            def round_trip():
+                for _ in range(10):
+                    serializer.loads(serializer.dumps(payload))
+            times = [t / 10 for t in measure(round_trip, args.rounds)]
+            yield 'serialize.{}.{}'.format(spec, name), summarize(
+                times, bytes=pickled_sizes[name], size=len(data))
+
+        with Kernel(make_echo, serializer=serializer) as kernel:
+            kernel.wait_ready()
+            for name, payload in payloads[1:]:
+                times = measure(lambda: kernel(payload), args.rounds)
+                yield 'serialize.{}.kernel_{}'.format(spec, name), summarize(times)
+
+
+# watch
+
+
+def watch_lag(watch_class, path, rounds):
+    times = []
+    with open(path, 'w') as f:
+        f.write('')
+    with watch_class(path) as watch:
+        time.sleep(.2)
+        for i in range(rounds):
+            with watch.alarm():
+                try:
+                    start = time.time()
+                    with open(path, 'w') as f:
+                        f.write(str(i))
+                    time.sleep(2)
+                except WatchAlarm:
+                    times.append(time.time() - start)
+            # file systems with coarse mtimes need the next change
+            # to be in another tick
+            time.sleep(.05)
+    return times
+
+
+@benchmark
+def watch(args):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'notebook.py')
+        yield 'watch.stat_lag', summarize(watch_lag(StatWatch, path, args.rounds))
+        if _libc is not None and hasattr(_libc, 'inotify_init1'):
+            yield 'watch.inotify_lag', summarize(watch_lag(InotifyWatch, path, args.rounds))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+# notebook
+
+
+@benchmark
+def notebook(args):
+    for size in args.sizes:
+        text = make_notebook(size)
+        yield 'notebook.parse[{}]'.format(size), summarize(
+            measure(lambda: parse_notebook(text), args.rounds), bytes=len(text))
+
+        # change one line in the middle
+        middle = 'x{0} = x{1} + 1\n'.format(size // 2, size // 2 - 1)
+        edited = text.replace(middle, 'x{0} = x{1} + 2\n'.format(size // 2, size // 2 - 1))
+
+        def setup():
+            parser = NotebookParser()
+            parser.update(text)
+            return parser
+
+        yield 'notebook.update[{}]'.format(size), summarize(
+            measure(lambda parser: parser.update(edited), args.rounds, setup))
+
+
+# driver
+
+
+class NoWatch(BaseWatch):
+
+    # A watch that never notices anything.
+
+    def _start(self):
+        pass
+
+    def _stop(self):
+        pass
+
+
+class BenchmarkDriver(BaseDriver):
+
+    # Edits the notebook, reloads it and runs a cell, commands times.
+    #
+    # read_command() runs with the watch alarm armed, so the notebook
+    # isn't watched, for its writes not to raise WatchAlarm; it reloads
+    # the notebook itself instead.
+
+    def __init__(self, notebook_path, text, commands):
+        super(BenchmarkDriver, self).__init__(notebook_path, DummyCompleter())
+        self.text = text
+        self.commands = commands
+        self.times = []
+        self._start = None
+
+    def read_command(self):
+        if self._start is not None:
+            self.times.append(time.time() - self._start)
+        if len(self.times) >= self.commands:
+            raise EOFError
+        # reloading the edited notebook is part of what's measured
+        self._start = time.time()
+        self.text = self.text.replace('x0 = ', 'x0 = 1 + ', 1)
+        with open(self.notebook_path, 'w') as f:
+            f.write(self.text)
+        self.reload_notebook()
+        return 'cell 0'
+
+    @contextlib.contextmanager
+    def run_watch(self):
+        with NoWatch(self.notebook_path) as watch:
+            self.watch = watch
+            try:
+                yield
+            finally:
+                self.watch = None
+
+
+@benchmark
+def driver(args):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'notebook.py')
+        for size in args.sizes:
+            text = make_notebook(size)
+            with open(path, 'w') as f:
+                f.write(text)
+            driver = BenchmarkDriver(path, text, args.rounds * 10)
+            driver.loop()
+            yield 'driver.command_loop[{}]'.format(size), summarize(driver.times)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = {}
+    for function in BENCHMARKS:
+        if args.filter and not any(f in function.__name__ for f in args.filter):
+            continue
+        for name, result in function(args):
+            results[name] = result
+            line = "{:<36} median {:10.6f}s  min {:10.6f}s".format(
+                name, result['median'], result['min'])
+            if 'bytes' in result:
+                line += "  {:8.1f} MiB/s".format(result['bytes'] / result['median'] / 1024 ** 2)
+            print(line)
+            sys.stdout.flush()
+    return {
+        'meta': {
+            'time': time.time(),
+            'commit': git_commit(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'rounds': args.rounds,
+        },
+        'results': results,
+    }
+
+
+def compare(new, old, threshold):
+    # returns the names of the benchmarks that got slower
+    slower = []
+    print()
+    print("{:<36} {:>12} {:>12} {:>8}".format('', 'old', 'new', 'ratio'))
+    for name in sorted(set(new['results']) & set(old['results'])):
+        old_median = old['results'][name]['median']
+        new_median = new['results'][name]['median']
+        ratio = new_median / old_median if old_median else float('inf')
+        mark = ''
+        if ratio > threshold:
+            mark = 'slower'
+            slower.append(name)
+        elif ratio < 1. / threshold:
+            mark = 'faster'
+        print("{:<36} {:11.6f}s {:11.6f}s {:8.2f} {}".format(
+            name, old_median, new_median, ratio, mark))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--output', metavar='PATH', help="write the results to PATH, as JSON")
+    parser.add_argument(
+        '--compare', metavar='PATH', help="compare with results from PATH")
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help="ratio of the medians above which a benchmark counts as "
+             "slower (default: %(default)s)")
+    parser.add_argument(
+        '--rounds', type=int, default=5, help="(default: %(default)s)")
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 1000, 100000],
+        metavar='CELLS', help="notebook sizes (default: %(default)s)")
+    parser.add_argument(
+        '--filter', action='append', metavar='NAME',
+        help="only run the benchmark groups whose name contains NAME "
+             "(kernel_start, kernel_calls, serializers, watch, notebook, driver)")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(results, old, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from .kernel import Kernel, KernelError, RETURNED, EVENT, UNSERIALIZABLE
+from .serialize import SerializationError
+
+
+class KernelInterrupted(Exception): pass
+
+
+class AsyncKernel(object):
+
+    # asyncio version of Kernel. Calls return futures and can be pipelined:
+    # requests go over the connection as soon as they are made, the kernel
+    # runs them one after another, and replies are matched to futures by
+    # call id. If the kernel dies, all pending futures get a KernelError;
+    # if a request or reply can't be (un)serialized, its future gets
+    # a SerializationError (see Kernel).
+    #
+    # Sends happen in a single worker thread (in order), so a full pipe
+    # doesn't block the event loop. Events (see kernel.emit()) are passed
+    # to on_event, if set.
+    #
+    #     async with AsyncKernel(make_target) as kernel:
+    #         a, b = await asyncio.gather(kernel(1), kernel(2))
+
+    Kernel = Kernel
+
+    def __init__(self, make_target, debug=False, **kwargs):
+        self.kernel = self.Kernel(make_target, debug, **kwargs)
+        self.on_event = None
+        self._call_ids = itertools.count()
+        self._pending = {}
+        self._loop = None
+        self._executor = None
+        self._ready = None
+        self._exited = None
+
+    @property
+    def start_time(self):
+        return self.kernel.start_time
+
+    @property
+    def pid(self):
+        return self.kernel.pid
+
+    async def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._executor = ThreadPoolExecutor(1)
+        self._ready = self._loop.create_future()
+        self._exited = self._loop.create_future()
+
+        self.kernel.start()
+        self._loop.add_reader(self._conn.conn.fileno(), self._on_readable)
+        self._loop.add_reader(self.kernel._process.sentinel, self._on_exit)
+        await self._ready
+
+    @property
+    def _conn(self):
+        return self.kernel._parent_conn
+
+    def _on_readable(self):
+        while not self._conn.closed and self._conn.poll():
+            try:
+                message = self._conn.recv()
+            except EOFError:
+                self._on_exit()
+                return
+            except SerializationError as e:
+                # replies come in call order
+                self._fail_oldest(SerializationError('reply', e.error, e.message))
+                continue
+
+            if not self._ready.done():
+                self.kernel.start_time = message - self.kernel._started_at
+                self._ready.set_result(None)
+                continue
+
+            call_id, status, value = message[:3]
+            if status == UNSERIALIZABLE and call_id is None:
+                # a request the kernel couldn't unpickle; it
+                # handles requests in order, so the oldest one
+                self._fail_oldest(SerializationError(*value))
+                continue
+            future = self._pending.pop(call_id, None)
+            if status == EVENT:
+                if future is not None:
+                    self._pending[call_id] = future
+                if self.on_event:
+                    self.on_event(value)
+                continue
+            if future is None or future.done():
+                continue
+            if status == RETURNED:
+                future.set_result(value)
+            elif status == UNSERIALIZABLE:
+                future.set_exception(SerializationError(*value))
+            else:
+                future.set_exception(KernelInterrupted())
+
+    def _fail_oldest(self, exception):
+        if not self._pending:
+            return
+        call_id = min(self._pending)
+        self._fail(call_id, exception)
+
+    def _fail(self, call_id, exception):
+        future = self._pending.pop(call_id, None)
+        if future is not None and not future.done():
+            future.set_exception(exception)
+
+    def _on_exit(self):
+        # get whatever the kernel sent before exiting
+        self._on_readable()
+
+        if not self._exited.done():
+            self._loop.remove_reader(self._conn.conn.fileno())
+            self._loop.remove_reader(self.kernel._process.sentinel)
+            self._exited.set_result(None)
+
+        futures = list(self._pending.values())
+        if not self._ready.done():
+            futures.append(self._ready)
+        self._pending.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(KernelError("kernel died"))
+
+    def __call__(self, *args, **kwargs):
+        assert self._ready is not None and self._ready.done(), "not started"
+        if self._exited.done():
+            raise KernelError("kernel died")
+        call_id = next(self._call_ids)
+        future = self._loop.create_future()
+        self._pending[call_id] = future
+        self._loop.run_in_executor(self._executor, self._send, (call_id, args, kwargs))
+        return future
+
+    def _send(self, message):
+        # If the kernel is dead, _on_exit() takes care of the futures.
+        # Runs in the executor, so failures go to the future through
+        # the event loop.
+        try:
+            self._conn.send(message)
+        except (IOError, OSError):
+            pass
+        except SerializationError as e:
+            self._loop.call_soon_threadsafe(
+                self._fail, message[0], SerializationError('request', e.error, e.message))
+
+    def interrupt(self):
+        self.kernel.interrupt()
+
+    async def close(self):
+        if not self._exited.done():
+            await self._loop.run_in_executor(self._executor, self._send, None)
+
+    async def join(self):
+        await self._exited
+        self._executor.shutdown()
+        self._conn.close()
+        self.kernel.join()
+
+    def terminate(self):
+        self.kernel.terminate()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        await self.join()
+        return False
@@ -0,0 +1,226 @@
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+import threading
+import contextlib
+from collections import deque
+
+from .driver import BaseDriver, CacheOptions, StatsOptions
+from .cli import DummyCompleter
+from .kernel import KernelError
+
+
+class _NoWatch(object):
+
+    # Batch runs don't reload the notebook; also, the real watches
+    # use signals, which only work in the main thread.
+
+    changed = False
+    changed_paths = frozenset()
+
+    @contextlib.contextmanager
+    def alarm(self):
+        yield
+
+    def watch_paths(self, paths):
+        pass
+
+
+class BatchDriver(BaseDriver):
+
+    # Runs the given cells (all of them, if None) in order, without
+    # prompting; stops at the first cell that fails, unless keep_going
+    # is true. Output goes to the file-like objects in streams
+    # (stream name -> file), with every line prefixed by prefix.
+    #
+    # After loop(), results is a list of dicts (name, error, wall_time,
+    # cpu_time) for the cells that ran, and failed is true if any
+    # of them raised an exception (or the kernel died).
+
+    # shared between drivers running in threads
+    output_lock = threading.Lock()
+
+    def __init__(self, notebook_path, cells=None, keep_going=False,
+                 streams=None, prefix='', report=None, stop=None, **kwargs):
+        kwargs.setdefault('max_output_lines', sys.maxsize)
+        kwargs.setdefault('stats_options', StatsOptions(min_time=0))
+        kwargs.setdefault('watch_modules', False)
+        super(BatchDriver, self).__init__(
+            notebook_path, DummyCompleter(), keep_going=keep_going, **kwargs)
+        self.commands = None if cells is None else list(cells)
+        self.streams = streams or {'stdout': sys.stdout, 'stderr': sys.stderr}
+        self.prefix = prefix
+        # called with (notebook path, result) after each cell
+        self.report = report
+        # a threading.Event; once set, no more cells are run
+        self.stop = stop or threading.Event()
+        self.results = []
+        self.failed = False
+        self._partial = {}
+
+    def add_result(self, name, error=None, stats=None):
+        stats = stats or {}
+        result = dict(
+            name=name, error=error,
+            wall_time=stats.get('wall_time'), cpu_time=stats.get('cpu_time'))
+        self.results.append(result)
+        if error:
+            self.failed = True
+        if self.report:
+            self.report(self.notebook_path, result)
+
+    @contextlib.contextmanager
+    def run_watch(self):
+        self.watch = _NoWatch()
+        try:
+            yield
+        finally:
+            self.watch = None
+
+    def read_command(self):
+        if self.commands is None:
+            self.commands = list(self.cells)
+        if (not self.commands or self.stop.is_set() or
+                (self.failed and not self.keep_going)):
+            raise EOFError
+        return self.commands.pop(0)
+
+    def run_cell(self, name):
+        self.stats = None
+        try:
+            super(BatchDriver, self).run_cell(name)
+        except KernelError:
+            self.add_result(name, 'KernelError')
+            raise
+        if self.runs[name][0] is None:
+            self.add_result(name, self.error or 'Error', self.stats)
+        else:
+            self.add_result(name, None, self.stats)
+
+    def notify_cell_does_not_exist(self, name):
+        self.add_result(name, 'CellDoesNotExist')
+
+    def notify_interrupted(self):
+        self.add_result(self.old_name, 'KeyboardInterrupt')
+        self.stop.set()
+
+    def notify_output(self, stream_name, text):
+        stream = self.streams[stream_name]
+        if not self.prefix:
+            with self.output_lock:
+                stream.write(text)
+                stream.flush()
+            return
+        text = self._partial.pop(stream_name, '') + text
+        lines = text.splitlines(True)
+        if lines and not lines[-1].endswith('\n'):
+            self._partial[stream_name] = lines.pop()
+        with self.output_lock:
+            stream.writelines(self.prefix + line for line in lines)
+            stream.flush()
+
+    def notify_output_collapsed(self, hidden, tail):
+        self.notify_output('stdout', tail)
+
+    def flush_output(self):
+        for stream_name in list(self._partial):
+            self.notify_output(stream_name, '\n')
+
+    def confirm_exit(self):
+        return True
+
+    def confirm_restart(self):
+        self.failed = True
+        return False
+
+
+def run_notebooks(paths, cells=None, jobs=1, keep_going=False, report=None, **kwargs):
+    # Run the notebooks at paths, at most jobs at a time, each in its own
+    # kernel (and thread); returns a list of (path, BatchDriver) tuples,
+    # in paths order. On KeyboardInterrupt (which the kernels get too),
+    # waits for the running cells to end, and doesn't start new ones.
+    queue = deque(enumerate(paths))
+    drivers = [None] * len(paths)
+    stop = threading.Event()
+
+    def work():
+        while not stop.is_set():
+            try:
+                i, path = queue.popleft()
+            except IndexError:
+                break
+            prefix = '{}: '.format(path) if len(paths) > 1 else ''
+            driver = drivers[i] = BatchDriver(
+                path, cells, keep_going, prefix=prefix, report=report,
+                stop=stop, **kwargs)
+            try:
+                driver.loop()
+            except (IOError, OSError) as e:
+                driver.add_result(None, type(e).__name__)
+            finally:
+                driver.flush_output()
+
+    threads = [threading.Thread(target=work) for _ in range(min(jobs, len(paths)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            try:
+                # a timeout makes join() interruptible on Python 2
+                thread.join(.1)
+            except KeyboardInterrupt:
+                stop.set()
+
+    return [(path, driver) for path, driver in zip(paths, drivers) if driver]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='intercessor run',
+        description="Run notebooks without prompting; the exit status "
+                    "is 1 if any cell raised an exception.")
+    parser.add_argument('notebook_paths', metavar='NOTEBOOK', nargs='+')
+    parser.add_argument(
+        '--cell', action='append', dest='cells', metavar='NAME',
+        help="run only this cell (can be given multiple times, "
+             "the cells run in the order given; default: all the cells)")
+    parser.add_argument(
+        '--jobs', type=int, default=1, metavar='N',
+        help="run at most N notebooks at a time (default: %(default)s)")
+    parser.add_argument(
+        '--keep-going', action='store_true',
+        help="keep running cells after one fails")
+    parser.add_argument(
+        '--timings', metavar='PATH',
+        help="write the result and timings of every cell to PATH, as JSON")
+    parser.add_argument(
+        '--cache', metavar='DIR', dest='cache_path',
+        help="use the result cache in DIR (see intercessor --help)")
+    args = parser.parse_args(args)
+
+    def report(path, result):
+        if result['wall_time'] is None:
+            timing = ''
+        else:
+            timing = ' {:.3f}s (cpu {:.3f}s)'.format(result['wall_time'], result['cpu_time'])
+        with BatchDriver.output_lock:
+            print('>>> {}: {!r} {}{}'.format(
+                path, result['name'], result['error'] or 'ok', timing), file=sys.stderr)
+
+    kwargs = {}
+    if args.cache_path:
+        kwargs['cache_options'] = CacheOptions(path=args.cache_path)
+    results = run_notebooks(
+        args.notebook_paths, args.cells, args.jobs, args.keep_going, report, **kwargs)
+
+    if args.timings:
+        with open(args.timings, 'w') as f:
+            json.dump([
+                dict(path=path, failed=driver.failed, cells=driver.results)
+                for path, driver in results
+            ], f, indent=2, sort_keys=True)
+
+    return 1 if any(driver.failed for _, driver in results) else 0
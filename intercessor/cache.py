@@ -0,0 +1,117 @@
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import pickle
+import importlib
+from collections import namedtuple
+
+
+CacheEntry = namedtuple('CacheEntry', 'key size mtime')
+
+
+class ResultCache(object):
+
+    # On-disk cache of the values of the names a cell defined, by key
+    # (see BaseDriver.cache_key()). Each entry is a directory with
+    # a values.pickle file and an .npy file for each numpy array;
+    # modules are stored by name, and imported again on load.
+    #
+    # The total size is bounded; least recently used entries are evicted
+    # first (get() touches the entry directory).
+
+    def __init__(self, path, max_size=1024 ** 3):
+        self.path = path
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            values = self._load(path)
+        except Exception:
+            # truncated, or something it needs can't be imported anymore;
+            # it's a miss, and the entry is of no use
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.utime(path, None)
+        return values
+
+    def _load(self, path):
+        with open(os.path.join(path, 'values.pickle'), 'rb') as f:
+            stored = pickle.load(f)
+        values = {}
+        for name, (kind, value) in stored.items():
+            if kind == 'module':
+                value = importlib.import_module(value)
+            elif kind == 'array':
+                import numpy
+                value = numpy.load(os.path.join(path, value))
+            values[name] = value
+        return values
+
+    def put(self, key, values):
+        # Returns false if any of the values could not be stored;
+        # either all the values of an entry are stored, or none.
+        numpy = sys.modules.get('numpy')
+        stored = {}
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp_path = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        try:
+            for i, (name, value) in enumerate(sorted(values.items())):
+                if isinstance(value, type(sys)):
+                    stored[name] = 'module', value.__name__
+                elif (numpy is not None and isinstance(value, numpy.ndarray)
+                        and not value.dtype.hasobject):
+                    filename = '{}.npy'.format(i)
+                    numpy.save(os.path.join(tmp_path, filename), value)
+                    stored[name] = 'array', filename
+                else:
+                    stored[name] = 'pickle', value
+            with open(os.path.join(tmp_path, 'values.pickle'), 'wb') as f:
+                pickle.dump(stored, f, pickle.HIGHEST_PROTOCOL)
+
+            path = self._entry_path(key)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmp_path, path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return False
+
+        self.evict()
+        return True
+
+    def entries(self):
+        # most recently used first
+        if not os.path.isdir(self.path):
+            return []
+        rv = []
+        for key in os.listdir(self.path):
+            if key.startswith('.'):
+                continue
+            path = self._entry_path(key)
+            size = sum(
+                os.path.getsize(os.path.join(path, name))
+                for name in os.listdir(path))
+            rv.append(CacheEntry(key, size, os.path.getmtime(path)))
+        rv.sort(key=lambda e: e.mtime, reverse=True)
+        return rv
+
+    def evict(self):
+        total = 0
+        for entry in self.entries():
+            total += entry.size
+            if total > self.max_size:
+                shutil.rmtree(self._entry_path(entry.key), ignore_errors=True)
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
@@ -1,20 +1,71 @@
 import sys
+import bisect
+import argparse
 
 try:
     import readline
 except ImportError:
     readline = None
 
-from .driver import Driver
+from .driver import Driver, KernelOptions, CacheOptions, CheckpointOptions
+from .driver import StatsOptions, MemoryLimits, AutoRunOptions
+from .metrics import KernelMetrics
+from .serialize import get_serializer
 
 
 class Completer(object):
 
-    def __init__(self):
+    # Completes cell names and, if get_names is given, the names
+    # defined in the kernel (get_names() returns them).
+    #
+    # words is kept sorted, so the matches for a prefix can be found
+    # by bisection; readline calls us once for every match (state),
+    # so the matches for the last prefix are kept around. Kernel names
+    # are only fetched when needed, and kept until invalidate_names().
+
+    def __init__(self, get_names=None):
         self.words = []
+        self.get_names = get_names
+        self._names = None
+        self._last = None, []
+
+    def update_words(self, added=(), removed=()):
+        if removed:
+            removed = set(removed)
+            self.words = [w for w in self.words if w not in removed]
+        if added:
+            self.words.extend(added)
+            self.words.sort()
+        self._last = None, []
+
+    def invalidate_names(self):
+        self._names = None
+        self._last = None, []
+
+    @staticmethod
+    def _prefixed(words, text):
+        rv = []
+        for i in range(bisect.bisect_left(words, text), len(words)):
+            if not words[i].startswith(text):
+                break
+            rv.append(words[i])
+        return rv
+
+    def matches(self, text):
+        if self._last[0] == text:
+            return self._last[1]
+        matches = self._prefixed(self.words, text)
+        if self.get_names is not None:
+            if self._names is None:
+                self._names = sorted(self.get_names())
+            seen = set(matches)
+            matches.extend(
+                w for w in self._prefixed(self._names, text) if w not in seen)
+        self._last = text, matches
+        return matches
 
     def __call__(self, text, state):
-        matches = [w for w in self.words if w.startswith(text)]
+        matches = self.matches(text)
 
         try:
             rv = matches[state]
@@ -31,14 +82,188 @@ class DummyCompleter(object):
     def __init__(self):
         self.words = []
 
+    def update_words(self, added=(), removed=()):
+        pass
 
-def main():
-    notebook_path = sys.argv[1]
+    def invalidate_names(self):
+        pass
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args[:1] == ['run']:
+        from .batch import main as batch_main
+        sys.exit(batch_main(args[1:]))
+    if args[:1] == ['serve']:
+        from .server import main as server_main
+        sys.exit(server_main(args[1:]))
+
+    parser = argparse.ArgumentParser(
+        prog='intercessor',
+        epilog="Use 'intercessor run --help' for running notebooks "
+               "without prompting, and 'intercessor serve --help' for "
+               "kernels that outlive the driver.")
+    parser.add_argument('notebook_path', metavar='NOTEBOOK')
+    parser.add_argument(
+        '--standby', type=int, default=0, metavar='N',
+        help="keep N kernels started ahead of time, for instant restarts")
+    parser.add_argument(
+        '--preload', action='append', default=[], metavar='MODULE',
+        help="import MODULE once in a fork server, so that new kernels "
+             "start with it already loaded (can be given multiple times)")
+    parser.add_argument(
+        '--cache', metavar='DIR', dest='cache_path',
+        help="cache the names cells define in DIR, and load them from there "
+             "instead of running the cell again, even in a new kernel")
+    parser.add_argument(
+        '--cache-size', type=int, default=1024, metavar='MIB',
+        help="maximum size of the cache (default: %(default)s)")
+    parser.add_argument(
+        '--cache-min-time', type=float, default=1, metavar='SECONDS',
+        help="only cache cells that took at least this long to run "
+             "(default: %(default)s)")
+    parser.add_argument(
+        '--max-output-lines', type=int, default=1000, metavar='N',
+        help="show at most N lines of the output of a cell as it runs; "
+             "the rest is collapsed, and can be seen with !output "
+             "(default: %(default)s)")
+    parser.add_argument(
+        '--jobs', type=int, metavar='N',
+        help="run cells in at most N kernels at a time with !parallel "
+             "(default: the number of CPUs)")
+    parser.add_argument(
+        '--max-checkpoints', type=int, default=4, metavar='N',
+        help="keep at most N kernel checkpoints (taken with !checkpoint) "
+             "at a time (default: %(default)s)")
+    parser.add_argument(
+        '--max-checkpoint-memory', type=int, default=1024, metavar='MIB',
+        help="maximum memory checkpoints can use, on top of what they "
+             "share with the kernel (default: %(default)s)")
+    parser.add_argument(
+        '--profile', action='store_true',
+        help="profile cells with cProfile (see !profile)")
+    parser.add_argument(
+        '--trace-memory', action='store_true',
+        help="trace the memory cells allocate with tracemalloc "
+             "(see !profile)")
+    parser.add_argument(
+        '--stats-min-time', type=float, default=1, metavar='SECONDS',
+        help="show how long a cell took, and how much memory it used, "
+             "if it took at least this long (default: %(default)s)")
+    parser.add_argument(
+        '--metrics', metavar='PATH', dest='metrics_path',
+        help="record how long each kernel call spent pickling, waiting "
+             "and running (see !metrics), and append the records to PATH, "
+             "as JSON lines")
+    parser.add_argument(
+        '--memory-soft-limit', type=int, metavar='MIB',
+        help="warn when the kernel uses more than this much memory (RSS)")
+    parser.add_argument(
+        '--memory-hard-limit', type=int, metavar='MIB',
+        help="interrupt or restart the kernel when it uses more than "
+             "this much memory (RSS)")
+    parser.add_argument(
+        '--memory-limit-action', choices=['interrupt', 'restart'],
+        default='interrupt',
+        help="what to do at the hard limit (default: %(default)s)")
+    parser.add_argument(
+        '--rlimit-as', type=int, metavar='MIB',
+        help="limit the kernel address space (RLIMIT_AS); allocations "
+             "over the limit raise MemoryError")
+    parser.add_argument(
+        '--serializer', metavar='SPEC', default='pickle',
+        help="how to send values to and from the kernel: pickle (highest "
+             "protocol) or cloudpickle (can send lambdas, and classes "
+             "defined in the notebook), optionally followed by +zlib or "
+             "+lz4 to compress large messages, e.g. cloudpickle+lz4 "
+             "(default: %(default)s)")
+    parser.add_argument(
+        '--attach', metavar='SOCKET',
+        help="use the kernel server listening on SOCKET (see intercessor "
+             "serve) instead of starting a kernel; exiting leaves it running")
+    parser.add_argument(
+        '--journal', metavar='PATH', dest='journal_path',
+        help="append a record of the cells run to PATH, so what a kernel ran "
+             "can be replayed after it dies, or after intercessor exits "
+             "(see !recover); without it, the record is kept in memory only")
+    parser.add_argument(
+        '--background', action='store_true',
+        help="run cells in the background, so more can be queued while "
+             "they run (see !queue, !move, !cancel, !wait)")
+    parser.add_argument(
+        '--auto-run', action='store_true',
+        help="when the notebook is saved, run the last cell run again if it "
+             "changed; if it's still running from the last save, interrupt it "
+             "and start over")
+    parser.add_argument(
+        '--auto-run-delay', type=float, default=.3, metavar='SECONDS',
+        help="with --auto-run, wait until the notebook hasn't changed for "
+             "this long (default: %(default)s)")
+    parser.add_argument(
+        '--keep-going', action='store_true',
+        help="with !run, keep running cells after one fails")
+    parser.add_argument(
+        '--complete-names', action='store_true',
+        help="also complete the names defined in the kernel")
+    parser.add_argument(
+        '--no-reload', action='store_false', dest='watch_modules',
+        help="don't reload the modules the notebook imported when their "
+             "source changes")
+    args = parser.parse_args(args)
+
+    try:
+        serializer = get_serializer(args.serializer)
+    except ValueError as e:
+        parser.error(str(e))
 
     completer = Completer() if readline else DummyCompleter()
     if readline:
         readline.set_completer(completer)
         readline.parse_and_bind('tab: complete')
 
-    driver = Driver(notebook_path, completer)
+    metrics = None
+    if args.metrics_path:
+        metrics = KernelMetrics(open(args.metrics_path, 'a'))
+
+    mib = lambda value: value * 1024 ** 2 if value is not None else None
+    rlimits = None
+    if args.rlimit_as is not None:
+        rlimits = {'RLIMIT_AS': (mib(args.rlimit_as), mib(args.rlimit_as))}
+
+    driver = Driver(
+        args.notebook_path, completer,
+        kernel_options=KernelOptions(
+            standby=args.standby,
+            preload=args.preload,
+            rlimits=rlimits),
+        cache_options=CacheOptions(
+            path=args.cache_path,
+            size=args.cache_size * 1024 ** 2,
+            min_time=args.cache_min_time),
+        max_output_lines=args.max_output_lines,
+        jobs=args.jobs,
+        checkpoint_options=CheckpointOptions(
+            max_count=args.max_checkpoints,
+            max_memory=args.max_checkpoint_memory * 1024 ** 2),
+        stats_options=StatsOptions(
+            profile=args.profile,
+            trace_memory=args.trace_memory,
+            min_time=args.stats_min_time),
+        metrics=metrics,
+        memory_limits=MemoryLimits(
+            soft=mib(args.memory_soft_limit),
+            hard=mib(args.memory_hard_limit),
+            action=args.memory_limit_action),
+        watch_modules=args.watch_modules,
+        attach=args.attach,
+        background=args.background,
+        journal_path=args.journal_path,
+        serializer=serializer,
+        keep_going=args.keep_going,
+        auto_run=AutoRunOptions(
+            enabled=args.auto_run,
+            delay=args.auto_run_delay))
+    if readline and args.complete_names:
+        completer.get_names = driver.kernel_names
     driver.loop()
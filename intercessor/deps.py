@@ -0,0 +1,233 @@
+import ast
+from collections import OrderedDict, namedtuple
+
+
+# defines are the global names a cell binds (or deletes), reads are the
+# global names it uses before binding them itself; mutates are the ones
+# it reads that it may change in place (it calls a method of, or sets an
+# attribute or item of), and imports the ones it binds with import.
+CellNames = namedtuple('CellNames', 'defines reads mutates imports')
+
+
+_FUNCTIONS = (ast.FunctionDef, ast.Lambda)
+if hasattr(ast, 'AsyncFunctionDef'):
+    _FUNCTIONS += (ast.AsyncFunctionDef, )
+
+
+def _arg_names(args):
+    for arg in args.args + getattr(args, 'posonlyargs', []) + getattr(args, 'kwonlyargs', []):
+        yield getattr(arg, 'arg', getattr(arg, 'id', None))
+    for arg in (args.vararg, args.kwarg):
+        if arg is not None:
+            yield getattr(arg, 'arg', arg)
+
+
+def _base_name(node):
+    # x for x, x.a, x[i], x.a[i].b, and so on
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _scope_body(node):
+    if isinstance(node, (ast.GeneratorExp, ast.ListComp, ast.SetComp)):
+        return node.generators + [node.elt]
+    if isinstance(node, ast.DictComp):
+        return node.generators + [node.key, node.value]
+    if isinstance(node, ast.Lambda):
+        return [node.body]
+    return node.body
+
+
+class _NameCollector(ast.NodeVisitor):
+
+    # Collects the names a (top-level) statement stores, loads and
+    # mutates. Loads inside nested scopes (functions, lambdas,
+    # comprehensions) count too, minus the names bound in that scope;
+    # this over-estimates what a cell reads (e.g. a local shadowing
+    # a global before use), which only ever means running a cell more
+    # often than needed. The same goes for mutates: any method call
+    # counts, since we can't tell which ones change the object.
+
+    def __init__(self):
+        self.stores = set()
+        self.loads = set()
+        self.mutates = set()
+        self.imports = set()
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.loads.add(node.id)
+        else:
+            self.stores.add(node.id)
+
+    def _visit_target(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            name = _base_name(node)
+            if name is not None:
+                self.mutates.add(name)
+        self.generic_visit(node)
+
+    visit_Attribute = visit_Subscript = _visit_target
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Attribute):
+            name = _base_name(node.func.value)
+            if name is not None:
+                self.mutates.add(name)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self.loads.add(node.target.id)
+        self.generic_visit(node)
+
+    def visit_alias(self, node):
+        name = node.asname or node.name.partition('.')[0]
+        if name != '*':
+            self.stores.add(name)
+            self.imports.add(name)
+
+    def visit_ExceptHandler(self, node):
+        if isinstance(node.name, str):
+            self.stores.add(node.name)
+        self.generic_visit(node)
+
+    def visit_Global(self, node):
+        self.stores.update(node.names)
+
+    def _visit_scope(self, node):
+        # things evaluated in the enclosing scope
+        if isinstance(node, _FUNCTIONS + (ast.ClassDef, )):
+            if not isinstance(node, ast.Lambda):
+                self.stores.add(node.name)
+                for child in node.decorator_list:
+                    self.visit(child)
+        if isinstance(node, ast.ClassDef):
+            for child in node.bases + [k.value for k in node.keywords]:
+                self.visit(child)
+
+        inner = _NameCollector()
+        args = getattr(node, 'args', None)
+        if args is not None:
+            defaults = args.defaults + getattr(args, 'kw_defaults', [])
+            for child in defaults:
+                if child is not None:
+                    self.visit(child)
+            inner.stores.update(_arg_names(args))
+        for child in _scope_body(node):
+            inner.visit(child)
+        self.loads.update(inner.loads - inner.stores)
+        self.mutates.update(inner.mutates - inner.stores)
+
+    visit_FunctionDef = visit_ClassDef = visit_Lambda = _visit_scope
+    visit_AsyncFunctionDef = _visit_scope
+    visit_GeneratorExp = visit_ListComp = visit_SetComp = visit_DictComp = _visit_scope
+
+
+def cell_names(text):
+    # A cell that does not parse defines and reads nothing.
+    try:
+        module = ast.parse(text)
+    except SyntaxError:
+        return CellNames(frozenset(), frozenset(), frozenset(), frozenset())
+
+    defines = set()
+    reads = set()
+    mutates = set()
+    imports = set()
+    for statement in module.body:
+        collector = _NameCollector()
+        collector.visit(statement)
+        reads.update(collector.loads - defines)
+        mutates.update(collector.mutates - defines)
+        defines.update(collector.stores)
+        imports.difference_update(collector.stores)
+        imports.update(collector.imports)
+    return CellNames(
+        frozenset(defines), frozenset(reads), frozenset(mutates), frozenset(imports))
+
+
+class Dependencies(object):
+
+    # Dependency graph of the cells of a notebook: a cell depends on
+    # the closest cell before it that defines a name it reads.
+    #
+    # Names are cached by cell hash, so only cells that changed
+    # are parsed again.
+
+    def __init__(self):
+        self._names = {}
+
+    def names(self, cell):
+        rv = self._names.get(cell.hash)
+        if rv is None:
+            rv = self._names[cell.hash] = cell_names(cell.text)
+        return rv
+
+    def upstream(self, cells):
+        # cells is a name -> Cell mapping, in notebook order;
+        # returns an ordered name -> list of upstream cell names mapping
+        rv = OrderedDict()
+        defined_by = {}
+        positions = {}
+        hashes = set()
+        for position, (name, cell) in enumerate(cells.items()):
+            positions[name] = position
+            hashes.add(cell.hash)
+            names = self.names(cell)
+            rv[name] = sorted(
+                set(defined_by[n] for n in names.reads if n in defined_by),
+                key=positions.get)
+            for n in names.defines:
+                defined_by[n] = name
+
+        # forget about cells that don't exist anymore
+        for hash in set(self._names) - hashes:
+            del self._names[hash]
+
+        return rv
+
+    def ancestors(self, upstream, name):
+        rv = set()
+        stack = [name]
+        while stack:
+            for parent in upstream[stack.pop()]:
+                if parent not in rv:
+                    rv.add(parent)
+                    stack.append(parent)
+        return rv
+
+
+# functions called only for their output, usually
+OUTPUT_FUNCTIONS = frozenset(['print', 'display', 'pprint'])
+
+
+_CONSTANT = getattr(ast, 'Constant', None) or ast.Str
+
+
+def _output_only(statement):
+    if not isinstance(statement, ast.Expr):
+        return False
+    value = statement.value
+    if isinstance(value, ast.Call):
+        if not (isinstance(value.func, ast.Name) and value.func.id in OUTPUT_FUNCTIONS):
+            return False
+        # print(data.pop()) changes data
+        return not any(
+            isinstance(node, (ast.Call, ast.Yield) + _FUNCTIONS)
+            for arg in value.args + [k.value for k in value.keywords]
+            for node in ast.walk(arg))
+    # showing a value (e.g. the last line of a cell in a notebook)
+    return isinstance(value, (ast.Name, ast.Attribute, _CONSTANT))
+
+
+def output_only(text):
+    # True if all a cell does is show things: call print() and the like,
+    # or evaluate names. Anything else may change some state (e.g.
+    # data.append(1) defines nothing, but changes data).
+    try:
+        module = ast.parse(text)
+    except SyntaxError:
+        return False
+    return all(_output_only(statement) for statement in module.body)
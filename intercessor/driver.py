@@ -1,31 +1,272 @@
+import os
+import os.path
+import sys
+import time
+import subprocess
+import shutil
+import tempfile
+import pickle
+import importlib
+import threading
+import multiprocessing
+import marshal
+import pstats
 import traceback
 import contextlib
+import functools
+import hashlib
+import linecache
+import itertools
+from collections import OrderedDict, namedtuple, deque
 
 from .watch import watch_file, WatchAlarm
-from .notebook import parse_notebook
-from .kernel import run_kernel, KernelError
+from .notebook import NotebookParser
+from .deps import Dependencies, cell_names, output_only
+from .cache import ResultCache
+from .output import OutputBuffer, capture_output
+from .instrument import measure
+from .memory import MemoryMonitor, process_rss, largest_objects
+from .reload import user_modules, reload_modules
+from .kernel import KernelPool, KernelError, KernelServer, AttachedKernel, emit
+from .serialize import SerializationError
+from .journal import Journal
 from .utils import echo, prompt, confirm
 
 
+# Per-kernel timing of a parallel run: the cells that ran in the kernel,
+# how many runs it replayed to get the state of the current kernel
+# (none if it was forked from it) and how long that took, and how long
+# the kernel was busy overall.
+ParallelTiming = namedtuple(
+    'ParallelTiming', 'kernel_pid cells replayed replay_time total_time')
+
+
+# Options of the BaseDriver features that have more than one; fields
+# not given get the defaults.
+
+# standby kernels to keep started, modules to preload in the fork
+# server they're started from, resource limits to start them with
+# (resource name -> (soft, hard))
+KernelOptions = namedtuple('KernelOptions', 'standby preload rlimits')
+KernelOptions.__new__.__defaults__ = (0, (), None)
+
+# cache the results of cells that took at least min_time seconds in
+# path (none, if None), with up to size bytes in it
+CacheOptions = namedtuple('CacheOptions', 'path size min_time')
+CacheOptions.__new__.__defaults__ = (None, 1024 ** 3, 1)
+
+# keep at most max_count checkpoints, using up to max_memory bytes
+# (besides the newest one)
+CheckpointOptions = namedtuple('CheckpointOptions', 'max_count max_memory')
+CheckpointOptions.__new__.__defaults__ = (4, 1024 ** 3)
+
+# what Target measures for each run (see instrument.measure()); stats
+# are shown for cells that took at least min_time (always, if profiling)
+StatsOptions = namedtuple('StatsOptions', 'profile trace_memory min_time')
+StatsOptions.__new__.__defaults__ = (False, False, 1)
+
+# kernel RSS limits, in bytes; over the hard limit, the kernel
+# is interrupted or restarted, depending on action
+MemoryLimits = namedtuple('MemoryLimits', 'soft hard action')
+MemoryLimits.__new__.__defaults__ = (None, None, 'interrupt')
+
+# run the last cell again when the notebook is saved with it changed,
+# once it's been quiet for delay seconds
+AutoRunOptions = namedtuple('AutoRunOptions', 'enabled delay')
+AutoRunOptions.__new__.__defaults__ = (False, .3)
+
+
 class BaseDriver(object):
 
-    def __init__(self, notebook_path, completer):
+    def __init__(self, notebook_path, completer, kernel_options=None,
+                 cache_options=None, max_output_lines=1000, jobs=None,
+                 checkpoint_options=None, stats_options=None, metrics=None,
+                 memory_limits=None, watch_modules=True, attach=None,
+                 background=False, journal_path=None, serializer=None,
+                 keep_going=False, auto_run=None):
+        # the *_options arguments (and memory_limits, auto_run) are the
+        # namedtuples above; None for the defaults
         self.notebook_path = notebook_path
         self.completer = completer
+        self.kernel_options = kernel_options or KernelOptions()
+        self.cache_options = cache_options or CacheOptions()
+        if self.cache_options.path is not None:
+            self.cache = ResultCache(self.cache_options.path, self.cache_options.size)
+        else:
+            self.cache = None
         self.old_name = None
         self.cells = None
+        self.parser = None
+        self.deps = Dependencies()
+        # name -> (hash, serial) of the cells run in the current kernel;
+        # serial increases with every run
+        self.runs = {}
+        # With background, the worker changes runs and run_times
+        # (and iterates or pickles them) while the main thread renames
+        # cells in them. Changes are made with the lock held; renames
+        # replace them with renamed copies, so the ones the worker has
+        # don't change under it.
+        self._runs_lock = threading.Lock()
+        self._run_serial = itertools.count()
         self.kernel = None
+        self.kernel_pool = None
         self.watch = None
+        # output of the last cell run
+        self.output = OutputBuffer(max_output_lines)
+        # how many kernels to run cells in parallel in
+        self.jobs = jobs or multiprocessing.cpu_count()
+        # label -> (Checkpoint, what ran in the kernel and journal session
+        # length at the time), oldest first
+        self.checkpoints = OrderedDict()
+        self.checkpoint_options = checkpoint_options or CheckpointOptions()
+        self._checkpoint_dir = None
+        self._checkpoint_serial = itertools.count()
+        self.stats_options = stats_options or StatsOptions()
+        # the stats of the last cell run
+        self.stats = None
+        # the exception type name of the last cell run, or None
+        self.error = None
+        # a metrics.KernelMetrics, to record kernel calls in
+        self.metrics = metrics
+        self.memory_limits = memory_limits or MemoryLimits()
+        assert self.memory_limits.action in ('interrupt', 'restart'), self.memory_limits.action
+        self._restart_kernel = False
+        # reload modules imported in the kernel when their source changes;
+        # module_files is module name -> source file, run_times
+        # is cell name -> how long it took to run, in the current kernel
+        self.watch_modules = watch_modules
+        self.module_files = {}
+        self.run_times = {}
+        # the address of a kernel server (see Kernel.serve()) to use
+        # instead of starting kernels; exiting only detaches from it
+        self.attach = attach
+        # run cells (and commands that use the kernel) in a worker thread,
+        # from a FIFO queue, so we can keep reading commands meanwhile;
+        # running is the command the worker is running, if any
+        self.background = background
+        self.queue = deque()
+        self.running = None
+        self._queue_cond = threading.Condition()
+        self._worker_busy = threading.Lock()
+        self._worker_stopping = False
+        self._worker_error = None
+        # the running command was interrupted to run it again, see auto_run_cell()
+        self._worker_requeued = False
+        # what ran in each kernel; recovery is what to replay
+        # to get the state of the previous one back, see do_recover()
+        self.journal = Journal(journal_path)
+        self.recovery = []
+        # how kernel calls are serialized (see serialize.py); None for pickle
+        self.serializer = serializer
+        # whether !run keeps running cells after one fails
+        self.keep_going = keep_going
+        self.auto_run = auto_run or AutoRunOptions()
+        self._auto_run_hash = None
+
+    @contextlib.contextmanager
+    def run_kernel_pool(self):
+        assert self.kernel_pool is None
+        try:
+            make_target = Target
+            if self.cache is not None:
+                make_target = functools.partial(
+                    Target, self.cache.path, self.cache.max_size,
+                    self.cache_options.min_time)
+            options = self.kernel_options
+            with KernelPool(make_target, options.standby, options.preload,
+                            rlimits=options.rlimits, serializer=self.serializer) as pool:
+                self.kernel_pool = pool
+                yield
+        finally:
+            self.kernel_pool = None
 
     @contextlib.contextmanager
     def run_kernel(self):
         assert self.kernel is None
+        if self.attach is not None:
+            kernel = KernelServer(self.attach).kernel(serializer=self.serializer)
+            kernel.start()
+            self.kernel = kernel
+        else:
+            self.kernel = self.kernel_pool.get()
         try:
-            with run_kernel(Target) as kernel:
-                self.kernel = kernel
-                yield
+            self.kernel.on_event = self.handle_event
+            self.kernel.metrics = self.metrics
+            self.runs = {}
+            self.run_times = {}
+            if self.attach is not None:
+                self.load_kernel_state()
+            else:
+                self.recovery = self.replay_plan(self.journal.start_session())
+            self.completer.invalidate_names()
+            self.module_files = {}
+            if self.watch_modules:
+                self.watch.watch_paths(())
+            self.notify_kernel_started()
+            if self.recovery:
+                self.notify_recoverable(
+                    len(self.recovery), sum(r['wall_time'] or 0 for r in self.recovery))
+            yield
         finally:
-            self.kernel = None
+            # may not be the same kernel anymore, see rewind()
+            kernel, self.kernel = self.kernel, None
+            kernel.on_event = None
+            kernel.shutdown()
+
+    @contextlib.contextmanager
+    def run_memory_monitor(self):
+        limits = self.memory_limits
+        if limits.soft is None and limits.hard is None:
+            yield
+            return
+        monitor = MemoryMonitor(
+            lambda: self.kernel.pid if self.kernel else None,
+            limits.soft, limits.hard,
+            self.notify_memory_soft_limit, self.memory_hard_limit_reached)
+        with monitor:
+            yield
+
+    def memory_hard_limit_reached(self, rss):
+        # called from the monitor thread
+        kernel = self.kernel
+        if kernel is None:
+            return
+        self.notify_memory_hard_limit(rss)
+        if self.memory_limits.action == 'restart':
+            self._restart_kernel = True
+            kernel.terminate()
+        else:
+            kernel.interrupt()
+
+    def load_kernel_state(self):
+        # what the drivers attached before us ran
+        state = self.kernel.call_method('driver_state')
+        self.runs = state.get('runs', {})
+        self.run_times = state.get('run_times', {})
+        self._run_serial = itertools.count(
+            max([serial for _, serial in self.runs.values()] + [-1]) + 1)
+
+    def save_kernel_state(self):
+        if isinstance(self.kernel, AttachedKernel):
+            self.kernel.call_method(
+                'save_driver_state', runs=self.runs, run_times=self.run_times)
+
+    def kernel_names(self):
+        # the names defined in the kernel, for completion
+        if self.kernel is None:
+            return []
+        # the worker may be using the kernel
+        if not self._worker_busy.acquire(False):
+            return []
+        try:
+            return self.kernel.call_method('names')
+        except KernelError:
+            return []
+        finally:
+            self._worker_busy.release()
+
+    def kernel_memory(self):
+        return process_rss(self.kernel.pid) if self.kernel else None
 
     @contextlib.contextmanager
     def run_watch(self):
@@ -37,30 +278,115 @@ class BaseDriver(object):
         finally:
             self.watch = None
 
+    @contextlib.contextmanager
+    def run_worker(self):
+        if not self.background:
+            yield
+            return
+        self._worker_stopping = False
+        self._worker_error = None
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+        try:
+            yield
+        finally:
+            with self._queue_cond:
+                self._worker_stopping = True
+                cancelled = list(self.queue)
+                self.queue.clear()
+                self._queue_cond.notify_all()
+            if cancelled:
+                self.notify_commands_cancelled(cancelled)
+            # let the command running finish
+            while worker.is_alive():
+                worker.join(.1)
+
+    def _work(self):
+        while True:
+            with self._queue_cond:
+                while not self.queue and not self._worker_stopping:
+                    self._queue_cond.wait()
+                if self._worker_stopping:
+                    return
+                command = self.running = self.queue.popleft()
+            try:
+                with self._worker_busy:
+                    self.run_queued(command)
+            except KeyboardInterrupt:
+                with self._queue_cond:
+                    requeued = self._worker_requeued
+                    cancelled = [] if requeued else list(self.queue)
+                    if not requeued:
+                        self.queue.clear()
+                if requeued:
+                    self.notify_auto_run_cancelled(command)
+                else:
+                    self.notify_interrupted()
+                    # the rest probably depends on what got interrupted
+                    if cancelled:
+                        self.notify_commands_cancelled(cancelled)
+            except BaseException as e:
+                # re-raised in the main thread, see check_worker()
+                with self._queue_cond:
+                    self._worker_error = e
+                    self._worker_stopping = True
+                return
+            finally:
+                with self._queue_cond:
+                    self.running = None
+                    self._worker_requeued = False
+                    self._queue_cond.notify_all()
+
+    def check_worker(self):
+        # raise whatever stopped the worker (e.g. KernelError)
+        error, self._worker_error = self._worker_error, None
+        if error is not None:
+            raise error
+
+    def enqueue(self, command):
+        with self._queue_cond:
+            self.queue.append(command)
+            position = len(self.queue)
+            self._queue_cond.notify_all()
+        self.notify_command_queued(command, position)
+
+    def wait_for_queue(self):
+        with self._queue_cond:
+            while (self.queue or self.running is not None) and not self._worker_stopping:
+                # a timeout makes wait() interruptible on Python 2
+                self._queue_cond.wait(.1)
+
     def loop(self):
         self.old_name = None
         self.cells = None
-        with self.run_watch():
-            while True:
-                try:
-                    self.notify_kernel_starting()
-                    with self.run_kernel():
-                        if self.command_loop():
-                            self.notify_kernel_exiting()
+        self.parser = NotebookParser()
+        try:
+            with self.run_watch(), self.run_kernel_pool(), self.run_memory_monitor():
+                while True:
+                    try:
+                        self.notify_kernel_starting()
+                        with self.run_kernel(), self.run_worker():
+                            if self.command_loop():
+                                self.notify_kernel_exiting()
+                                break
+                    except KernelError:
+                        # killed for using too much memory; don't ask
+                        if self._restart_kernel:
+                            self._restart_kernel = False
+                            continue
+                        if not self.confirm_restart():
                             break
-                except KernelError:
-                    if not self.confirm_restart():
-                        break
+        finally:
+            self.output.close()
+            self.close_checkpoints()
+            self.journal.close()
 
     def command_loop(self):
         while True:
             try:
                 if self.watch.changed or self.cells is None:
-                    with open(self.notebook_path) as f:
-                        notebook_text = f.read()
-                    self.cells = parse_notebook(notebook_text)
-                    self.completer.words = list(self.cells)
-                    self.notify_notebook_reloaded()
+                    self.reload_notebook()
 
                 if self.old_name is not None and self.old_name not in self.cells:
                     self.notify_cell_gone()
@@ -76,13 +402,128 @@ class BaseDriver(object):
                     continue
                 except WatchAlarm:
                     self.notify_notebook_changed_during_input()
+                    if self.auto_run.enabled:
+                        self.auto_run_cell()
                     continue
 
                 self.one_command(name)
             except KeyboardInterrupt:
                 self.notify_interrupted()
 
+    def wait_for_quiet(self):
+        # Editors may write a file in more than one go, and people
+        # save more than once in a row; wait for the changes to stop.
+        while self.watch.changed:
+            time.sleep(self.auto_run.delay)
+
+    def auto_run_cell(self):
+        # The notebook changed; run the last cell again if it changed since
+        # it last ran. If the notebook changes again while the cell runs,
+        # interrupt it (the kernel only) and start over. With background,
+        # the cell is queued instead, unless it's queued already; if it's
+        # running, it's interrupted and queued first.
+        while True:
+            self.wait_for_quiet()
+            self.reload_notebook()
+            name = self.old_name
+            cell = self.cells.get(name) if name is not None else None
+            if cell is None or cell.hash in (
+                    self.runs.get(name, (None, ))[0], self._auto_run_hash):
+                return
+            self._auto_run_hash = cell.hash
+            if self.background:
+                with self._queue_cond:
+                    requeue = name == self.running and not self._worker_requeued
+                    if requeue:
+                        self._worker_requeued = True
+                        self.queue.appendleft(name)
+                        # the kernel ignores SIGINT if the cell is done already
+                        self.kernel.interrupt()
+                if requeue:
+                    self.notify_command_queued(name, 1)
+                elif name not in self.queue:
+                    self.enqueue(name)
+                return
+            self.notify_auto_run(name)
+            # Not watch.alarm(): WatchAlarm could be raised anywhere,
+            # e.g. in the middle of reading a reply; interrupt the kernel
+            # instead, and start over once the call returns.
+            changed = []
+
+            def interrupt():
+                if not changed:
+                    changed.append(True)
+                    # the kernel ignores SIGINT if the cell is done already
+                    self.kernel.interrupt()
+
+            try:
+                with self.watch.callback(interrupt):
+                    self.run_cell(name)
+            except KeyboardInterrupt:
+                if not changed:
+                    raise
+            if not changed:
+                return
+            self._auto_run_hash = None
+            self.notify_auto_run_cancelled(name)
+
+    def reload_notebook(self):
+        with open(self.notebook_path) as f:
+            notebook_text = f.read()
+        diff = self.parser.update(notebook_text)
+        if self.background:
+            # the parser updates its cells in place; the worker
+            # may be using them
+            self.cells = OrderedDict(self.parser.cells)
+        else:
+            self.cells = self.parser.cells
+
+        self.completer.update_words(
+            diff.added + [new for _, new in diff.renamed],
+            diff.removed + [old for old, _ in diff.renamed])
+        for old, new in diff.renamed:
+            if self.old_name == old:
+                self.old_name = new
+        if diff.renamed:
+            with self._runs_lock:
+                runs, run_times = dict(self.runs), dict(self.run_times)
+                for old, new in diff.renamed:
+                    if old in runs:
+                        runs[new] = runs.pop(old)
+                    if old in run_times:
+                        run_times[new] = run_times.pop(old)
+                self.runs, self.run_times = runs, run_times
+
+        self.notify_notebook_reloaded(diff)
+
+    # with background, these run right away instead of being queued
+    immediate_commands = frozenset(['queue', 'move', 'cancel', 'wait', 'output', 'metrics'])
+
+    def _command_method(self, name):
+        # Anything starting with ! that is not a cell name is a command,
+        # handled by the do_<command> method (like cmd.Cmd does); returns
+        # the command, the method (None if there's no such command),
+        # and its argument; or None, if name is not a command.
+        if not name.startswith('!') or name in self.cells:
+            return None
+        command, _, arg = name[1:].partition(' ')
+        return command, getattr(self, 'do_' + command, None), arg.strip()
+
     def one_command(self, name):
+        if self.background:
+            self.check_worker()
+
+        parts = self._command_method(name)
+        if parts:
+            command, method, arg = parts
+            if method is None:
+                self.notify_command_does_not_exist(command)
+            elif self.background and command not in self.immediate_commands:
+                self.enqueue(name)
+            else:
+                method(arg)
+            return
+
         if not name:
             if self.old_name is None:
                 return
@@ -93,18 +534,758 @@ class BaseDriver(object):
                 return
             self.old_name = name
 
+        if self.background:
+            self.enqueue(name)
+        else:
+            self.run_cell(name)
+
+    def run_queued(self, name):
+        # the notebook may have changed since name was queued
+        parts = self._command_method(name)
+        if parts:
+            command, method, arg = parts
+            method(arg)
+        elif name not in self.cells:
+            self.notify_cell_does_not_exist(name)
+        else:
+            self.run_cell(name)
+
+    def cache_key(self, name, upstream=None, _keys=None):
+        # The key of a cell is the hash of its text and the keys of
+        # the cells it depends on (so, of all its ancestors).
+        if upstream is None:
+            upstream = self.deps.upstream(self.cells)
+        if _keys is None:
+            _keys = {}
+        if name not in _keys:
+            parts = [self.cells[name].hash]
+            parts.extend(self.cache_key(p, upstream, _keys) for p in upstream[name])
+            _keys[name] = hashlib.sha1(' '.join(parts).encode('utf-8')).hexdigest()
+        return _keys[name]
+
+    def handle_event(self, event):
+        kind, value = event
+        if kind == 'output':
+            for stream_name, text in value:
+                text = self.output.write(text)
+                if text:
+                    self.notify_output(stream_name, text)
+
+    def cell_kwargs(self, name):
+        # Keyword arguments to pass to Target for a cell. The cache is
+        # only used to get a new kernel to the state of the current one;
+        # running a cell again in the same kernel runs it.
+        kwargs = {}
+        if self.cache is not None and name not in self.runs:
+            kwargs.update(
+                cache_key=self.cache_key(name),
+                cache_names=sorted(self.deps.names(self.cells[name]).defines))
+        return kwargs
+
+    def handle_parallel_event(self, event):
+        # output of cells running in parallel is not collapsed
+        kind, value = event
+        if kind == 'output':
+            for stream_name, text in value:
+                self.notify_output(stream_name, text)
+
+    def update_module_watch(self):
+        self.module_files = self.kernel.call_method('loaded_modules')
+        self.watch.watch_paths(self.module_files.values())
+
+    def restart_time(self):
+        # how long a restart would take to get back to the current state
+        return (self.kernel.start_time or 0) + sum(
+            self.run_times.get(name, 0) for name in self.runs)
+
+    def reload_changed_modules(self):
+        paths = self.watch.changed_paths
+        names = sorted(
+            name for name, path in self.module_files.items() if path in paths)
+        if not names:
+            return
+        self.output.start()
+        try:
+            rv = self.kernel.call_method('reload_modules', names)
+        finally:
+            hidden, tail = self.output.finish()
+            if hidden or tail:
+                self.notify_output_collapsed(hidden, tail)
+        self.notify_modules_reloaded(
+            rv['reloaded'], rv['error'], rv['time'], self.restart_time())
+
+    def run_cell(self, name):
+        if self.watch_modules:
+            self.reload_changed_modules()
+        cell = self.cells[name]
+        self.notify_cell_running(name, cell.text)
+        args, kwargs = self.cell_call(name)
+        self.output.start()
+        try:
+            rv = self.kernel(*args, **kwargs)
+        except SerializationError as e:
+            # the cell ran (or not, for requests), but we don't know how it went
+            self.notify_serialization_error(e.where, e.error, e.message)
+            rv = None
+        finally:
+            self.finish_output()
+            if self.checkpoints:
+                self.limit_checkpoints()
+        self.cell_done(name, cell, rv)
+        self.cells_done()
+
+    def run_cells(self, names):
+        # Like run_cell() for each of names, in order, but all in a single
+        # kernel call (see Target.run_cells()); stops after the first cell
+        # that fails, unless keep_going.
+        if self.watch_modules:
+            self.reload_changed_modules()
+        cells = [self.cells[name] for name in names]
+        started = []
+
+        def on_event(event):
+            kind, index = event
+            if kind != 'cell':
+                self.handle_event(event)
+                return
+            if started:
+                self.finish_output()
+            started.append(index)
+            self.notify_cell_running(names[index], cells[index].text)
+            self.output.start()
+
+        self.kernel.on_event = on_event
+        results = None
+        try:
+            results = self.kernel.call_method(
+                'run_cells', [self.cell_call(name) for name in names], self.keep_going)
+        except SerializationError as e:
+            self.notify_serialization_error(e.where, e.error, e.message)
+        finally:
+            self.kernel.on_event = self.handle_event
+            if started:
+                self.finish_output()
+            if self.checkpoints:
+                self.limit_checkpoints()
+            if results is None:
+                # Interrupted, or the results didn't make it back; the cells
+                # that started did run, but we don't know how it went.
+                for index in started:
+                    self.cell_done(names[index], cells[index], None)
+                self.completer.invalidate_names()
+        if results is None:
+            return
+
+        for name, cell, rv in zip(names, cells, results):
+            self.cell_done(name, cell, rv)
+        self.cells_done()
+        if len(results) < len(names):
+            self.notify_cells_not_run(names[len(results) - 1], names[len(results):])
+
+    def cell_call(self, name):
+        # the arguments to run a cell with in the kernel
         cell = self.cells[name]
+        kwargs = self.cell_kwargs(name)
+        kwargs.update(
+            profile=self.stats_options.profile,
+            trace_memory=self.stats_options.trace_memory)
+        return (cell.text, os.path.abspath(self.notebook_path), cell.lineno), kwargs
+
+    def finish_output(self):
+        hidden, tail = self.output.finish()
+        if hidden or tail:
+            self.notify_output_collapsed(hidden, tail)
+
+    def cell_done(self, name, cell, rv):
+        # Record the run of a cell (rv is what the kernel returned,
+        # None if we don't know).
+        self.error = rv['error'] if rv else None
+        if rv and rv.get('cached'):
+            self.notify_cell_cached(name)
+        if rv and rv.get('stats'):
+            self.stats = rv['stats']
+            options = self.stats_options
+            if (options.profile or options.trace_memory or
+                    self.stats['wall_time'] >= options.min_time):
+                self.notify_cell_stats(name, self.stats)
+        # a cell that raised an exception counts as run, but with
+        # a hash that can't match, so it's always stale
+        with self._runs_lock:
+            self.runs[name] = (
+                cell.hash if rv and not rv['error'] else None,
+                next(self._run_serial))
+            if rv and rv.get('stats'):
+                self.run_times[name] = rv['stats']['wall_time']
+        self.journal.record_run(
+            name, cell.hash, cell.text, cell.lineno,
+            self.run_times.get(name) if rv and rv.get('stats') else None,
+            self.error)
+
+    def cells_done(self):
+        # after one or more cells ran
+        self.completer.invalidate_names()
+        if self.attach is not None:
+            self.save_kernel_state()
+        if self.watch_modules:
+            self.update_module_watch()
+
+    def independent_cells(self, names):
+        # Split names into the cells that can run in parallel, and the rest
+        # (to run serially, after them); both in notebook order. Two cells
+        # conflict if one depends on the other, or one defines a name
+        # the other one reads or defines; a cell can run in parallel
+        # only if it does not conflict with any cell before it.
+        #
+        # Only the names a cell defines are loaded back from the worker,
+        # so cells that define none, or may change something they read
+        # in place (modules don't count), always run serially.
+        upstream = self.deps.upstream(self.cells)
+        wanted = set(names)
+        names = [n for n in self.cells if n in wanted]
+        ancestors = dict((n, self.deps.ancestors(upstream, n)) for n in names)
+        cell_names = dict((n, self.deps.names(self.cells[n])) for n in names)
+
+        # whether each name was last defined by an import, in notebook order
+        imported = {}
+        mutates = {}
+        for name, cell in self.cells.items():
+            names_ = self.deps.names(cell)
+            if name in wanted:
+                mutates[name] = set(n for n in names_.mutates if not imported.get(n))
+            for n in names_.defines:
+                imported[n] = n in names_.imports
+
+        def conflict(one, two):
+            one_names, two_names = cell_names[one], cell_names[two]
+            return (
+                one in ancestors[two] or two in ancestors[one] or
+                one_names.defines & (two_names.defines | two_names.reads) or
+                one_names.reads & two_names.defines)
+
+        parallel, serial = [], []
+        for i, name in enumerate(names):
+            if not cell_names[name].defines or mutates[name]:
+                serial.append(name)
+            elif any(conflict(name, other) for other in names[:i]):
+                serial.append(name)
+            else:
+                parallel.append(name)
+        return parallel, serial
+
+    def run_parallel(self, names):
+        # Run independent cells in separate kernels (with the state of
+        # the current one, see worker_kernels()), then load the names
+        # they defined into the current kernel. Cells that are not
+        # independent (or whose names can't be pickled) run serially,
+        # in the current kernel.
+        parallel, serial = self.independent_cells(names)
+        if len(parallel) < 2:
+            parallel, serial = [], parallel + serial
+        if parallel:
+            self.notify_parallel_starting(parallel, serial)
+            results, timings = self._run_in_workers(parallel)
+            self.notify_parallel_done(timings)
+
+            filename = os.path.abspath(self.notebook_path)
+            for name in parallel:
+                rv = results.get(name)
+                cell = self.cells[name]
+                if rv is None:
+                    continue
+                if rv['error']:
+                    with self._runs_lock:
+                        self.runs[name] = (None, next(self._run_serial))
+                elif rv.get('not_exported'):
+                    self.notify_cell_not_exported(name, rv['not_exported'])
+                    serial.append(name)
+                elif self.kernel(
+                        cell.text, filename, cell.lineno, values=rv.get('values', {})
+                        )['error']:
+                    self.notify_cell_not_exported(name, sorted(rv['values']))
+                    serial.append(name)
+                else:
+                    with self._runs_lock:
+                        self.runs[name] = (cell.hash, next(self._run_serial))
+                    self.journal.record_run(
+                        name, cell.hash, cell.text, cell.lineno,
+                        rv.get('stats', {}).get('wall_time'))
+            if self.attach is not None:
+                self.save_kernel_state()
+
+        for name in sorted(serial, key=lambda n: self.cells[n].offset):
+            self.run_cell(name)
+
+    def _run_in_workers(self, names):
+        filename = os.path.abspath(self.notebook_path)
+        # everything the worker threads need, computed here
+        calls = OrderedDict()
+        for name in names:
+            cell = self.cells[name]
+            kwargs = self.cell_kwargs(name)
+            kwargs['return_names'] = sorted(self.deps.names(cell).defines)
+            calls[name] = (cell.text, filename, cell.lineno), kwargs
+        with self.worker_kernels(min(self.jobs, len(names))) as (kernels, plan):
+            return self._work_in_kernels(kernels, plan, calls)
+
+    def _work_in_kernels(self, kernels, plan, calls):
+        # run calls (name -> kernel call arguments), spread over kernels,
+        # each of them replaying plan first; returns the results and timings
+        filename = os.path.abspath(self.notebook_path)
+        replay = [(r['text'], filename, r['lineno']) for r in plan]
+        queue = deque(calls)
+        results = {}
+        timings = {}
+        output_lock = threading.Lock()
+
+        def on_event(event):
+            with output_lock:
+                self.handle_parallel_event(event)
+
+        def work(index, kernel):
+            ran = []
+            replayed = 0
+            start = time.time()
+            replay_time = 0
+            kernel.metrics = self.metrics
+            try:
+                while True:
+                    if queue and replay and not replayed:
+                        # its output was shown when it ran the first time
+                        rv = kernel.call_method('replay', replay)
+                        replay_time = time.time() - start
+                        if rv['error']:
+                            # leave the cells to the other workers
+                            break
+                        replayed = len(replay)
+                    kernel.on_event = on_event
+                    try:
+                        name = queue.popleft()
+                    except IndexError:
+                        break
+                    args, kwargs = calls[name]
+                    try:
+                        results[name] = kernel(*args, **kwargs)
+                    except KernelError:
+                        results[name] = {'error': 'KernelError'}
+                        raise
+                    except SerializationError as e:
+                        with output_lock:
+                            self.notify_serialization_error(e.where, e.error, e.message)
+                        results[name] = {'error': 'SerializationError'}
+                    ran.append(name)
+            except (KernelError, KeyboardInterrupt):
+                pass
+            timings[index] = ParallelTiming(
+                kernel.pid, ran, replayed, replay_time, time.time() - start)
+
+        threads = [
+            threading.Thread(target=work, args=(i, k))
+            for i, k in enumerate(kernels)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            queue.clear()
+            for kernel in kernels:
+                kernel.interrupt()
+            for thread in threads:
+                thread.join()
+            raise
+
+        return results, [timings[i] for i in sorted(timings)]
+
+    @contextlib.contextmanager
+    def worker_kernels(self, count):
+        # Yields count kernels with the state of the current one, forked
+        # from a checkpoint of it, and an empty plan; if it can't take
+        # one, new kernels, and the plan they need to replay to get the
+        # state (the whole session, since cells change objects in place).
+        # The kernels are shut down after.
+        checkpoint = None
+        if hasattr(os, 'fork'):
+            checkpoint = self.kernel.checkpoint(self._checkpoint_address())
+        kernels = []
+        try:
+            plan = []
+            try:
+                for _ in range(count if checkpoint else 0):
+                    kernels.append(checkpoint.kernel(serializer=self.serializer))
+                    kernels[-1].start()
+                for kernel in kernels:
+                    kernel.wait_ready()
+            except KernelError:
+                for kernel in kernels:
+                    kernel.shutdown()
+                kernels = []
+            if not kernels:
+                kernels = self.kernel_pool.get_many(count)
+                plan = self.replay_plan(self.journal.session)
+            yield kernels, plan
+        finally:
+            for kernel in kernels:
+                kernel.shutdown()
+            # after the kernels exit, since it reaps them
+            if checkpoint is not None:
+                checkpoint.close()
+
+    def _checkpoint_address(self):
+        if self._checkpoint_dir is None:
+            self._checkpoint_dir = tempfile.mkdtemp(prefix='intercessor-checkpoints-')
+        return os.path.join(
+            self._checkpoint_dir, '{}.sock'.format(next(self._checkpoint_serial)))
+
+    def take_checkpoint(self, label):
+        checkpoint = self.kernel.checkpoint(self._checkpoint_address())
+        if checkpoint is None:
+            self.notify_checkpoint_failed(label)
+            return
+        if label in self.checkpoints:
+            self.checkpoints.pop(label)[0].close()
+        # what ran in the kernel so far, to get it back on rewind
+        with self._runs_lock:
+            state = dict(
+                runs=dict(self.runs), run_times=dict(self.run_times),
+                module_files=dict(self.module_files))
+        self.checkpoints[label] = checkpoint, state, len(self.journal.session)
+        self.notify_checkpoint_taken(label)
+        self.limit_checkpoints()
+
+    def checkpoint_memory(self):
+        return sum(c.memory() or 0 for c, _, _ in self.checkpoints.values())
+
+    def limit_checkpoints(self):
+        # Drop the oldest checkpoints while over the limits;
+        # the newest one is always kept. Checkpoints use more memory
+        # the more the kernel changes after them.
+        while self.checkpoints and (
+                len(self.checkpoints) > self.checkpoint_options.max_count or (
+                    len(self.checkpoints) > 1 and
+                    self.checkpoint_memory() > self.checkpoint_options.max_memory)):
+            label, (checkpoint, _, _) = self.checkpoints.popitem(last=False)
+            checkpoint.close()
+            self.notify_checkpoint_dropped(label)
+
+    def rewind(self, label):
+        # Replace the kernel with one forked from the checkpoint;
+        # the checkpoint stays, so we can rewind to it again.
+        checkpoint, state, journal_length = self.checkpoints[label]
+        start = time.time()
+        kernel = checkpoint.kernel(serializer=self.serializer)
+        try:
+            kernel.start()
+            kernel.wait_ready()
+        except KernelError:
+            del self.checkpoints[label]
+            checkpoint.close()
+            self.notify_checkpoint_gone(label)
+            return
+
+        old_kernel, self.kernel = self.kernel, kernel
+        kernel.on_event = self.handle_event
+        kernel.metrics = self.metrics
+        with self._runs_lock:
+            self.runs = dict(state['runs'])
+            self.run_times = dict(state['run_times'])
+        self.module_files = dict(state['module_files'])
+        if self.watch_modules:
+            self.watch.watch_paths(self.module_files.values())
+        self.journal.rewind(journal_length)
+        self.completer.invalidate_names()
+        old_kernel.on_event = None
+        old_kernel.shutdown()
+        self.notify_rewound(label, time.time() - start)
+
+    def replay_plan(self, runs):
+        # The runs (journal records) to replay to get the state of a kernel
+        # that did runs back: those that didn't fail, and may have changed
+        # something (output_only() is conservative about it).
+        #
+        # A run is also left out if a later run of the same cell redefines
+        # everything it defines without reading it, it changes nothing in
+        # place, and no run in between reads what it defines; e.g. all but
+        # the last of a cell edited and run over and over.
+        plan = [
+            r for r in runs
+            if not r.get('error') and not output_only(r['text'])]
+
+        names = {}
+        for r in plan:
+            if r['text'] not in names:
+                names[r['text']] = cell_names(r['text'])
+
+        superseded = set()
+        for i, r in enumerate(plan):
+            these = names[r['text']]
+            if not these.defines or these.mutates:
+                continue
+            for later in plan[i+1:]:
+                later_names = names[later['text']]
+                if later['name'] == r['name']:
+                    if (these.defines <= later_names.defines and
+                            not these.defines & later_names.reads):
+                        superseded.add(i)
+                    break
+                if these.defines & later_names.reads:
+                    break
 
-        self.notify_cell_running(name, cell)
-        self.kernel(cell)
+        return [r for i, r in enumerate(plan) if i not in superseded]
+
+    def replay(self, plan):
+        # Run the plan in the kernel, in a single call; the kernel
+        # tells us after every cell, so we can show the progress, with
+        # an estimate of what's left based on the times in the plan.
+        filename = os.path.abspath(self.notebook_path)
+        total = sum(r['wall_time'] or 0 for r in plan)
+        start = time.time()
+
+        def on_event(event):
+            kind, done = event
+            if kind != 'replay':
+                self.handle_event(event)
+                return
+            elapsed = time.time() - start
+            expected = sum(r['wall_time'] or 0 for r in plan[:done])
+            # as fast (or slow) as it's been going so far
+            remaining = (total - expected) * (elapsed / expected if expected else 1)
+            self.notify_replay_progress(done, len(plan), elapsed, remaining)
+
+        self.kernel.on_event = on_event
+        self.output.start()
+        try:
+            rv = self.kernel.call_method(
+                'replay', [(r['text'], filename, r['lineno']) for r in plan])
+        finally:
+            self.kernel.on_event = self.handle_event
+            hidden, tail = self.output.finish()
+            if hidden or tail:
+                self.notify_output_collapsed(hidden, tail)
+
+        wall_times = rv['wall_times']
+        for i, record in enumerate(plan[:len(wall_times) + bool(rv['error'])]):
+            error = rv['error'] if i == len(wall_times) else None
+            self.journal.record_run(
+                record['name'], record['hash'], record['text'], record['lineno'],
+                None if error else wall_times[i], error)
+            # cells changed (or gone) since are stale
+            cell = self.cells.get(record['name'])
+            if cell is not None:
+                with self._runs_lock:
+                    self.runs[record['name']] = (
+                        cell.hash if cell.hash == record['hash'] and not error else None,
+                        next(self._run_serial))
+        failed = plan[len(wall_times)]['name'] if rv['error'] else None
+        self.notify_replay_done(len(wall_times), time.time() - start, rv['error'], failed)
+
+    def close_checkpoints(self):
+        while self.checkpoints:
+            self.checkpoints.popitem()[1][0].close()
+        if self._checkpoint_dir is not None:
+            shutil.rmtree(self._checkpoint_dir, ignore_errors=True)
+            self._checkpoint_dir = None
+
+    def stale_cells(self, name=None):
+        # Cells that ran in the current kernel, but whose source changed
+        # since, or that depend on cells that are stale or ran after them;
+        # in notebook order. If name is given, only consider it and
+        # the cells it depends on.
+        upstream = self.deps.upstream(self.cells)
+        if name is not None:
+            candidates = self.deps.ancestors(upstream, name)
+            candidates.add(name)
+        else:
+            candidates = upstream
+
+        rv = OrderedDict()
+        for cell_name, cell in self.cells.items():
+            run = self.runs.get(cell_name)
+            if run is None or cell_name not in candidates:
+                continue
+            hash, serial = run
+            if hash != cell.hash or any(
+                    parent in rv or self.runs.get(parent, (None, -1))[1] > serial
+                    for parent in upstream[cell_name]):
+                rv[cell_name] = cell
+        return list(rv)
+
+    def do_cache(self, arg):
+        if self.cache is None:
+            self.notify_cache_disabled()
+        elif arg == 'clear':
+            self.cache.clear()
+            self.notify_cache_cleared()
+        elif not arg:
+            self.notify_cache_entries(self.cache.entries())
+        else:
+            self.notify_command_does_not_exist('cache ' + arg)
+
+    def do_output(self, arg):
+        # !output pages the output of the last cell run,
+        # !output save PATH saves it to PATH
+        command, _, path = arg.partition(' ')
+        if self.output.path is None:
+            self.notify_no_output()
+        elif not command:
+            self.page_output(self.output.path)
+        elif command == 'save' and path.strip():
+            self.output.save(path.strip())
+            self.notify_output_saved(path.strip())
+        else:
+            self.notify_command_does_not_exist('output ' + arg)
+
+    def parse_cell_names(self, arg):
+        # Comma-separated cell names, or ranges of them (FIRST..LAST,
+        # in notebook order); None if any of them does not exist.
+        names = []
+        order = list(self.cells)
+        for part in (p.strip() for p in arg.split(',')):
+            first, sep, last = part.partition('..')
+            if not part:
+                continue
+            if part in self.cells or not sep:
+                first = last = part
+            bounds = first.strip(), last.strip()
+            for name in bounds:
+                if name not in self.cells:
+                    self.notify_cell_does_not_exist(name)
+                    return None
+            start, end = sorted(order.index(name) for name in bounds)
+            names.extend(order[start:end + 1])
+        return names
+
+    def do_run(self, arg):
+        names = self.parse_cell_names(arg)
+        if names:
+            self.run_cells(names)
+
+    def do_parallel(self, arg):
+        names = self.parse_cell_names(arg)
+        if names:
+            self.run_parallel(names)
+
+    def do_checkpoint(self, arg):
+        # labelled after the last cell run, by default
+        self.take_checkpoint(arg or self.old_name or 'checkpoint')
+
+    def do_checkpoints(self, arg):
+        self.notify_checkpoints(
+            [(label, c.memory()) for label, (c, _, _) in self.checkpoints.items()])
+
+    def do_rewind(self, arg):
+        if not self.checkpoints:
+            self.notify_no_checkpoints()
+            return
+        label = arg or next(reversed(self.checkpoints))
+        if label not in self.checkpoints:
+            self.notify_checkpoint_does_not_exist(label)
+            return
+        self.rewind(label)
+
+    def do_profile(self, arg):
+        # !profile shows the profile of the last cell run,
+        # !profile PATH saves it in pstats format
+        if not self.stats or not (self.stats.get('profile') or self.stats.get('memory_top')):
+            self.notify_no_profile()
+        elif arg:
+            if not self.stats.get('profile'):
+                self.notify_no_profile()
+                return
+            with open(arg, 'wb') as f:
+                f.write(self.stats['profile'])
+            self.notify_profile_saved(arg)
+        else:
+            self.notify_profile(self.stats)
+
+    def do_memory(self, arg):
+        # the largest objects in the kernel namespace
+        self.notify_memory(
+            self.kernel_memory(), self.kernel.call_method('largest_objects'))
+
+    def do_metrics(self, arg):
+        if self.metrics is None:
+            self.notify_metrics_disabled()
+        else:
+            self.notify_metrics(self.metrics.snapshot())
+
+    def parse_queue_position(self, arg):
+        # 1-based position in the queue -> index, or None if invalid
+        try:
+            index = int(arg) - 1
+        except ValueError:
+            return None
+        return index if 0 <= index < len(self.queue) else None
+
+    def do_queue(self, arg):
+        with self._queue_cond:
+            running, pending = self.running, list(self.queue)
+        self.notify_queue(running, pending)
+
+    def do_move(self, arg):
+        # !move FROM TO moves the queue entry at position FROM to TO
+        source, _, destination = arg.partition(' ')
+        with self._queue_cond:
+            source = self.parse_queue_position(source)
+            destination = self.parse_queue_position(destination.strip())
+            if source is not None and destination is not None:
+                command = self.queue[source]
+                del self.queue[source]
+                self.queue.insert(destination, command)
+        if source is None or destination is None:
+            self.notify_no_queue_entry(arg)
+            return
+        self.do_queue('')
+
+    def do_cancel(self, arg):
+        # !cancel POSITION cancels one queue entry, !cancel all of them
+        with self._queue_cond:
+            if not arg:
+                cancelled = list(self.queue)
+                self.queue.clear()
+            else:
+                index = self.parse_queue_position(arg)
+                cancelled = [] if index is None else [self.queue[index]]
+                if index is not None:
+                    del self.queue[index]
+        if arg and not cancelled:
+            self.notify_no_queue_entry(arg)
+            return
+        self.notify_commands_cancelled(cancelled)
+
+    def do_wait(self, arg):
+        self.wait_for_queue()
+        self.check_worker()
+
+    def do_recover(self, arg):
+        # replay what the previous kernel ran (see replay_plan())
+        if not self.recovery:
+            self.notify_nothing_to_recover()
+            return
+        plan, self.recovery = self.recovery, []
+        self.replay(plan)
+
+    def do_stale(self, arg):
+        if arg and arg not in self.cells:
+            self.notify_cell_does_not_exist(arg)
+            return
+        names = self.stale_cells(arg or None)
+        if not names:
+            self.notify_nothing_stale()
+            return
+        for name in names:
+            self.run_cell(name)
 
     def notify_kernel_starting(self):
         pass
 
+    def notify_kernel_started(self):
+        pass
+
     def notify_kernel_exiting(self):
         pass
 
-    def notify_notebook_reloaded(self):
+    def notify_notebook_reloaded(self, diff):
         pass
 
     def notify_notebook_changed_during_input(self):
@@ -119,9 +1300,141 @@ class BaseDriver(object):
     def notify_cell_running(self, name, cell):
         pass
 
+    def notify_command_does_not_exist(self, command):
+        pass
+
+    def notify_nothing_stale(self):
+        pass
+
+    def notify_cell_cached(self, name):
+        pass
+
+    def notify_cache_disabled(self):
+        pass
+
+    def notify_cache_cleared(self):
+        pass
+
+    def notify_cache_entries(self, entries):
+        pass
+
+    def notify_output(self, stream_name, text):
+        pass
+
+    def notify_output_collapsed(self, hidden, tail):
+        pass
+
+    def notify_no_output(self):
+        pass
+
+    def notify_output_saved(self, path):
+        pass
+
+    def notify_parallel_starting(self, parallel, serial):
+        pass
+
+    def notify_parallel_done(self, timings):
+        pass
+
+    def notify_cell_not_exported(self, name, names):
+        pass
+
+    def notify_serialization_error(self, where, error, message):
+        pass
+
+    def notify_cells_not_run(self, failed, names):
+        pass
+
+    def notify_auto_run(self, name):
+        pass
+
+    def notify_auto_run_cancelled(self, name):
+        pass
+
+    def notify_checkpoint_taken(self, label):
+        pass
+
+    def notify_checkpoint_failed(self, label):
+        pass
+
+    def notify_checkpoint_dropped(self, label):
+        pass
+
+    def notify_checkpoint_gone(self, label):
+        pass
+
+    def notify_checkpoint_does_not_exist(self, label):
+        pass
+
+    def notify_no_checkpoints(self):
+        pass
+
+    def notify_checkpoints(self, checkpoints):
+        pass
+
+    def notify_rewound(self, label, duration):
+        pass
+
+    def notify_cell_stats(self, name, stats):
+        pass
+
+    def notify_no_profile(self):
+        pass
+
+    def notify_profile(self, stats):
+        pass
+
+    def notify_profile_saved(self, path):
+        pass
+
+    def notify_metrics_disabled(self):
+        pass
+
+    def notify_metrics(self, snapshot):
+        pass
+
+    def notify_memory_soft_limit(self, rss):
+        pass
+
+    def notify_memory_hard_limit(self, rss):
+        pass
+
+    def notify_memory(self, rss, objects):
+        pass
+
+    def notify_modules_reloaded(self, modules, error, duration, restart_time):
+        pass
+
+    def notify_command_queued(self, command, position):
+        pass
+
+    def notify_queue(self, running, pending):
+        pass
+
+    def notify_commands_cancelled(self, commands):
+        pass
+
+    def notify_no_queue_entry(self, arg):
+        pass
+
+    def notify_recoverable(self, count, duration):
+        pass
+
+    def notify_nothing_to_recover(self):
+        pass
+
+    def notify_replay_progress(self, done, total, elapsed, remaining):
+        pass
+
+    def notify_replay_done(self, count, duration, error, failed):
+        pass
+
     def notify_interrupted(self):
         pass
 
+    def page_output(self, path):
+        pass
+
     def read_command(self):
         return prompt(':')
 
@@ -137,11 +1450,32 @@ class Driver(BaseDriver):
     def notify_kernel_starting(self):
         echo(">>> starting kernel")
 
+    def notify_kernel_started(self):
+        kernel = self.kernel
+        if self.attach is not None:
+            echo(">>> attached to the kernel at {} ({} cells run)".format(
+                self.attach, len(self.runs)))
+        elif kernel.handoff_time < kernel.start_time:
+            echo(">>> kernel ready in {:.3f}s (cold start took {:.3f}s)".format(
+                kernel.handoff_time, kernel.start_time))
+        else:
+            echo(">>> kernel ready in {:.3f}s".format(kernel.handoff_time))
+
     def notify_kernel_exiting(self):
-        echo(">>> waiting for kernel to exit")
+        if self.attach is not None:
+            echo(">>> detaching; the kernel keeps running at {}".format(self.attach))
+        else:
+            echo(">>> waiting for kernel to exit")
 
-    def notify_notebook_reloaded(self):
-        echo(">>> reloaded notebook")
+    def notify_notebook_reloaded(self, diff):
+        changes = [
+            '{} {}'.format(len(names), label)
+            for names, label in zip(diff, diff._fields) if names
+        ]
+        if changes:
+            echo(">>> reloaded notebook ({})".format(', '.join(changes)))
+        else:
+            echo(">>> reloaded notebook")
 
     def notify_notebook_changed_during_input(self):
         echo()
@@ -156,11 +1490,223 @@ class Driver(BaseDriver):
         echo('>>> running {!r}'.format(name))
         echo('\n'.join('... ' + l for l in cell.splitlines()))
 
+    def notify_command_does_not_exist(self, command):
+        echo(">>> command does not exist:", command)
+
+    def notify_nothing_stale(self):
+        echo(">>> no stale cells")
+
+    def notify_cell_cached(self, name):
+        echo(">>> loaded {!r} from cache".format(name))
+
+    def notify_cache_disabled(self):
+        echo(">>> cache not enabled")
+
+    def notify_cache_cleared(self):
+        echo(">>> cleared cache")
+
+    def notify_cache_entries(self, entries):
+        total = sum(e.size for e in entries)
+        echo(">>> cache: {} entries, {:.1f} MiB (max {:.1f} MiB)".format(
+            len(entries), total / 1024. ** 2, self.cache.max_size / 1024. ** 2))
+        for entry in entries:
+            echo("... {}  {:10.1f} KiB  {}".format(
+                entry.key[:12], entry.size / 1024.,
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.mtime))))
+
+    def notify_output(self, stream_name, text):
+        stream = sys.stderr if stream_name == 'stderr' else sys.stdout
+        stream.write(text)
+        stream.flush()
+
+    def notify_output_collapsed(self, hidden, tail):
+        if hidden:
+            echo(">>> ... {} lines hidden (see !output) ...".format(hidden))
+        sys.stdout.write(tail)
+        sys.stdout.flush()
+
+    def notify_no_output(self):
+        echo(">>> no output")
+
+    def notify_output_saved(self, path):
+        echo(">>> saved output to", path)
+
+    def notify_parallel_starting(self, parallel, serial):
+        echo(">>> running in parallel in {} kernels: {}".format(
+            min(self.jobs, len(parallel)), ', '.join(map(repr, parallel))))
+        if serial:
+            echo(">>> then serially: {}".format(', '.join(map(repr, serial))))
+
+    def notify_parallel_done(self, timings):
+        for timing in timings:
+            echo(">>> kernel {}: ran {} in {:.3f}s (replayed {} cells in {:.3f}s)".format(
+                timing.kernel_pid, ', '.join(map(repr, timing.cells)) or 'nothing',
+                timing.total_time, timing.replayed, timing.replay_time))
+
+    def notify_cell_not_exported(self, name, names):
+        echo(">>> can't load {} from parallel run of {!r}; running it again".format(
+            ', '.join(names), name))
+
+    def notify_auto_run(self, name):
+        echo(">>> {!r} changed, running it again".format(name))
+
+    def notify_auto_run_cancelled(self, name):
+        echo(">>> the notebook changed again, interrupted {!r}".format(name))
+
+    def notify_cells_not_run(self, failed, names):
+        echo(">>> {!r} failed; did not run {}".format(
+            failed, ', '.join(repr(n) for n in names)))
+
+    def notify_serialization_error(self, where, error, message):
+        echo(">>> could not send the {} {} the kernel: {}: {}".format(
+            where, 'to' if where == 'request' else 'from', error, message))
+
+    def notify_checkpoint_taken(self, label):
+        echo(">>> took checkpoint {!r}".format(label))
+
+    def notify_checkpoint_failed(self, label):
+        echo(">>> could not take checkpoint {!r}".format(label))
+
+    def notify_checkpoint_dropped(self, label):
+        echo(">>> dropped checkpoint {!r} (too many checkpoints, "
+             "or too much memory used)".format(label))
+
+    def notify_checkpoint_gone(self, label):
+        echo(">>> checkpoint {!r} does not exist anymore".format(label))
+
+    def notify_checkpoint_does_not_exist(self, label):
+        echo(">>> checkpoint does not exist:", label)
+
+    def notify_no_checkpoints(self):
+        echo(">>> no checkpoints")
+
+    def notify_checkpoints(self, checkpoints):
+        echo(">>> {} checkpoints (max {}, {:.1f} MiB max)".format(
+            len(checkpoints), self.checkpoint_options.max_count,
+            self.checkpoint_options.max_memory / 1024. ** 2))
+        for label, memory in checkpoints:
+            if memory is None:
+                echo("... {!r}".format(label))
+            else:
+                echo("... {!r}  {:.1f} MiB".format(label, memory / 1024. ** 2))
+
+    def notify_rewound(self, label, duration):
+        echo(">>> rewound to checkpoint {!r} in {:.3f}s".format(label, duration))
+
+    def notify_cell_stats(self, name, stats):
+        parts = ["wall {:.3f}s".format(stats['wall_time']),
+                 "cpu {:.3f}s".format(stats['cpu_time'])]
+        if stats.get('max_rss_delta') is not None:
+            parts.append("max rss +{:.1f} MiB".format(stats['max_rss_delta'] / 1024. ** 2))
+        if stats.get('memory_peak') is not None:
+            parts.append("allocated peak {:.1f} MiB".format(stats['memory_peak'] / 1024. ** 2))
+        echo(">>> {!r}: {}".format(name, ', '.join(parts)))
+
+    def notify_no_profile(self):
+        echo(">>> no profile (use --profile or --trace-memory)")
+
+    def notify_profile(self, stats):
+        if stats.get('profile'):
+            profile = pstats.Stats(_MarshalledStats(stats['profile']), stream=sys.stdout)
+            profile.sort_stats('cumulative').print_stats(20)
+        if stats.get('memory_top'):
+            echo(">>> top allocations still in use:")
+            for line, size, count in stats['memory_top']:
+                echo("... {}: {:.1f} KiB in {} blocks".format(line, size / 1024., count))
+
+    def notify_profile_saved(self, path):
+        echo(">>> saved profile to", path)
+
+    def notify_metrics_disabled(self):
+        echo(">>> metrics not enabled")
+
+    def notify_metrics(self, snapshot):
+        counters = snapshot['counters']
+        echo(">>> {} calls, {} events, {:.1f} KiB sent, {:.1f} KiB received".format(
+            counters.get('calls', 0), counters.get('events', 0),
+            counters.get('bytes_sent', 0) / 1024.,
+            counters.get('bytes_received', 0) / 1024.))
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            if not histogram['count']:
+                continue
+            if name.startswith('bytes_'):
+                values = ['{:.0f}'.format(histogram[k]) for k in ('p50', 'p90', 'p99', 'max')]
+            else:
+                values = ['{:.3f}ms'.format(histogram[k] * 1000) for k in ('p50', 'p90', 'p99', 'max')]
+            echo("... {:<18} p50 {}  p90 {}  p99 {}  max {}".format(name, *values))
+
+    def notify_memory_soft_limit(self, rss):
+        echo("\n>>> warning: kernel uses {:.1f} MiB (soft limit {:.1f} MiB)".format(
+            rss / 1024. ** 2, self.memory_limits.soft / 1024. ** 2))
+
+    def notify_memory_hard_limit(self, rss):
+        echo("\n>>> kernel uses {:.1f} MiB (hard limit {:.1f} MiB); {}".format(
+            rss / 1024. ** 2, self.memory_limits.hard / 1024. ** 2,
+            'restarting' if self.memory_limits.action == 'restart' else 'interrupting'))
+
+    def notify_memory(self, rss, objects):
+        if rss is not None:
+            echo(">>> kernel uses {:.1f} MiB".format(rss / 1024. ** 2))
+        for name, type_name, size in objects:
+            echo("... {:<20} {:<12} {:10.1f} KiB".format(name, type_name, size / 1024.))
+
+    def notify_modules_reloaded(self, modules, error, duration, restart_time):
+        if modules:
+            echo(">>> reloaded {} in {:.3f}s (a restart would take about {:.3f}s)".format(
+                ', '.join(modules), duration, restart_time))
+        if error:
+            echo(">>> reloading {1} failed with {0}".format(*error))
+
+    def notify_command_queued(self, command, position):
+        if position > 1 or self.running is not None:
+            echo(">>> queued {!r} ({} in the queue)".format(command, position))
+
+    def notify_queue(self, running, pending):
+        if running is None and not pending:
+            echo(">>> nothing running")
+            return
+        if running is not None:
+            echo(">>> running {!r}".format(running))
+        for i, command in enumerate(pending, 1):
+            echo(">>> {:>3}. {!r}".format(i, command))
+
+    def notify_commands_cancelled(self, commands):
+        if commands:
+            echo(">>> cancelled {}".format(', '.join(map(repr, commands))))
+
+    def notify_no_queue_entry(self, arg):
+        echo(">>> no such queue entry: {}".format(arg))
+
+    def notify_recoverable(self, count, duration):
+        echo(">>> the previous kernel ran {} cells that can be replayed "
+             "with !recover (about {:.1f}s)".format(count, duration))
+
+    def notify_nothing_to_recover(self):
+        echo(">>> nothing to recover")
+
+    def notify_replay_progress(self, done, total, elapsed, remaining):
+        echo(">>> replayed {}/{} in {:.1f}s, about {:.1f}s left".format(
+            done, total, elapsed, remaining))
+
+    def notify_replay_done(self, count, duration, error, failed):
+        if error:
+            echo(">>> replay stopped at {!r} ({}), after {} cells in {:.1f}s".format(
+                failed, error, count, duration))
+        else:
+            echo(">>> replayed {} cells in {:.1f}s".format(count, duration))
+
     def notify_interrupted(self):
         echo(">>> interrupted")
 
+    def page_output(self, path):
+        subprocess.call([os.environ.get('PAGER', 'less'), path])
+
     def read_command(self):
-        return prompt('>>> at {!r}; run: '.format(self.old_name)).strip()
+        rss = self.kernel_memory()
+        if rss is None:
+            return prompt('>>> at {!r}; run: '.format(self.old_name)).strip()
+        return prompt('>>> at {!r} ({:.0f} MiB); run: '.format(
+            self.old_name, rss / 1024. ** 2)).strip()
 
     def confirm_exit(self):
         return confirm(">>> exit?", True)
@@ -169,14 +1715,186 @@ class Driver(BaseDriver):
         return not confirm(">>> kernel died; exit?")
 
 
+class _MarshalledStats(object):
+
+    # pstats.Stats() accepts anything with a create_stats() method
+    # that sets a stats attribute.
+
+    def __init__(self, data):
+        self.data = data
+
+    def create_stats(self):
+        self.stats = marshal.loads(self.data)
+
+
 class Target(object):
 
-    def __init__(self):
+    code_cache_size = 256
+
+    def __init__(self, cache_path=None, cache_size=None, cache_min_time=0):
         self.context = {}
+        # kept here for the next driver to attach (see BaseDriver.attach)
+        self.state = {}
+        self._code_cache = OrderedDict()
+        if cache_path is not None:
+            self.cache = ResultCache(cache_path, cache_size)
+        else:
+            self.cache = None
+        self.cache_min_time = cache_min_time
+
+    def compile(self, text, filename, lineno):
+        # Code objects are cached by source hash, so re-running a cell
+        # does not parse and compile it again; the cache is an LRU.
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest(), filename, lineno
+        code = self._code_cache.pop(key, None)
+        if code is None:
+            # Padding with newlines makes line numbers (in tracebacks
+            # and syntax errors) be the ones in the notebook.
+            code = compile('\n' * (lineno - 1) + text, filename, 'exec')
+        self._code_cache[key] = code
+        while len(self._code_cache) > self.code_cache_size:
+            self._code_cache.popitem(last=False)
+        return code
+
+    def largest_objects(self, top=10):
+        return largest_objects(self.context, top)
+
+    def names(self):
+        return [name for name in self.context if not name.startswith('__')]
 
-    def __call__(self, text):
+    def replay(self, cells):
+        # Run cells ((text, filename, lineno) tuples) in order, stopping
+        # at the first that fails; emits a ('replay', count) event after
+        # each. Returns the wall times of the cells that ran, and the error.
+        wall_times = []
+        for text, filename, lineno in cells:
+            rv = self(text, filename, lineno)
+            if rv['error']:
+                return {'wall_times': wall_times, 'error': rv['error']}
+            wall_times.append(rv['stats']['wall_time'])
+            emit(('replay', len(wall_times)))
+        return {'wall_times': wall_times, 'error': None}
+
+    def run_cells(self, cells, keep_going=False):
+        # Run cells ((args, kwargs) tuples to call this with) in order,
+        # stopping after the first that fails, unless keep_going; emits
+        # a ('cell', index) event before each, so the driver can tell
+        # whose output is whose. Returns what the cells that ran returned.
+        results = []
+        for index, (args, kwargs) in enumerate(cells):
+            emit(('cell', index))
+            rv = self(*args, **kwargs)
+            results.append(rv)
+            if rv['error'] and not keep_going:
+                break
+        return results
+
+    def driver_state(self):
+        return self.state
+
+    def save_driver_state(self, **state):
+        self.state.update(state)
+
+    def loaded_modules(self):
+        return user_modules()
+
+    def reload_modules(self, names):
+        with capture_output():
+            return reload_modules(names, self.context)
+
+    @staticmethod
+    def update_linecache(text, filename, lineno):
+        # Put the cell source at the right lines in linecache, so tracebacks
+        # can show it without reading the notebook (which may have changed
+        # since). An mtime of None tells linecache.checkcache() to leave
+        # the entry alone.
+        entry = linecache.cache.get(filename)
+        if entry and len(entry) == 4 and entry[1] is None:
+            lines = list(entry[2])
+        else:
+            lines = []
+        new_lines = text.splitlines(True)
+        if new_lines and not new_lines[-1].endswith('\n'):
+            new_lines[-1] += '\n'
+        end = lineno - 1 + len(new_lines)
+        if len(lines) < end:
+            lines.extend(['\n'] * (end - len(lines)))
+        lines[lineno - 1:end] = new_lines
+        linecache.cache[filename] = (None, None, lines, filename)
+
+    def __call__(self, text, filename='<cell>', lineno=1,
+                 cache_key=None, cache_names=(), values=None, return_names=(),
+                 profile=False, trace_memory=False):
+        self.update_linecache(text, filename, lineno)
+
+        # The cell ran in another kernel (see BaseDriver.run_parallel());
+        # load the names it defined instead of running it.
+        if values is not None:
+            try:
+                load_values(self.context, values)
+            except Exception as e:
+                return {'error': type(e).__name__, 'loaded': False}
+            return {'error': None, 'loaded': True}
+
+        # If the cell ran before (with the same upstream cells),
+        # load the names it defined instead of running it.
+        use_cache = self.cache is not None and cache_key is not None
+        if use_cache:
+            values = self.cache.get(cache_key)
+            if values is not None:
+                self.context.update(values)
+                return {'error': None, 'cached': True}
+
+        error = None
+        # when running in a kernel, output goes to the driver as events
+        with capture_output():
+            with measure(profile, trace_memory) as stats:
+                try:
+                    exec(self.compile(text, filename, lineno), self.context)
+                except Exception as e:
+                    traceback.print_exc()
+                    error = type(e).__name__
+
+        if (use_cache and cache_names and not error
+                and stats['wall_time'] >= self.cache_min_time):
+            self.cache.put(cache_key, dict(
+                (name, self.context[name])
+                for name in cache_names if name in self.context))
+
+        rv = {'error': error, 'stats': stats}
+        if return_names and not error:
+            rv['values'], rv['not_exported'] = dump_values(self.context, return_names)
+        return rv
+
+
+def dump_values(context, names):
+    # Values are pickled here, so the driver can pass them from a kernel
+    # to another without unpickling them (it may not be able to import
+    # the modules needed). Modules are passed by name. Returns the values,
+    # and the names that could not be pickled.
+    values = {}
+    failed = []
+    for name in names:
+        if name not in context:
+            values[name] = 'deleted', None
+            continue
+        value = context[name]
+        if isinstance(value, type(sys)):
+            values[name] = 'module', value.__name__
+            continue
         try:
-            exec(text, self.context)
+            values[name] = 'pickle', pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
         except Exception:
-            traceback.print_exc()
+            failed.append(name)
+    return values, failed
+
+
+def load_values(context, values):
+    for name, (kind, value) in values.items():
+        if kind == 'deleted':
+            context.pop(name, None)
+        elif kind == 'module':
+            context[name] = importlib.import_module(value)
+        else:
+            context[name] = pickle.loads(value)
 
@@ -0,0 +1,89 @@
+import sys
+import time
+import marshal
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import cProfile
+except ImportError:
+    cProfile = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+def max_rss():
+    # peak resident set size of this process so far, in bytes
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere except macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextlib.contextmanager
+def measure(profile=False, trace_memory=False, top=10):
+    # Measure the code run in the with block; the dict yielded
+    # gets filled in at the end:
+    #
+    # * wall_time, cpu_time (seconds)
+    # * max_rss_delta: how much the peak RSS grew (bytes), or None
+    # * profile: the cProfile stats, in pstats (marshal) format,
+    #   if profile is true
+    # * memory_peak, memory_top: the peak memory allocated while running
+    #   and (traceback line, size, count) tuples for the top lines that
+    #   allocated memory still in use at the end, if trace_memory is true
+    #
+    # The optional measurements are skipped if not available.
+    stats = {}
+
+    profiler = None
+    if profile and cProfile is not None:
+        profiler = cProfile.Profile()
+    tracing = False
+    if trace_memory and tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        tracing = True
+
+    rss = max_rss()
+    cpu_start = process_time()
+    start = time.time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield stats
+    finally:
+        if profiler:
+            profiler.disable()
+        stats['wall_time'] = time.time() - start
+        stats['cpu_time'] = process_time() - cpu_start
+        stats['max_rss_delta'] = None if rss is None else max_rss() - rss
+
+        if profiler:
+            profiler.create_stats()
+            stats['profile'] = marshal.dumps(profiler.stats)
+
+        if tracing:
+            # leave out our own allocations
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, filename) for filename in (
+                    __file__, tracemalloc.__file__, contextlib.__file__,
+                    getattr(cProfile, '__file__', '<none>'),
+                    '<frozen importlib._bootstrap>')
+            ])
+            stats['memory_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            stats['memory_top'] = [
+                (str(stat.traceback), stat.size, stat.count)
+                for stat in snapshot.statistics('lineno')[:top]
+            ]
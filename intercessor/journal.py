@@ -0,0 +1,76 @@
+import io
+import os.path
+import json
+import time
+
+
+class Journal(object):
+
+    # Append-only record of the cells run in each kernel, so what a kernel
+    # ran can be replayed in a new one after it dies (see BaseDriver.recover).
+    #
+    # If path is given, the records are also appended to it, as JSON lines,
+    # and the ones already there are read first, so the journal survives
+    # the driver too. Records are dicts with a type:
+    #
+    # * kernel: a new kernel started (what ran before was lost)
+    # * run: a cell ran; name, hash, text, lineno, wall_time, error
+    # * rewind: the kernel was rewound to a checkpoint, taken after
+    #   the first length runs (see BaseDriver.rewind)
+    #
+    # session is the list of run records of the current kernel.
+
+    def __init__(self, path=None):
+        self.path = path
+        self.session = []
+        self._file = None
+        if path is None:
+            return
+        line = u'\n'
+        if os.path.exists(path):
+            with io.open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # cut short by a crash
+                        continue
+                    self._apply(record)
+        self._file = io.open(path, 'a', encoding='utf-8')
+        if not line.endswith(u'\n'):
+            self._file.write(u'\n')
+
+    def _apply(self, record):
+        kind = record.get('type')
+        if kind == 'kernel':
+            self.session = []
+        elif kind == 'run':
+            self.session.append(record)
+        elif kind == 'rewind':
+            del self.session[record['length']:]
+
+    def _append(self, record):
+        record['time'] = time.time()
+        self._apply(record)
+        if self._file is not None:
+            self._file.write(json.dumps(record, sort_keys=True) + u'\n')
+            self._file.flush()
+
+    def start_session(self):
+        # returns the runs of the previous kernel
+        lost = self.session
+        self._append({'type': 'kernel'})
+        return lost
+
+    def record_run(self, name, hash, text, lineno, wall_time=None, error=None):
+        self._append(dict(
+            type='run', name=name, hash=hash, text=text, lineno=lineno,
+            wall_time=wall_time, error=error))
+
+    def rewind(self, length):
+        self._append({'type': 'rewind', 'length': length})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
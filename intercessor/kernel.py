@@ -1,7 +1,34 @@
 import multiprocessing
 import sys
+import os
 import logging
 import signal
+import time
+import collections
+import itertools
+import pickle
+import mmap
+import shutil
+import tempfile
+import threading
+import socket
+
+try:
+    from multiprocessing.reduction import ForkingPickler as _ForkingPickler
+except ImportError:
+    _ForkingPickler = None
+
+from .serialize import PickleSerializer, SerializationError
+
+try:
+    from multiprocessing.connection import wait as _wait_for
+except ImportError:
+    _wait_for = None
+
+try:
+    from multiprocessing.connection import Connection as _Connection
+except ImportError:
+    _Connection = None
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
@@ -13,9 +40,269 @@ if sys.version_info[0] >= 3 and sys.version_info[1] >= 4:
     multiprocessing = multiprocessing.get_context('spawn')
 
 
+# what forkserver_context() was asked to preload so far
+_forkserver_preload = []
+
+
+def forkserver_context(preload=()):
+    # The fork server is single-threaded, so forking it is safe;
+    # the modules in preload are imported once, in the fork server,
+    # and every kernel started from it gets them for free.
+    # Returns None if the 'forkserver' start method is not available.
+    #
+    # multiprocessing has a single fork server per process, so the
+    # preload can't be scoped to a caller: modules are added to those
+    # earlier callers asked for (instead of replacing them), every
+    # process started from the fork server gets all of them, and they
+    # only take effect if the fork server hasn't started yet.
+    try:
+        context = multiprocessing.get_context('forkserver')
+    except (AttributeError, ValueError):
+        return None
+    new = [name for name in preload if name not in _forkserver_preload]
+    if new:
+        _forkserver_preload.extend(new)
+        context.set_forkserver_preload(list(_forkserver_preload))
+    return context
+
+
 class KernelError(Exception): pass
 
 
+# Requests are (call_id, args, kwargs) tuples (or None, to exit),
+# replies are (call_id, status, value) tuples; a call that was
+# interrupted gets an INTERRUPTED reply with a None value.
+# While running, a call can send any number of EVENT replies; see emit().
+# If a request has a fourth item (true), its RETURNED or INTERRUPTED
+# reply gets a fourth item too: when the target started and ended.
+# If the request or the return value can't be (un)serialized, the reply
+# is UNSERIALIZABLE, with a (where, error, message) value (see
+# SerializationError); for requests, the call_id is None.
+RETURNED = 'returned'
+INTERRUPTED = 'interrupted'
+EVENT = 'event'
+UNSERIALIZABLE = 'unserializable'
+
+# SerializationError.where, from Channel (on the driver side) to Kernel
+_CHANNEL_WHERE = {'send': 'request', 'receive': 'reply'}
+
+# Control requests are (call_id, name, kwargs) tuples, handled
+# by the kernel itself instead of the target.
+CHECKPOINT = 'checkpoint'
+# calls a method of the target instead of the target itself
+METHOD = 'method'
+
+
+# (channel, call_id) of the call being run, in the kernel process.
+_current_call = None
+
+
+def emit(value):
+    # Send value to the parent while a call is running; the parent
+    # passes it to Kernel.on_event (if set). Safe to call from any thread;
+    # returns false if not called from a kernel call.
+    current_call = _current_call
+    if current_call is None:
+        return False
+    conn, call_id = current_call
+    conn.send((call_id, EVENT, value))
+    return True
+
+
+_OOB_MARKER = b'intercessor: out-of-band buffers'
+
+
+
+def make_buffer_dir():
+    # /dev/shm is memory-backed, so mapping files from it amounts to
+    # using shared memory; fall back to the normal temporary directory.
+    dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    return tempfile.mkdtemp(prefix='intercessor-', dir=dir)
+
+
+def private_memory(pid):
+    # Memory (in bytes) only process pid uses, i.e. not shared with
+    # other processes; None if not available.
+    for name in 'smaps_rollup', 'smaps':
+        try:
+            with open('/proc/{}/{}'.format(pid, name)) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            continue
+        return 1024 * sum(
+            int(line.split()[1]) for line in lines
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')))
+    return None
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _reap_children():
+    # reap the children that exited, e.g. checkpoints
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            return
+        if not pid:
+            return
+
+
+def _stop_server(address):
+    # tell the server listening on address to exit (see Kernel._server_loop())
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(address)
+        channel = _socket_channel(sock)
+        channel.send(None)
+        channel.close()
+    except (IOError, OSError):
+        sock.close()
+        if os.path.exists(address):
+            os.remove(address)
+
+
+def _socket_channel(sock, *args):
+    sock.settimeout(None)
+    return Channel(_Connection(sock.detach()), *args)
+
+
+class Channel(object):
+
+    # Wraps a Connection. With pickle protocol 5, buffers (e.g. numpy arrays,
+    # bytearrays) larger than buffer_threshold are sent out of band instead
+    # of being copied through the pipe: they are written to files in
+    # buffer_dir, and the receiver memory-maps them (copy-on-write) and
+    # unlinks the files right away; the mapping goes away when the last
+    # object using it does. Everything else goes through the pipe, as usual.
+    #
+    # If the receiver dies before unlinking them, the files are removed
+    # together with buffer_dir, which Kernel owns; see Kernel.join().
+    #
+    # Messages are turned into bytes by serializer (see serialize.py);
+    # if that fails, send() and recv() raise SerializationError.
+
+    def __init__(self, conn, buffer_dir=None, buffer_threshold=1024 ** 2,
+                 serializer=None):
+        self.conn = conn
+        self.buffer_dir = buffer_dir
+        self.buffer_threshold = buffer_threshold
+        self.serializer = serializer or PickleSerializer()
+        # sends of (possibly) multiple messages must not interleave
+        self.send_lock = threading.Lock()
+        # if measure is true, last_sent and last_received are the size
+        # (in bytes) and pickling / unpickling time of the last message
+        self.measure = False
+        self.last_sent = None
+        self.last_received = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['send_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.send_lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self.conn.closed
+
+    def poll(self, timeout=0):
+        return self.conn.poll(timeout)
+
+    def close(self):
+        self.conn.close()
+
+    def _dumps(self, obj):
+        buffers = []
+        if (self.buffer_dir is None or self.buffer_threshold is None
+                or pickle.HIGHEST_PROTOCOL < 5):
+            return self.serializer.dumps(obj), buffers
+
+        def buffer_callback(buffer):
+            raw = buffer.raw()
+            if raw.nbytes < self.buffer_threshold:
+                return True
+            buffers.append(raw)
+            return False
+
+        return self.serializer.dumps(obj, buffer_callback), buffers
+
+    def _loads(self, data, buffers=None):
+        try:
+            return self.serializer.loads(data, buffers)
+        except Exception as e:
+            raise SerializationError('receive', type(e).__name__, str(e))
+
+    def _write_buffer(self, buffer):
+        fd, path = tempfile.mkstemp(dir=self.buffer_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer)
+        return path
+
+    @staticmethod
+    def _map_buffer(path):
+        with open(path, 'rb') as f:
+            os.unlink(path)
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def send(self, obj):
+        if _ForkingPickler is None:
+            with self.send_lock:
+                self.conn.send(obj)
+            return
+
+        # Pickle everything before sending anything, so a pickling error
+        # doesn't leave half a message in the pipe.
+        if self.measure:
+            start = time.time()
+        try:
+            data, buffers = self._dumps(obj)
+        except Exception as e:
+            raise SerializationError('send', type(e).__name__, str(e))
+        if self.measure:
+            self.last_sent = (
+                len(data) + sum(b.nbytes for b in buffers), time.time() - start)
+        with self.send_lock:
+            if buffers:
+                paths = [self._write_buffer(b) for b in buffers]
+                self.conn.send_bytes(_OOB_MARKER)
+                self.conn.send(paths)
+            self.conn.send_bytes(data)
+
+    def recv(self):
+        if _ForkingPickler is None:
+            return self.conn.recv()
+
+        data = self.conn.recv_bytes()
+        if data != _OOB_MARKER:
+            if not self.measure:
+                return self._loads(data)
+            start = time.time()
+            rv = self._loads(data)
+            self.last_received = len(data), time.time() - start
+            return rv
+
+        buffers = [self._map_buffer(path) for path in self.conn.recv()]
+        data = self.conn.recv_bytes()
+        start = time.time()
+        rv = self._loads(data, buffers)
+        if self.measure:
+            self.last_received = (
+                len(data) + sum(len(b) for b in buffers), time.time() - start)
+        return rv
+
+
 class Kernel(object):
 
     Process = staticmethod(multiprocessing.Process)
@@ -23,9 +310,27 @@ class Kernel(object):
 
     make_debug_handler = staticmethod(lambda: logging.StreamHandler())
 
-    def __init__(self, make_target, debug=False):
+    def __init__(self, make_target, debug=False, context=None,
+                 buffer_threshold=1024 ** 2, metrics=None, rlimits=None,
+                 serializer=None):
         self.make_target = make_target
         self.debug = debug
+        if context is not None:
+            self.Process = context.Process
+            self.Pipe = context.Pipe
+        self.buffer_threshold = buffer_threshold
+        # how requests and replies are turned into bytes (see serialize.py)
+        self.serializer = serializer or PickleSerializer()
+        self.buffer_dir = None
+        self.start_time = None
+        self._started_at = None
+        self.on_event = None
+        # if set, gets a record for each call (see metrics.KernelMetrics)
+        self.metrics = metrics
+        # resource name -> (soft, hard) limits to run the kernel with,
+        # e.g. {'RLIMIT_AS': (2 ** 30, 2 ** 30)}; see resource.setrlimit()
+        self.rlimits = rlimits
+        self._call_ids = itertools.count()
         self._parent_conn = None
         self._kernel_conn = None
         self._process = None
@@ -33,12 +338,33 @@ class Kernel(object):
         self._old_log_level = None
 
     @classmethod
-    def _kernel_loop(cls, conn, make_target, debug):
+    def _kernel_loop(cls, conn, make_target, debug, target=None, rlimits=None):
+        global _current_call
+
         if debug:
             log.addHandler(cls.make_debug_handler())
             log.setLevel(logging.DEBUG)
 
-        target = make_target()
+        if rlimits:
+            import resource
+            for name, limits in rlimits.items():
+                resource.setrlimit(getattr(resource, name), limits)
+
+        if target is None:
+            target = make_target()
+        checkpoint_pids = set()
+
+        # Tell the parent we're ready, and when; the kernel may sit
+        # unused for a while after this (e.g. in a KernelPool).
+        # The parent may have already gone away (e.g. a KernelPool
+        # closing a kernel that was still starting).
+        try:
+            conn.send(time.time())
+            log.info("kernel: send ready")
+        except (IOError, OSError):
+            log.info("kernel: parent went away before ready")
+            conn.close()
+            return
 
         # When SIGINT is sent to the parent, all processes in its
         # process group receive it. By default, SIGINT manifests as a
@@ -60,38 +386,67 @@ class Kernel(object):
             while not done:
 
                     while True:
-                        args_tuple = conn.recv()
+                        try:
+                            request = conn.recv()
+                        except SerializationError as e:
+                            log.exception("kernel: could not unpickle request")
+                            conn.send((None, UNSERIALIZABLE, ('request', e.error, e.message)))
+                            continue
                         log.info("kernel: recv")
-                        if args_tuple is None:
+                        if request is None:
                             done = True
                             break
 
-                        args, kwargs = args_tuple
+                        call_id, args, kwargs = request[:3]
+                        timed = len(request) > 3
+
+                        # reap checkpoints that exited
+                        for pid in list(checkpoint_pids):
+                            if os.waitpid(pid, os.WNOHANG)[0]:
+                                checkpoint_pids.remove(pid)
+
+                        if args == CHECKPOINT:
+                            rv = cls._checkpoint(conn, target, **kwargs)
+                            if rv is not None:
+                                checkpoint_pids.add(rv)
+                            conn.send((call_id, RETURNED, rv))
+                            continue
+
+                        function = target
+                        if args == METHOD:
+                            function = getattr(target, kwargs['name'])
+                            args, kwargs = kwargs['args'], kwargs['kwargs']
 
                         signal.signal(signal.SIGINT, old_sigint_handler)
+                        _current_call = conn, call_id
+                        started = time.time()
                         try:
-                            rv = target(*args, **kwargs)
+                            rv = function(*args, **kwargs)
                         except Exception as e:
                             log.exception('kernel: exception during target')
                             rv = None
                         except KeyboardInterrupt:
                             log.info("kernel: interrupted during target")
+                            timings = ((started, time.time()), ) if timed else ()
+                            conn.send((call_id, INTERRUPTED, None) + timings)
+                            log.info('kernel: send')
                             continue
                         finally:
                             signal.signal(signal.SIGINT, signal.SIG_IGN)
+                            _current_call = None
+                        timings = ((started, time.time()), ) if timed else ()
 
                         # We assume that the actual send never fails and that any
                         # exceptions are raised during the pickling of rv prior
-                        # to sending it. I don't know how to distinguish between
-                        # pickling errors and actual send errors (without trying
-                        # to pickle rv before sending it). Even if I did, I'm not
-                        # sure how to recover from a failed actual send.
+                        # to sending it (Channel pickles rv before sending
+                        # anything). I'm not sure how to recover from a failed
+                        # actual send.
                         try:
-                            conn.send(rv)
+                            conn.send((call_id, RETURNED, rv) + timings)
                             log.info('kernel: send')
-                        except Exception as e:
+                        except SerializationError as e:
                             log.exception('kernel: exception during send')
-                            conn.send(None)
+                            conn.send((call_id, UNSERIALIZABLE, ('reply', e.error, e.message)) + timings)
                             log.info("kernel: send")
 
         finally:
@@ -100,24 +455,276 @@ class Kernel(object):
         # TODO: Should this be in finally: too?
         conn.close()
         log.info("kernel: exiting kernel loop")
+        if conn.buffer_dir:
+            shutil.rmtree(conn.buffer_dir, ignore_errors=True)
 
-    def __call__(self, *args, **kwargs):
-        assert self._process, "not started"
-        assert self._process.is_alive(), "not alive"
-        assert not self._parent_conn.closed, "closed"
+    @classmethod
+    def _checkpoint(cls, conn, target, address, driver_pid):
+        # Fork a frozen copy of the kernel (copy-on-write, so it's cheap),
+        # that listens on address (a Unix socket); each connection gets
+        # a new kernel forked from the copy, with the state from this
+        # point on (see ForkedKernel). Returns the pid of the copy,
+        # or None if it could not be started.
+        #
+        # Forking is only safe because the kernel does nothing else
+        # between calls; threads started by the target don't make it
+        # to the copy.
+        ready_r, ready_w = os.pipe()
+        try:
+            pid = os.fork()
+        except OSError:
+            log.exception("kernel: checkpoint fork failed")
+            os.close(ready_r)
+            os.close(ready_w)
+            return None
+
+        if pid:
+            os.close(ready_w)
+            ready = os.read(ready_r, 1)
+            os.close(ready_r)
+            return pid if ready else None
 
-        self._parent_conn.send((args, kwargs))
-        log.info("parent: send")
+        try:
+            os.close(ready_r)
+            # only the kernel talks to the parent
+            conn.conn.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+            listener = socket.socket(socket.AF_UNIX)
+            listener.bind(address)
+            listener.listen(8)
+            listener.settimeout(1)
+            os.write(ready_w, b'1')
+            os.close(ready_w)
+            cls._server_loop(listener, target, address, driver_pid)
+        except BaseException:
+            log.exception("kernel: checkpoint failed")
+        finally:
+            os._exit(0)
+
+    @classmethod
+    def serve(cls, address, make_target, debug=False):
+        # Run a kernel that outlives the drivers using it: listen on
+        # address (a Unix socket), and run calls from one connection
+        # at a time, all with the same target (see AttachedKernel);
+        # more connections wait their turn. Returns when asked to
+        # (see KernelServer.close()).
+        if debug:
+            log.addHandler(cls.make_debug_handler())
+            log.setLevel(logging.DEBUG)
+        target = make_target()
+        listener = socket.socket(socket.AF_UNIX)
+        listener.bind(address)
+        try:
+            listener.listen(8)
+            listener.settimeout(1)
+            cls._server_loop(listener, target, address, fork=False)
+        except BaseException:
+            listener.close()
+            os.unlink(address)
+            raise
 
+    @classmethod
+    def _server_loop(cls, listener, target, address, driver_pid=None, fork=True):
+        # Requests are (buffer_dir, buffer_threshold, serializer) tuples,
+        # to run a kernel with target, or None, to exit (the request itself
+        # is always plain pickle, the pid reply is not); with fork, each kernel
+        # runs in a new process forked from this one, otherwise, here.
+        # If driver_pid is given, we also exit when it goes away.
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except socket.timeout:
+                if driver_pid is not None and not _pid_exists(driver_pid):
+                    break
+                if not fork:
+                    _reap_children()
+                continue
+            channel = _socket_channel(sock)
+            try:
+                request = channel.recv()
+            except EOFError:
+                channel.close()
+                continue
+            if request is None:
+                channel.close()
+                break
+
+            if not fork:
+                try:
+                    channel = Channel(channel.conn, *request)
+                    channel.send(os.getpid())
+                    cls._kernel_loop(channel, None, False, target)
+                except (EOFError, IOError, OSError):
+                    # the driver went away without detaching
+                    log.info("kernel: driver went away")
+                    channel.close()
+                continue
+
+            if os.fork() == 0:
+                try:
+                    listener.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.default_int_handler)
+                    channel = Channel(channel.conn, *request)
+                    channel.send(os.getpid())
+                    cls._kernel_loop(channel, None, False, target)
+                except BaseException:
+                    log.exception("kernel: forked kernel failed")
+                finally:
+                    os._exit(0)
+            channel.close()
+
+        listener.close()
+        os.unlink(address)
+
+    def _wait(self):
+        # Wait for the kernel to send something, or to die, whichever
+        # comes first. If the kernel sent something and then died,
+        # we still get what it sent.
+        if _wait_for is None:
+            return self._wait_polling()
+        conn = self._parent_conn.conn
+        ready = _wait_for([conn, self._process.sentinel])
+        if conn not in ready:
+            self._kernel_died()
+
+    def _wait_polling(self):
+        # For Pythons without multiprocessing.connection.wait().
         while not self._parent_conn.poll(.1):
             if not self._process.is_alive():
-                log.info("parent: kernel died")
-                self._parent_conn.close()
-                raise KernelError("kernel died")
+                self._kernel_died()
 
-        rv = self._parent_conn.recv()
-        log.info("parent: recv")
-        return rv
+    def _kernel_died(self):
+        log.info("parent: kernel died")
+        self._parent_conn.close()
+        raise KernelError("kernel died")
+
+    def _recv(self):
+        # The pipe gets to EOF before the sentinel fires if the kernel
+        # dies while forked processes still hold the sentinel open.
+        try:
+            return self._parent_conn.recv()
+        except EOFError:
+            self._kernel_died()
+
+    def wait_ready(self):
+        assert self._process, "not started"
+        if self.start_time is not None:
+            return
+        self._wait()
+        ready_at = self._recv()
+        log.info("parent: recv ready")
+        self.start_time = ready_at - self._started_at
+
+    def __call__(self, *args, **kwargs):
+        return self._call(args, kwargs)
+
+    def checkpoint(self, address):
+        # Take a checkpoint of the kernel, listening on address (the path
+        # of a Unix socket); returns a Checkpoint, or None on failure.
+        pid = self._call(CHECKPOINT, dict(address=address, driver_pid=os.getpid()))
+        if pid is None:
+            return None
+        return Checkpoint(address, pid)
+
+    def call_method(self, name, *args, **kwargs):
+        # like calling the kernel, but calls a method of the target
+        return self._call(METHOD, dict(name=name, args=args, kwargs=kwargs))
+
+    def _call(self, args, kwargs):
+        self.wait_ready()
+        # e.g. terminated while idle (see BaseDriver.memory_hard_limit_reached())
+        if not self._process.is_alive():
+            log.info("parent: kernel died")
+            raise KernelError("kernel died")
+        assert not self._parent_conn.closed, "closed"
+
+        call_id = next(self._call_ids)
+        try:
+            if self.metrics is None:
+                self._parent_conn.measure = False
+                self._parent_conn.send((call_id, args, kwargs))
+                log.info("parent: send")
+                reply = self._wait_for_reply(call_id)
+            else:
+                reply = self._measured_call(call_id, args, kwargs)
+        except SerializationError as e:
+            # Errors on our side come from Channel, as send or receive;
+            # the ones the kernel reported say where already.
+            if e.where not in _CHANNEL_WHERE:
+                raise
+            raise SerializationError(_CHANNEL_WHERE[e.where], e.error, e.message)
+
+        if reply[1] == INTERRUPTED:
+            raise KeyboardInterrupt
+        return reply[2]
+
+    def _wait_for_reply(self, call_id, call=None):
+        while True:
+            self._wait()
+            reply = self._recv()
+            log.info("parent: recv")
+            if call is not None:
+                size, seconds = self._parent_conn.last_received or (0, 0.)
+                call['bytes_received'] += size
+                call['deserialize_time'] += seconds
+            reply_id, status, rv = reply[:3]
+            if status == UNSERIALIZABLE and reply_id in (call_id, None):
+                if call is not None:
+                    call['status'] = status
+                raise SerializationError(*rv)
+            # Replies to calls we stopped waiting for (because we were
+            # interrupted too) may still be in the pipe; skip them.
+            if reply_id != call_id:
+                continue
+            if status != EVENT:
+                return reply
+            if call is not None:
+                call['events'] += 1
+            if self.on_event:
+                self.on_event(rv)
+
+    def _measured_call(self, call_id, args, kwargs):
+        # Like the unmeasured path in _call(), but records what happened
+        # (see metrics.KernelMetrics); kept separate so calls without
+        # metrics don't pay for it.
+        conn = self._parent_conn
+        conn.measure = True
+        call = dict(
+            call_id=call_id, status=None, events=0,
+            bytes_received=0, deserialize_time=0.)
+        start = time.time()
+        try:
+            conn.send((call_id, args, kwargs, True))
+            sent = time.time()
+            call['bytes_sent'], call['serialize_time'] = conn.last_sent or (0, 0.)
+            log.info("parent: send")
+            reply = self._wait_for_reply(call_id, call)
+        except KernelError:
+            call.setdefault('bytes_sent', 0)
+            call.update(status='died', total_time=time.time() - start)
+            self.metrics.record(call)
+            raise
+
+        end = time.time()
+        call.update(status=reply[1], total_time=end - start)
+        if len(reply) > 3:
+            target_start, target_end = reply[3]
+            call['queue_wait'] = target_start - sent
+            call['target_time'] = target_end - target_start
+            call['reply_wait'] = end - target_end
+        self.metrics.record(call)
+        return reply
+
+    @property
+    def pid(self):
+        return self._process.pid if self._process else None
+
+    def interrupt(self):
+        # Send SIGINT to the kernel only; the current call
+        # raises KeyboardInterrupt (in the parent).
+        assert self._process, "not started"
+        os.kill(self._process.pid, signal.SIGINT)
 
     def start(self):
         assert not self._process or not self._process.is_alive(), "already started"
@@ -128,11 +735,20 @@ class Kernel(object):
             self._old_log_level = log.level
             log.setLevel(logging.DEBUG)
 
-        self._parent_conn, self._kernel_conn = self.Pipe()
+        parent_conn, kernel_conn = self.Pipe()
+        if self.buffer_threshold is not None and pickle.HIGHEST_PROTOCOL >= 5:
+            self.buffer_dir = make_buffer_dir()
+        self._parent_conn = Channel(
+            parent_conn, self.buffer_dir, self.buffer_threshold, self.serializer)
+        self._kernel_conn = Channel(
+            kernel_conn, self.buffer_dir, self.buffer_threshold, self.serializer)
+        self.start_time = None
+        self._started_at = time.time()
 
         self._process = self.Process(
             target=self._kernel_loop,
-            args=(self._kernel_conn, self.make_target, self.debug))
+            args=(self._kernel_conn, self.make_target, self.debug),
+            kwargs=dict(rlimits=self.rlimits))
         self._process.start()
 
     def close(self):
@@ -152,17 +768,16 @@ class Kernel(object):
     def join(self):
         assert self._process, "not started"
         self._process.join()
+        if self.buffer_dir:
+            shutil.rmtree(self.buffer_dir, ignore_errors=True)
+            self.buffer_dir = None
         if self.debug:
             log.setLevel(self._old_log_level)
             self._old_log_level = None
             log.removeHandler(self._debug_handler)
             self._debug_handler = None
 
-    def __enter__(self):
-        self.start()
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    def shutdown(self):
         try:
             self.close()
             log.info('parent: waiting for kernel to exit')
@@ -171,8 +786,229 @@ class Kernel(object):
             log.info('parent: terminating kernel')
             self.terminate()
             self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
         return False
 
 
 run_kernel = Kernel
 
+
+class _ForkedProcess(object):
+
+    # Stands in for the Process of a kernel that is not our child
+    # (so we can't wait for it); the sentinel is a pidfd, if available.
+
+    def __init__(self, pid):
+        self.pid = pid
+        try:
+            self.sentinel = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self.sentinel = None
+
+    def is_alive(self):
+        if self.sentinel is not None:
+            return not _wait_for([self.sentinel], 0)
+        return _pid_exists(self.pid)
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def join(self):
+        if self.sentinel is not None:
+            _wait_for([self.sentinel])
+            os.close(self.sentinel)
+            self.sentinel = None
+        while _pid_exists(self.pid):
+            time.sleep(.01)
+
+
+class ForkedKernel(Kernel):
+
+    # A kernel forked from a Checkpoint; starting it takes about as long
+    # as a fork, since there's nothing to import or initialize.
+
+    def __init__(self, address, buffer_threshold=1024 ** 2, serializer=None):
+        super(ForkedKernel, self).__init__(
+            None, buffer_threshold=buffer_threshold, serializer=serializer)
+        self.address = address
+
+    def _wait(self):
+        if self._process.sentinel is None:
+            return self._wait_polling()
+        return super(ForkedKernel, self)._wait()
+
+    def start(self):
+        assert not self._process or not self._process.is_alive(), "already started"
+
+        sock = socket.socket(socket.AF_UNIX)
+        try:
+            sock.connect(self.address)
+        except (IOError, OSError):
+            sock.close()
+            raise KernelError("checkpoint does not exist anymore")
+
+        if self.buffer_threshold is not None and pickle.HIGHEST_PROTOCOL >= 5:
+            self.buffer_dir = make_buffer_dir()
+        self._parent_conn = _socket_channel(sock, self.buffer_dir, self.buffer_threshold)
+        self.start_time = None
+        self._started_at = time.time()
+
+        self._parent_conn.send((self.buffer_dir, self.buffer_threshold, self.serializer))
+        self._parent_conn.serializer = self.serializer
+        try:
+            pid = self._parent_conn.recv()
+        except EOFError:
+            self._parent_conn.close()
+            raise KernelError("checkpoint could not fork a kernel")
+        self._process = _ForkedProcess(pid)
+
+
+class Checkpoint(object):
+
+    # A frozen copy of a kernel, taken by Kernel.checkpoint().
+
+    def __init__(self, address, pid):
+        self.address = address
+        self.pid = pid
+
+    def memory(self):
+        # The checkpoint shares its memory with the kernel it was taken
+        # from until either of them changes it; this is how much it
+        # doesn't share anymore.
+        return private_memory(self.pid)
+
+    def kernel(self, **kwargs):
+        return ForkedKernel(self.address, **kwargs)
+
+    def close(self):
+        _stop_server(self.address)
+
+
+class AttachedKernel(ForkedKernel):
+
+    # A kernel run by Kernel.serve(), maybe in another session (so it
+    # doesn't get our SIGINTs; we pass them on). Shutting it down only
+    # detaches from it; the server keeps running, with the same state.
+
+    def _call(self, args, kwargs):
+        try:
+            return super(AttachedKernel, self)._call(args, kwargs)
+        except KeyboardInterrupt:
+            # if it was the kernel that got interrupted, it's idle now,
+            # and ignores SIGINT
+            if self._process.is_alive():
+                self.interrupt()
+            raise
+
+    def start(self):
+        try:
+            super(AttachedKernel, self).start()
+        except KernelError:
+            raise KernelError("no kernel server at {}".format(self.address))
+
+    def join(self):
+        # the server doesn't exit
+        if self._process.sentinel is not None:
+            os.close(self._process.sentinel)
+            self._process.sentinel = None
+        if self.buffer_dir:
+            shutil.rmtree(self.buffer_dir, ignore_errors=True)
+            self.buffer_dir = None
+
+
+class KernelServer(object):
+
+    # A kernel started with Kernel.serve(), listening on address.
+
+    def __init__(self, address):
+        self.address = address
+
+    def kernel(self, **kwargs):
+        return AttachedKernel(self.address, **kwargs)
+
+    def close(self):
+        _stop_server(self.address)
+
+
+class KernelPool(object):
+
+    # Keeps size kernels started ahead of time, so get() can hand over
+    # a ready kernel at once. If preload is given (and the platform
+    # supports it), kernels are forked from a fork server that has
+    # already imported the preload modules.
+    #
+    # Kernels returned by get() have a start_time attribute (how long
+    # the kernel took to become ready, i.e. a cold start) and
+    # a handoff_time one (how long get() took).
+
+    Kernel = Kernel
+
+    def __init__(self, make_target, size=1, preload=(), debug=False, rlimits=None,
+                 serializer=None):
+        self.make_target = make_target
+        self.size = size
+        self.preload = list(preload)
+        self.debug = debug
+        self.rlimits = rlimits
+        self.serializer = serializer
+        self.context = forkserver_context(self.preload) if self.preload else None
+        self._standby = collections.deque()
+
+    def _start_kernel(self):
+        kernel = self.Kernel(
+            self.make_target, self.debug, context=self.context, rlimits=self.rlimits,
+            serializer=self.serializer)
+        kernel.start()
+        return kernel
+
+    def _fill(self):
+        while len(self._standby) < self.size:
+            self._standby.append(self._start_kernel())
+
+    def start(self):
+        self._fill()
+
+    def get(self):
+        return self.get_many(1)[0]
+
+    def get_many(self, count):
+        # Kernels that are not in standby are all started before waiting
+        # for any of them, so they start in parallel.
+        start = time.time()
+        kernels = []
+        while self._standby and len(kernels) < count:
+            kernel = self._standby.popleft()
+            if kernel._process.is_alive():
+                kernels.append(kernel)
+                continue
+            log.info("parent: standby kernel died")
+            kernel.join()
+        while len(kernels) < count:
+            kernels.append(self._start_kernel())
+        self._fill()
+        for kernel in kernels:
+            kernel.wait_ready()
+            kernel.handoff_time = time.time() - start
+        return kernels
+
+    def close(self):
+        while self._standby:
+            self._standby.popleft().shutdown()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
@@ -0,0 +1,119 @@
+import os
+import sys
+import gc
+import types
+import threading
+
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+
+def process_rss(pid):
+    # resident set size of process pid, in bytes; None if not available
+    if _PAGE_SIZE is None or pid is None:
+        return None
+    try:
+        with open('/proc/{}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+# Following references into these would count most of the process.
+_SKIP_TYPES = (
+    types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType,
+    types.MethodType, types.FrameType, types.CodeType,
+)
+
+
+def deep_size(obj, limit=100000):
+    # Approximate size of obj and everything it refers to, in bytes;
+    # stops after limit objects. Objects shared with other values
+    # are counted for each of them.
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack and len(seen) < limit:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj, 0)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+def largest_objects(namespace, top=10):
+    # (name, type name, size) tuples for the largest values
+    # in namespace, largest first
+    sizes = [
+        (name, type(value).__name__, deep_size(value))
+        for name, value in namespace.items()
+        if not name.startswith('__') and not isinstance(value, _SKIP_TYPES)
+    ]
+    sizes.sort(key=lambda t: t[2], reverse=True)
+    return sizes[:top]
+
+
+class MemoryMonitor(object):
+
+    # Samples the RSS of the process get_pid() returns every interval
+    # seconds, in a background thread; calls on_soft_limit(rss) or
+    # on_hard_limit(rss) when it goes over soft_limit or hard_limit
+    # (once, until it goes below the limit again). Either limit can be None.
+
+    interval = .2
+
+    def __init__(self, get_pid, soft_limit=None, hard_limit=None,
+                 on_soft_limit=None, on_hard_limit=None):
+        self.get_pid = get_pid
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.on_soft_limit = on_soft_limit
+        self.on_hard_limit = on_hard_limit
+        self._done = threading.Event()
+        self._thread = None
+
+    def check(self, over):
+        # over is the set of limits we're over already; updated in place
+        rss = process_rss(self.get_pid())
+        if rss is None:
+            return
+        for name, limit, callback in [
+                ('soft', self.soft_limit, self.on_soft_limit),
+                ('hard', self.hard_limit, self.on_hard_limit)]:
+            if limit is None:
+                continue
+            if rss < limit:
+                over.discard(name)
+            elif name not in over:
+                over.add(name)
+                if callback:
+                    callback(rss)
+
+    def _target(self):
+        over = set()
+        while not self._done.wait(self.interval):
+            self.check(over)
+
+    def start(self):
+        self._done.clear()
+        self._thread = threading.Thread(target=self._target)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
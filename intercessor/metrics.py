@@ -0,0 +1,114 @@
+import json
+import math
+import time
+import threading
+import collections
+
+
+class Histogram(object):
+
+    # Counts values in power-of-two buckets (values in [2**(e-1), 2**e)
+    # go in bucket e; zero and negative values in bucket None), so it
+    # stays small and cheap to update whatever the scale of the values;
+    # percentiles are accurate to within a factor of two.
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = collections.Counter()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[math.frexp(value)[1] if value > 0 else None] += 1
+
+    def percentile(self, q):
+        # the upper bound of the bucket the q-th percentile is in
+        if not self.count:
+            return None
+        seen = 0
+        for exponent in sorted(self.buckets, key=lambda e: -2000 if e is None else e):
+            seen += self.buckets[exponent]
+            if seen >= self.count * q / 100.:
+                if exponent is None:
+                    return 0
+                return min(math.ldexp(1, exponent), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class KernelMetrics(object):
+
+    # Collects per-call records from kernels (see Kernel.metrics);
+    # a record is a dict with:
+    #
+    # * call_id, status, time (when the call ended)
+    # * serialize_time, bytes_sent: pickling and size of the request
+    # * queue_wait: from the request being sent to the target starting
+    # * target_time: how long the target took
+    # * reply_wait: from the target ending to the reply being received,
+    #   i.e. pickling and sending the reply
+    # * bytes_received, deserialize_time: size and unpickling
+    #   of the reply (and any events before it)
+    # * events: how many events the call sent
+    # * total_time
+    #
+    # The kernel times are missing for calls that died. If export is
+    # given, it gets each record as a JSON line.
+
+    fields = (
+        'serialize_time', 'bytes_sent', 'queue_wait', 'target_time',
+        'reply_wait', 'bytes_received', 'deserialize_time', 'total_time',
+    )
+
+    def __init__(self, export=None):
+        self.export = export
+        self.counters = collections.Counter()
+        self.histograms = dict((name, Histogram()) for name in self.fields)
+        # parallel runs use kernels from multiple threads
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        call['time'] = time.time()
+        with self._lock:
+            self.counters['calls'] += 1
+            self.counters[call['status']] += 1
+            self.counters['events'] += call['events']
+            self.counters['bytes_sent'] += call['bytes_sent']
+            self.counters['bytes_received'] += call['bytes_received']
+            for name in self.fields:
+                value = call.get(name)
+                if value is not None:
+                    self.histograms[name].add(value)
+            if self.export is not None:
+                self.export.write(json.dumps(call, sort_keys=True) + '\n')
+                self.export.flush()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': dict(
+                    (name, histogram.to_dict())
+                    for name, histogram in self.histograms.items()),
+            }
+
+    def dump(self, file):
+        file.write(json.dumps(self.snapshot(), sort_keys=True) + '\n')
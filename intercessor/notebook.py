@@ -1,16 +1,371 @@
 from __future__ import print_function
 
 import re
-from collections import OrderedDict
+import hashlib
+from collections import OrderedDict, namedtuple
+
+
+_header_re = re.compile(r'\s*\n#: +(.*)\n\s*')
+
+
+class _Anchor(object):
+
+    # Where a run of consecutive cells is; see Cell.
+
+    __slots__ = ('offset', 'lineno')
+
+    def __init__(self, offset, lineno):
+        self.offset = offset
+        self.lineno = lineno
+
+
+class Cell(object):
+
+    # lineno is the line in the notebook the cell text starts on (1-based),
+    # offset is the offset in the notebook text the cell text starts at,
+    # and hash is a hash of the cell text (computed when first needed).
+    #
+    # lineno and offset are kept relative to an anchor shared with
+    # the cells around, so when an edit moves all the cells after it,
+    # NotebookParser only has to move the anchors.
+
+    __slots__ = ('name', 'text', '_anchor', '_offset', '_lineno', '_hash')
+
+    def __init__(self, name, text, lineno, offset, anchor=None):
+        self.name = name
+        self.text = text
+        self._anchor = anchor or _Anchor(0, 0)
+        self._offset = offset - self._anchor.offset
+        self._lineno = lineno - self._anchor.lineno
+        self._hash = None
+
+    @property
+    def offset(self):
+        return self._anchor.offset + self._offset
+
+    @property
+    def lineno(self):
+        return self._anchor.lineno + self._lineno
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = hash_text(self.text)
+        return self._hash
+
+    def _move(self, anchor):
+        # same place, different anchor
+        self._offset += self._anchor.offset - anchor.offset
+        self._lineno += self._anchor.lineno - anchor.lineno
+        self._anchor = anchor
+
+    def _key(self):
+        return self.name, self.text, self.lineno, self.offset
+
+    def __eq__(self, other):
+        return isinstance(other, Cell) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'Cell(name={!r}, text={!r}, lineno={!r}, offset={!r})'.format(*self._key())
+
+
+# added, removed and modified are lists of cell names,
+# renamed is a list of (old name, new name) tuples.
+NotebookDiff = namedtuple('NotebookDiff', 'added removed modified renamed')
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _common_prefix_length(a, b, end):
+    # Compare exponentially larger chunks, then bisect the first chunk
+    # that differs; this keeps the comparisons in C.
+    lo, size = 0, 1024
+    while lo < end:
+        hi = min(lo + size, end)
+        if a[lo:hi] != b[lo:hi]:
+            break
+        lo, size = hi, size * 2
+    else:
+        return end
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _common_suffix_length(a, b, end):
+    la, lb = len(a), len(b)
+    lo, size = 0, 1024
+    while lo < end:
+        hi = min(lo + size, end)
+        if a[la-hi:la-lo] != b[lb-hi:lb-lo]:
+            break
+        lo, size = hi, size * 2
+    else:
+        return end
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[la-mid:la-lo] == b[lb-mid:lb-lo]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+class NotebookParser(object):
+
+    # Parses a notebook incrementally: update() only re-parses the region
+    # between the common prefix and suffix of the old and new text, and
+    # returns a NotebookDiff; cells (name -> Cell) is updated in place.
+    #
+    # The header regex is applied sequentially (each search starts where
+    # the previous match ended), so:
+    #
+    # * header matches ending before the first changed character are the
+    #   same in the new text; we resume the scan after the last of them
+    # * once the scan finds a match in the unchanged suffix that is also
+    #   an old match (shifted), the rest of the matches are the old ones
+    #
+    # The cells after the edit keep their Cell objects; they share
+    # anchors (one per up to block_size cells), and only those move.
+    #
+    # The result is always the same as parse_notebook_cells() would give.
+
+    block_size = 256
+
+    def __init__(self):
+        self.cells = OrderedDict()
+        # the padded text ('\n' + text + '\n'); positions below are in it
+        self._text = None
+        # where the first header starts (None if there are no cells)
+        self._start0 = None
+        # one Cell per match, in order; different from cells.values()
+        # if there are duplicate names
+        self._cells = []
+        # the anchors of _cells, in order
+        self._anchors = []
+
+    def _end(self, k):
+        # where match k ends (and cell k starts)
+        return self._cells[k].offset + 1
+
+    def _start(self, k):
+        if not k:
+            return self._start0
+        cell = self._cells[k-1]
+        return cell.offset + 1 + len(cell.text)
+
+    def _bisect_ends(self, pos, lo=0):
+        # the first match ending at pos or later
+        hi = len(self._cells)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._end(mid) < pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _make_cells(self, text, starts, ends, names, next_start, lineno):
+        # cells and anchors for matches; lineno is that of the first one,
+        # next_start where the match after them starts
+        cells = []
+        anchors = []
+        for i in range(len(starts)):
+            end = starts[i+1] if i + 1 < len(starts) else next_start
+            if i % self.block_size == 0:
+                anchors.append(_Anchor(ends[i] - 1, lineno))
+            cells.append(Cell(names[i], text[ends[i]:end], lineno, ends[i] - 1, anchors[-1]))
+            if i + 1 < len(starts):
+                lineno += text.count('\n', ends[i], ends[i+1])
+        return cells, anchors
+
+    def _compact_anchors(self):
+        # splits leave runs of cells shorter than block_size
+        cells = self._cells
+        self._anchors = []
+        for i in range(0, len(cells), self.block_size):
+            anchor = _Anchor(cells[i].offset, cells[i].lineno)
+            self._anchors.append(anchor)
+            for cell in cells[i:i + self.block_size]:
+                cell._move(anchor)
+
+    def update(self, text):
+        text = '\n' + text + '\n'
+        old_text = self._text
+
+        if old_text is None:
+            p = 0
+            s = 0
+        elif text == old_text:
+            return NotebookDiff([], [], [], [])
+        else:
+            end = min(len(old_text), len(text))
+            p = _common_prefix_length(old_text, text, end)
+            s = _common_suffix_length(old_text, text, end - p)
+        delta = len(text) - len(old_text or '')
+        cells = self._cells
+        n = len(cells)
+
+        # matches [0, i) are safe
+        i = self._bisect_ends(p)
+        pos = self._end(i-1) if i else 0
+
+        # matches [j, ...) are the old ones, shifted by delta
+        j = n
+        scanned = []
+        for match in _header_re.finditer(text, pos):
+            start, end = match.span()
+            if old_text is not None and start >= len(text) - s:
+                k = self._bisect_ends(end - delta, i)
+                if (k < n and self._end(k) == end - delta
+                        and self._start(k) == start - delta):
+                    j = k
+                    break
+            scanned.append((start, end, match.group(1)))
+
+        starts = [m[0] for m in scanned]
+        ends = [m[1] for m in scanned]
+        names = [m[2] for m in scanned]
+        next_start = self._start(j) + delta if j < n else len(text)
+
+        # the cell before the first scanned match may have changed too,
+        # since its text ends where that match starts
+        first = max(i - 1, 0)
+        if i:
+            starts.insert(0, self._start(first))
+            ends.insert(0, self._end(first))
+            names.insert(0, cells[first].name)
+            lineno = cells[first].lineno
+        else:
+            lineno = text.count('\n', 0, ends[0]) if ends else 1
+        if i:
+            start0 = self._start0
+        else:
+            start0 = starts[0] if starts else next_start if j < n else None
+        assert text[:start0].strip() == ''
+
+        new_cells, new_anchors = self._make_cells(
+            text, starts, ends, names, next_start, lineno)
+
+        if old_text is None:
+            line_delta = 0
+        else:
+            line_delta = (text.count('\n', p, len(text) - s) -
+                          old_text.count('\n', p, len(old_text) - s))
+
+        # move the anchors of cells [j, ...), giving them their own
+        # if they share one with the cells before
+        anchors = self._anchors
+        lo = anchors.index(cells[first-1]._anchor) + 1 if first else 0
+        tail = []
+        if j < n:
+            anchor = cells[j]._anchor
+            hi = anchors.index(anchor)
+            if j and cells[j-1]._anchor is anchor:
+                split = _Anchor(anchor.offset, anchor.lineno)
+                k = j
+                while k < n and cells[k]._anchor is anchor:
+                    cells[k]._anchor = split
+                    k += 1
+                tail = [split] + anchors[hi+1:]
+            else:
+                tail = anchors[hi:]
+        for anchor in tail:
+            anchor.offset += delta
+            anchor.lineno += line_delta
+
+        old_window = cells[first:j]
+        cells = cells[:first] + new_cells + cells[j:]
+        diff = self._update_cells(cells, old_window, new_cells)
+
+        self._text = text
+        self._start0 = start0
+        self._cells = cells
+        self._anchors = anchors[:lo] + new_anchors + tail
+        if len(self._anchors) > 2 * (len(cells) // self.block_size) + 16:
+            self._compact_anchors()
+        return diff
+
+    def _update_cells(self, cells, old_window, new_window):
+        old_cells = self.cells
+        old_names = set(c.name for c in old_window)
+        new_names = set(c.name for c in new_window)
+
+        # If the window has the same names in the same order, and its
+        # cells are the ones the names map to, positions don't change and
+        # we only need to look at the window; otherwise, it's hard to know
+        # which value and position a name has, so we rebuild everything.
+        simple = (
+            [c.name for c in old_window] == [c.name for c in new_window] and
+            len(old_names) == len(old_window) and
+            all(old_cells.get(c.name) is c for c in old_window)
+        )
+        if simple:
+            new_cells = OrderedDict((c.name, c) for c in new_window)
+        else:
+            new_cells = OrderedDict((c.name, c) for c in cells)
+
+        affected = old_names | new_names
+        added = [n for n in affected if n not in old_cells]
+        removed = [n for n in affected if n not in new_cells]
+        modified = [
+            n for n in affected
+            if n in old_cells and n in new_cells
+            and old_cells[n].hash != new_cells[n].hash
+        ]
+
+        # a cell that went away and a new one with the same text
+        # are a rename
+        renamed = []
+        added_by_hash = {}
+        for name in sorted(added, key=lambda n: new_cells[n].offset):
+            added_by_hash.setdefault(new_cells[name].hash, []).append(name)
+        for name in sorted(removed, key=lambda n: old_cells[n].offset):
+            candidates = added_by_hash.get(old_cells[name].hash)
+            if candidates:
+                new_name = candidates.pop(0)
+                renamed.append((name, new_name))
+                removed.remove(name)
+                added.remove(new_name)
+
+        added.sort(key=lambda n: new_cells[n].offset)
+        removed.sort(key=lambda n: old_cells[n].offset)
+        modified.sort(key=lambda n: new_cells[n].offset)
+
+        if simple:
+            for c in new_window:
+                old_cells[c.name] = c
+        else:
+            old_cells.clear()
+            old_cells.update(new_cells)
+
+        return NotebookDiff(added, removed, modified, renamed)
+
+
+def parse_notebook_cells(text):
+    parser = NotebookParser()
+    parser.update(text)
+    return parser.cells
 
 
 def parse_notebook(text):
-    parts = re.split('\s*\n#: +(.*)\n\s*', '\n'+text+'\n')
+    # just the text, so there's no need for the parser
+    parts = _header_re.split('\n' + text + '\n')
     assert parts[0].strip() == ''
     if len(parts) % 2 == 1:
         parts.append('')
     parts = iter(parts)
     next(parts)
-    parts = zip(parts, parts)
-    return OrderedDict(parts)
-
+    return OrderedDict(zip(parts, parts))
@@ -0,0 +1,183 @@
+import os
+import sys
+import io
+import shutil
+import tempfile
+import threading
+import contextlib
+from collections import deque
+
+from . import kernel
+
+
+class OutputBatcher(object):
+
+    # Kernel side: collects writes to stdout and stderr and sends them
+    # to the parent in batches, as ('output', [(stream name, text), ...])
+    # events (see kernel.emit()); consecutive writes to the same stream
+    # are merged. A batch is sent when it gets to batch_size characters,
+    # or by a background thread every interval seconds.
+
+    batch_size = 64 * 1024
+    interval = .05
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    def write(self, name, text):
+        with self._lock:
+            if self._chunks and self._chunks[-1][0] == name:
+                self._chunks[-1][1].append(text)
+            else:
+                self._chunks.append((name, [text]))
+            self._size += len(text)
+            if self._size >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._chunks:
+            return
+        chunks = [(name, ''.join(parts)) for name, parts in self._chunks]
+        self._chunks = []
+        self._size = 0
+        kernel.emit(('output', chunks))
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _target(self):
+        while not self._done.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self._done.clear()
+        self._thread = threading.Thread(target=self._target)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+
+class OutputStream(io.TextIOBase):
+
+    def __init__(self, batcher, name, original):
+        self._batcher = batcher
+        self.name = name
+        self._original = original
+
+    @property
+    def encoding(self):
+        return getattr(self._original, 'encoding', 'utf-8')
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._batcher.write(self.name, text)
+        return len(text)
+
+    def flush(self):
+        self._batcher.flush()
+
+
+@contextlib.contextmanager
+def capture_output():
+    # Redirect stdout and stderr to the parent, if running in a kernel call.
+    if kernel._current_call is None:
+        yield
+        return
+
+    batcher = OutputBatcher()
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout = OutputStream(batcher, 'stdout', old_stdout)
+    sys.stderr = OutputStream(batcher, 'stderr', old_stderr)
+    batcher.start()
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+        batcher.stop()
+
+
+class OutputBuffer(object):
+
+    # Driver side: keeps the output of the last cell run.
+    #
+    # All the output goes to a temporary file (so it can be paged or saved
+    # later), but only the first max_lines lines are shown as they come;
+    # after that, output is collapsed: only the last tail_lines lines are
+    # kept (in a ring buffer), and shown when the run ends.
+
+    def __init__(self, max_lines=1000, tail_lines=20):
+        self.max_lines = max_lines
+        self.tail_lines = tail_lines
+        self.path = None
+        self._file = None
+        self._lines = 0
+        self._hidden = 0
+        self._tail = deque(maxlen=tail_lines)
+        self._partial = ''
+
+    def start(self):
+        self.close()
+        fd, self.path = tempfile.mkstemp(prefix='intercessor-output-', suffix='.txt')
+        self._file = io.open(fd, 'w', encoding='utf-8', errors='replace')
+        self._lines = 0
+        self._hidden = 0
+        self._tail.clear()
+        self._partial = ''
+
+    def write(self, text):
+        # returns the part of text that should be shown now
+        self._file.write(text)
+        if self._lines >= self.max_lines:
+            self._collapse(text)
+            return ''
+
+        lines = text.splitlines(True)
+        shown = lines[:self.max_lines - self._lines]
+        rest = lines[len(shown):]
+        self._lines += sum(1 for line in shown if line.endswith('\n'))
+        if rest:
+            self._collapse(''.join(rest))
+        return ''.join(shown)
+
+    def _collapse(self, text):
+        lines = (self._partial + text).splitlines(True)
+        self._partial = ''
+        if lines and not lines[-1].endswith('\n'):
+            self._partial = lines.pop()
+        self._hidden += len(lines)
+        self._tail.extend(lines)
+
+    def finish(self):
+        # returns the number of hidden lines, and the tail to show
+        self._file.flush()
+        if self._partial:
+            self._hidden += 1
+            self._tail.append(self._partial)
+            self._partial = ''
+        if not self._hidden:
+            return 0, ''
+        tail = list(self._tail)
+        return self._hidden - len(tail), ''.join(tail)
+
+    def save(self, path):
+        self._file.flush()
+        shutil.copyfile(self.path, path)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            os.remove(self.path)
+        self._file = None
+        self.path = None
@@ -0,0 +1,180 @@
+import os
+import os.path
+import sys
+import time
+import inspect
+import sysconfig
+import traceback
+
+try:
+    from importlib import reload as reload_module
+except ImportError:
+    reload_module = reload
+
+try:
+    from importlib.util import cache_from_source
+except ImportError:
+    cache_from_source = lambda path: path + 'c'
+
+
+_ignored_dirs_cache = None
+
+
+def _ignored_dirs():
+    # Python itself, installed packages, and intercessor
+    global _ignored_dirs_cache
+    if _ignored_dirs_cache is None:
+        paths = sysconfig.get_paths()
+        dirs = set(
+            paths[key] for key in ('stdlib', 'platstdlib', 'purelib', 'platlib')
+            if key in paths)
+        dirs.add(os.path.dirname(os.path.abspath(__file__)))
+        _ignored_dirs_cache = tuple(os.path.realpath(d) + os.sep for d in dirs)
+    return _ignored_dirs_cache
+
+
+def module_source(module):
+    # the .py file of module, if it has one
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    if filename.endswith(('.pyc', '.pyo')):
+        filename = filename[:-1]
+    if not filename.endswith('.py'):
+        return None
+    return os.path.realpath(filename)
+
+
+def remove_bytecode(module):
+    # Bytecode is only checked against the source mtime (in seconds) and
+    # size, so an edit made right after the module was imported may not
+    # be seen; remove it, so the module is compiled again.
+    filename = module_source(module)
+    if filename:
+        try:
+            os.remove(cache_from_source(filename))
+        except (OSError, ValueError, NotImplementedError):
+            pass
+
+
+# name -> (module, user source file or None), as of the last user_modules()
+_user_sources = {}
+
+
+def user_modules():
+    # name -> source file of the modules imported (from .py files)
+    # that are not part of Python or of an installed package;
+    # called after every cell, so module_source() (a realpath())
+    # is only called for the modules imported since the last call
+    global _user_sources
+    ignored = _ignored_dirs()
+    sources = {}
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        if module is None or name == '__main__':
+            continue
+        source = _user_sources.get(name)
+        if source is None or source[0] is not module:
+            filename = module_source(module)
+            if filename and filename.startswith(ignored):
+                filename = None
+            source = module, filename
+        sources[name] = source
+        if source[1]:
+            modules[name] = source[1]
+    _user_sources = sources
+    return modules
+
+
+def module_dependencies(names):
+    # name -> the names (out of names) of the modules it uses,
+    # i.e. that it has a module, class or function of in its namespace
+    names = set(names)
+    deps = {}
+    for name in names:
+        module = sys.modules.get(name)
+        deps[name] = set()
+        for value in list(vars(module).values()) if module else ():
+            if inspect.ismodule(value):
+                other = value.__name__
+            else:
+                other = getattr(value, '__module__', None)
+            if other in names and other != name:
+                deps[name].add(other)
+    return deps
+
+
+def reload_order(changed, deps):
+    # The changed modules and the ones that use them (directly or not),
+    # the modules they use first; deps is module_dependencies() output.
+    users = dict((name, set()) for name in deps)
+    for name, used in deps.items():
+        for other in used:
+            users[other].add(name)
+
+    affected = set()
+    stack = [name for name in changed if name in deps]
+    while stack:
+        name = stack.pop()
+        if name not in affected:
+            affected.add(name)
+            stack.extend(users[name])
+
+    order = []
+    done = set()
+    remaining = sorted(affected)
+    while remaining:
+        ready = [n for n in remaining if not (deps[n] & affected) - done]
+        # import cycle; break it in name order
+        ready = ready or remaining[:1]
+        order.extend(ready)
+        done.update(ready)
+        remaining = [n for n in remaining if n not in done]
+    return order
+
+
+def rebind(namespace, modules):
+    # Point names in namespace bound to (the old version of) classes and
+    # functions from modules to the new ones; returns the names rebound.
+    # Modules themselves are reloaded in place, so they're fine already.
+    rebound = []
+    for name, value in list(namespace.items()):
+        if not (inspect.isclass(value) or inspect.isfunction(value)):
+            continue
+        module = modules.get(getattr(value, '__module__', None))
+        new = getattr(module, getattr(value, '__name__', ''), value)
+        if new is not value:
+            namespace[name] = new
+            rebound.append(name)
+    return sorted(rebound)
+
+
+def reload_modules(changed, namespace):
+    # Reload the changed modules (names) and the ones that use them,
+    # in dependency order, and update namespace; returns a dict with:
+    #
+    # * reloaded: the modules reloaded, in order
+    # * rebound: the names in namespace updated
+    # * error: the exception type name and the module that raised it,
+    #   if any did (the modules after it are not reloaded)
+    # * time: how long it took
+    start = time.time()
+    order = reload_order(changed, module_dependencies(user_modules()))
+    reloaded = []
+    error = None
+    for name in order:
+        try:
+            remove_bytecode(sys.modules[name])
+            reload_module(sys.modules[name])
+        except Exception as e:
+            traceback.print_exc()
+            error = type(e).__name__, name
+            break
+        reloaded.append(name)
+    rebound = rebind(namespace, dict((name, sys.modules[name]) for name in reloaded))
+    return {
+        'reloaded': reloaded,
+        'rebound': rebound,
+        'error': error,
+        'time': time.time() - start,
+    }
@@ -0,0 +1,174 @@
+import io
+import zlib
+import struct
+import pickle
+
+try:
+    from multiprocessing.reduction import ForkingPickler as _ForkingPickler
+except ImportError:
+    _ForkingPickler = None
+
+try:
+    import cloudpickle
+except ImportError:
+    cloudpickle = None
+
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+
+class SerializationError(Exception):
+
+    # A value that could not be pickled or unpickled, on either side;
+    # the kernel is fine. where is 'request' or 'reply' (or, from
+    # Channel, 'send' or 'receive'), error is the original exception
+    # type name, and message its message.
+
+    def __init__(self, where, error, message=''):
+        super(SerializationError, self).__init__(
+            "could not (de)serialize the {}: {}: {}".format(where, error, message))
+        self.where = where
+        self.error = error
+        self.message = message
+
+
+class PickleSerializer(object):
+
+    # Serializers turn messages into bytes and back (see Channel).
+    # If buffer_callback is given (pickle protocol 5), dumps() passes it
+    # the buffers that could go out of band, like Pickler does, and
+    # loads() gets the ones that did in buffers.
+    #
+    # This one uses the highest pickle protocol, with the reducers
+    # multiprocessing registers (for sockets, connections, and so on).
+
+    name = 'pickle'
+    protocol = pickle.HIGHEST_PROTOCOL
+
+    def pickler(self, file, protocol, buffer_callback=None):
+        if buffer_callback is None:
+            return _ForkingPickler(file, protocol)
+        # ForkingPickler only takes positional arguments
+        return _ForkingPickler(file, protocol, True, buffer_callback)
+
+    def dump(self, obj, file, buffer_callback=None):
+        self.pickler(file, self.protocol, buffer_callback).dump(obj)
+
+    def dumps(self, obj, buffer_callback=None):
+        f = io.BytesIO()
+        self.dump(obj, f, buffer_callback)
+        return f.getbuffer() if hasattr(f, 'getbuffer') else f.getvalue()
+
+    def loads(self, data, buffers=None):
+        if buffers is None:
+            return pickle.loads(data)
+        return pickle.loads(data, buffers=buffers)
+
+
+class CloudPickleSerializer(PickleSerializer):
+
+    # Can also pickle lambdas, nested functions, classes defined
+    # in the kernel, and so on (by value); needs cloudpickle.
+
+    name = 'cloudpickle'
+
+    def __init__(self):
+        if cloudpickle is None:
+            raise ValueError("cloudpickle is not installed")
+
+    def pickler(self, file, protocol, buffer_callback=None):
+        if buffer_callback is None:
+            return cloudpickle.CloudPickler(file, protocol)
+        return cloudpickle.CloudPickler(file, protocol, buffer_callback=buffer_callback)
+
+
+def _lz4_compress(data):
+    return lz4_block.compress(data, store_size=False)
+
+
+def _lz4_decompress(data, size):
+    return lz4_block.decompress(data, uncompressed_size=size)
+
+
+_COMPRESSORS = {
+    'zlib': (lambda data: zlib.compress(data, 1), lambda data, size: zlib.decompress(data)),
+    'lz4': (_lz4_compress, _lz4_decompress),
+}
+
+# codec (b'-' for none, b'z' zlib, b'l' lz4), uncompressed size
+_header = struct.Struct('!cQ')
+_CODECS = {None: b'-', 'zlib': b'z', 'lz4': b'l'}
+_CODEC_NAMES = dict((v, k) for k, v in _CODECS.items())
+
+
+class CompressedSerializer(object):
+
+    # Compresses what serializer (a PickleSerializer) makes, if it's
+    # at least threshold bytes; the message starts with a header saying
+    # how (if at all) it's compressed, and its uncompressed size.
+    # Out-of-band buffers are not compressed.
+    #
+    # Data that doesn't compress (already compressed images, random
+    # numbers) takes as long to compress as any other, for nothing;
+    # if a sample of it doesn't get smaller by at least min_saving,
+    # it's sent as is.
+
+    sample_size = 64 * 1024
+    min_saving = .1
+
+    def __init__(self, serializer, compression='zlib', threshold=64 * 1024):
+        if compression == 'lz4' and lz4_block is None:
+            raise ValueError("lz4 is not installed")
+        if compression not in _COMPRESSORS:
+            raise ValueError("unknown compression: {}".format(compression))
+        self.serializer = serializer
+        self.compression = compression
+        self.threshold = threshold
+        self.name = '{}+{}'.format(serializer.name, compression)
+
+    def dumps(self, obj, buffer_callback=None):
+        # Pickle after room for the header, and fill it in after, so
+        # uncompressed messages (most of them) aren't copied.
+        f = io.BytesIO()
+        f.write(_header.pack(_CODECS[None], 0))
+        self.serializer.dump(obj, f, buffer_callback)
+        size = f.tell() - _header.size
+        if hasattr(f, 'getbuffer'):
+            message = f.getbuffer()
+        else:
+            message = bytearray(f.getvalue())
+        if size >= self.threshold:
+            compress, _ = _COMPRESSORS[self.compression]
+            data = memoryview(message)[_header.size:]
+            sample = data[size // 2:size // 2 + self.sample_size]
+            if len(compress(sample)) <= len(sample) * (1 - self.min_saving):
+                return _header.pack(_CODECS[self.compression], size) + compress(data)
+        _header.pack_into(message, 0, _CODECS[None], size)
+        return message
+
+    def loads(self, data, buffers=None):
+        data = memoryview(data)
+        codec, size = _header.unpack_from(data)
+        data = data[_header.size:]
+        compression = _CODEC_NAMES[codec]
+        if compression is not None:
+            _, decompress = _COMPRESSORS[compression]
+            data = decompress(data, size)
+        return self.serializer.loads(data, buffers)
+
+
+def get_serializer(spec):
+    # 'pickle', 'cloudpickle', optionally followed by +zlib or +lz4
+    # (e.g. 'cloudpickle+lz4'); raises ValueError if not available
+    name, _, compression = spec.partition('+')
+    if name == 'pickle':
+        serializer = PickleSerializer()
+    elif name == 'cloudpickle':
+        serializer = CloudPickleSerializer()
+    else:
+        raise ValueError("unknown serializer: {}".format(name))
+    if compression:
+        serializer = CompressedSerializer(serializer, compression)
+    return serializer
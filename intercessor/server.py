@@ -0,0 +1,52 @@
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import functools
+
+from .driver import Target
+from .kernel import Kernel, KernelServer
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='intercessor serve',
+        description="Run a kernel that outlives the drivers using it; "
+                    "attach to it with 'intercessor NOTEBOOK --attach SOCKET'. "
+                    "Drivers attach one at a time; exiting one only detaches it.")
+    parser.add_argument('address', metavar='SOCKET', help="the Unix socket to listen on")
+    parser.add_argument(
+        '--stop', action='store_true',
+        help="stop the kernel server listening on SOCKET")
+    parser.add_argument(
+        '--cache', metavar='DIR', dest='cache_path',
+        help="use the result cache in DIR (see intercessor --help)")
+    parser.add_argument(
+        '--cache-size', type=int, default=1024, metavar='MIB',
+        help="maximum size of the cache (default: %(default)s)")
+    parser.add_argument(
+        '--cache-min-time', type=float, default=1, metavar='SECONDS',
+        help="only cache cells that took at least this long to run "
+             "(default: %(default)s)")
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args(args)
+
+    if args.stop:
+        KernelServer(args.address).close()
+        return 0
+
+    if os.path.exists(args.address):
+        print("{} already exists; is a server running?".format(args.address), file=sys.stderr)
+        return 1
+
+    make_target = Target
+    if args.cache_path:
+        make_target = functools.partial(
+            Target, args.cache_path, args.cache_size * 1024 ** 2, args.cache_min_time)
+    print("kernel {} listening on {}".format(os.getpid(), args.address), file=sys.stderr)
+    try:
+        Kernel.serve(args.address, make_target, args.debug)
+    except KeyboardInterrupt:
+        pass
+    return 0
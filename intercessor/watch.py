@@ -1,9 +1,15 @@
 import os
 import os.path
+import sys
+import errno
 import signal
 import contextlib
 import time
 import threading
+import select
+import struct
+import ctypes
+import ctypes.util
 
 
 class WatchAlarm(Exception): pass
@@ -16,11 +22,19 @@ _ENABLED = object()
 
 class BaseWatch(object):
 
+    # Besides path, a watch can keep track of other files (see
+    # watch_paths()); changes to them don't alarm, and are collected
+    # in changed_paths instead.
+
     def __init__(self, path):
         self.path = os.path.abspath(path)
         self._state = _STOPPED
         self._changed = False
         self._old_signal_handler = None
+        self._paths = frozenset()
+        self._changed_paths = set()
+        self._lock = threading.Lock()
+        self._callback = None
 
     @contextlib.contextmanager
     def alarm(self):
@@ -32,6 +46,21 @@ class BaseWatch(object):
             assert self._state is _ENABLED, "not enabled"
             self._state = _STARTED
 
+    @contextlib.contextmanager
+    def callback(self, function):
+        # Like alarm(), but a change calls function (in the watch thread)
+        # instead of raising WatchAlarm, for code that must not be
+        # interrupted at an arbitrary point; function isn't called
+        # once this exits.
+        assert self._state is _STARTED, "not started"
+        with self._lock:
+            self._callback = function
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._callback = None
+
     def start(self):
         assert self._state is _STOPPED, "already started"
         self._state = _STARTED
@@ -52,6 +81,28 @@ class BaseWatch(object):
         self._changed = False
         return rv
 
+    def watch_paths(self, paths):
+        # replaces the paths watched before
+        paths = frozenset(os.path.abspath(p) for p in paths)
+        if paths != self._paths:
+            self._paths = paths
+            self._update_paths()
+
+    @property
+    def changed_paths(self):
+        with self._lock:
+            rv = self._changed_paths
+            self._changed_paths = set()
+        return rv
+
+    def _path_changed(self, path):
+        if path in self._paths:
+            with self._lock:
+                self._changed_paths.add(path)
+
+    def _update_paths(self):
+        pass
+
     def _start(self):
         raise NotImplementedError
 
@@ -59,6 +110,11 @@ class BaseWatch(object):
         raise NotImplementedError
 
     def _alarm(self):
+        with self._lock:
+            if self._callback is not None:
+                self._changed = True
+                self._callback()
+                return
         if self._state is _ENABLED:
             self._changed = True
             os.kill(os.getpid(), signal.SIGALRM)
@@ -86,15 +142,38 @@ class StatWatch(BaseWatch):
         super(StatWatch, self).__init__(*args, **kwargs)
         self._done = True
         self._mtime = None
+        self._mtimes = {}
         self._thread = None
 
+    def _check_paths(self):
+        for path in self._paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            mtime = stat.st_mtime, stat.st_ino
+            if self._mtimes.setdefault(path, mtime) != mtime:
+                self._mtimes[path] = mtime
+                self._path_changed(path)
+
     def _target(self):
         while not self._done:
-            mtime = os.stat(self.path).st_mtime
+            self._check_paths()
+            # Editors that save by renaming a temporary file over the
+            # original leave a window where the path does not exist;
+            # just try again on the next tick.
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                time.sleep(.1)
+                continue
+            mtime = stat.st_mtime, stat.st_ino
             if self._mtime is None:
                 self._mtime = mtime
                 continue
-            elif mtime > self._mtime:
+            elif mtime != self._mtime:
                 self._mtime = mtime
                 self._alarm()
             time.sleep(.1)
@@ -108,8 +187,190 @@ class StatWatch(BaseWatch):
         self._done = True
         self._thread.join()
         self._mtime = None
+        self._mtimes = {}
+        self._thread = None
+
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _libc = None
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_IGNORED = 0x8000
+_IN_NONBLOCK = os.O_NONBLOCK
+# the same values as the inotify ones on Linux
+_IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+_inotify_event = struct.Struct('iIII')
+
+
+class InotifyWatch(BaseWatch):
+
+    # We watch the file itself for writes, and the directory containing
+    # it for files created or renamed into it, so we see editors that
+    # save by renaming a temporary file over the original (the original
+    # inode goes away in that case; we then watch the new one). Writes to
+    # other files in the directory (logs, say) don't wake us up at all.
+    #
+    # Bursts of events are coalesced into a single alarm: after the first
+    # event, we keep reading until there are no new events for our file
+    # for coalesce_delay seconds, but for no more than max_coalesce_delay.
+
+    dir_mask = _IN_MOVED_TO | _IN_CREATE
+    file_mask = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE
+    coalesce_delay = .02
+    max_coalesce_delay = .2
+
+    def __init__(self, *args, **kwargs):
+        super(InotifyWatch, self).__init__(*args, **kwargs)
+        self._fd = None
+        # directory -> watch descriptor; watch descriptor -> {file name: path}
+        # for directories, and -> path for files; the watch thread uses
+        # the last two, with _wds_lock held
+        self._dir_wds = {}
+        self._dir_names = {}
+        self._file_wds = {}
+        self._wds_lock = threading.Lock()
+        self._wakeup_fds = None
+        self._thread = None
+
+    def _add_watch(self, path, mask):
+        wd = _libc.inotify_add_watch(
+            self._fd, path.encode(sys.getfilesystemencoding()), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def _watch_file(self, path, file_wds):
+        # if it doesn't exist, we'll see it being created
+        try:
+            file_wds[self._add_watch(path, self.file_mask)] = path
+        except OSError:
+            pass
+
+    def _update_paths(self):
+        if self._fd is None:
+            return
+        paths = set((self.path, ) + tuple(self._paths))
+        with self._wds_lock:
+            file_wds = {}
+            for wd, path in self._file_wds.items():
+                if path in paths:
+                    file_wds[wd] = path
+                else:
+                    _libc.inotify_rm_watch(self._fd, wd)
+            dir_names = {}
+            for path in paths:
+                dirname, basename = os.path.split(path)
+                wd = self._dir_wds.get(dirname)
+                if wd is None:
+                    try:
+                        wd = self._dir_wds[dirname] = self._add_watch(dirname, self.dir_mask)
+                    except OSError:
+                        if path == self.path:
+                            raise
+                        continue
+                dir_names.setdefault(wd, {})[
+                    basename.encode(sys.getfilesystemencoding())] = path
+                if path not in file_wds.values():
+                    self._watch_file(path, file_wds)
+            self._file_wds = file_wds
+            self._dir_names = dir_names
+
+    def _read_events(self):
+        # Read all the pending events; return true if any are for our file.
+        rv = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return rv
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _inotify_event.unpack_from(data, offset)
+                offset += _inotify_event.size
+                name = data[offset:offset+length].rstrip(b'\0')
+                offset += length
+                with self._wds_lock:
+                    if name:
+                        path = self._dir_names.get(wd, {}).get(name)
+                        if path and mask & self.dir_mask:
+                            # a new file (inode)
+                            self._watch_file(path, self._file_wds)
+                    elif mask & self.file_mask:
+                        path = self._file_wds.get(wd)
+                    else:
+                        # the watch went away, e.g. with the inode
+                        # of a replaced file
+                        if mask & _IN_IGNORED:
+                            self._file_wds.pop(wd, None)
+                        path = None
+                if path == self.path:
+                    rv = True
+                elif path:
+                    self._path_changed(path)
+
+    def _target(self):
+        fds = [self._fd, self._wakeup_fds[0]]
+        while True:
+            ready, _, _ = select.select(fds, [], [])
+            if self._wakeup_fds[0] in ready:
+                break
+            if not self._read_events():
+                continue
+            deadline = time.time() + self.max_coalesce_delay
+            quiet_at = time.time() + self.coalesce_delay
+            while True:
+                timeout = min(quiet_at, deadline) - time.time()
+                if timeout <= 0:
+                    break
+                ready, _, _ = select.select(fds, [], [], timeout)
+                if self._wakeup_fds[0] in ready:
+                    break
+                if ready and self._read_events():
+                    quiet_at = time.time() + self.coalesce_delay
+            self._alarm()
+
+    def _start(self):
+        fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        try:
+            self._update_paths()
+        except OSError:
+            os.close(fd)
+            self._fd = None
+            self._dir_wds = {}
+            raise
+        self._wakeup_fds = os.pipe()
+        self._thread = threading.Thread(target=self._target)
+        self._thread.start()
+
+    def _stop(self):
+        os.write(self._wakeup_fds[1], b'x')
+        self._thread.join()
+        for fd in (self._fd, ) + self._wakeup_fds:
+            os.close(fd)
+        self._fd = None
+        self._dir_wds = {}
+        self._dir_names = {}
+        self._file_wds = {}
+        self._wakeup_fds = None
         self._thread = None
 
 
-watch_file = StatWatch
+if _libc is not None and hasattr(_libc, 'inotify_init1'):
+    watch_file = InotifyWatch
+else:
+    watch_file = StatWatch
 
@@ -0,0 +1,70 @@
+import pytest
+
+asyncio = pytest.importorskip('asyncio')
+
+from intercessor.kernel import KernelError
+from intercessor.aio import AsyncKernel, KernelInterrupted
+from intercessor.serialize import SerializationError
+
+from test_kernel import make_kill_self, make_sleep
+from test_kernel import make_return_unpickleable, BadOnLoad
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def make_slow_double():
+    def slow_double(i):
+        import time
+        time.sleep(.01)
+        return i * 2
+    return slow_double
+
+def test_async_kernel():
+    async def main():
+        async with AsyncKernel(make_slow_double) as kernel:
+            assert kernel.start_time > 0
+            futures = [kernel(i) for i in range(20)]
+            assert await asyncio.gather(*futures) == [i * 2 for i in range(20)]
+            return kernel
+    kernel = run(main())
+    assert not kernel.kernel._process.is_alive()
+
+
+def test_async_kernel_death():
+    async def main():
+        async with AsyncKernel(make_kill_self) as kernel:
+            futures = [kernel() for i in range(3)]
+            for future in futures:
+                with pytest.raises(KernelError):
+                    await future
+            with pytest.raises(KernelError):
+                kernel()
+    run(main())
+
+
+def test_async_kernel_interrupt():
+    async def main():
+        async with AsyncKernel(make_sleep) as kernel:
+            future = kernel()
+            await asyncio.sleep(.5)
+            kernel.interrupt()
+            with pytest.raises(KernelInterrupted):
+                await asyncio.wait_for(future, 2)
+    run(main())
+
+
+def test_async_kernel_unpickleable():
+    import threading
+
+    async def main():
+        async with AsyncKernel(make_return_unpickleable) as kernel:
+            futures = [kernel(1), kernel(), kernel(BadOnLoad()), kernel(threading.Lock()), kernel(2)]
+            results = await asyncio.wait_for(
+                asyncio.gather(*futures, return_exceptions=True), 5)
+            assert results[0] == 1 and results[4] == 2
+            for error, where in zip(results[1:4], ['reply', 'request', 'request']):
+                assert isinstance(error, SerializationError)
+                assert error.where == where
+    run(main())
@@ -0,0 +1,110 @@
+import json
+import textwrap
+
+from intercessor.batch import BatchDriver, run_notebooks, main
+
+
+NOTEBOOK = textwrap.dedent("""\
+    #: one
+    x = 1
+    print('one', x)
+
+    #: two
+    y = x + 1
+    print('two', y)
+
+    #: three
+    1 / 0
+
+    #: four
+    print('four')
+""")
+
+
+class Stream(list):
+
+    def write(self, text):
+        self.append(text)
+
+    def writelines(self, lines):
+        self.extend(lines)
+
+    def flush(self):
+        pass
+
+
+def make_notebook(tmpdir, name='notebook.py', text=NOTEBOOK):
+    path = tmpdir.join(name)
+    path.write(text)
+    return str(path)
+
+
+def test_batch_driver(tmpdir):
+    out, err = Stream(), Stream()
+    driver = BatchDriver(make_notebook(tmpdir), streams={'stdout': out, 'stderr': err})
+    driver.loop()
+
+    assert driver.failed
+    assert [(r['name'], r['error']) for r in driver.results] == [
+        ('one', None), ('two', None), ('three', 'ZeroDivisionError')]
+    assert all(r['wall_time'] >= 0 for r in driver.results)
+    assert ''.join(out) == 'one 1\ntwo 2\n'
+    assert 'ZeroDivisionError' in ''.join(err)
+
+
+def test_batch_driver_cells(tmpdir):
+    out = Stream()
+    driver = BatchDriver(
+        make_notebook(tmpdir), ['one', 'four', 'two'],
+        streams={'stdout': out, 'stderr': Stream()}, prefix='nb: ')
+    driver.loop()
+
+    assert not driver.failed
+    assert [r['name'] for r in driver.results] == ['one', 'four', 'two']
+    assert out == ['nb: one 1\n', 'nb: four\n', 'nb: two 2\n']
+
+
+def test_batch_driver_keep_going(tmpdir):
+    driver = BatchDriver(
+        make_notebook(tmpdir), ['three', 'nope', 'four'], keep_going=True,
+        streams={'stdout': Stream(), 'stderr': Stream()})
+    driver.loop()
+
+    assert driver.failed
+    assert [(r['name'], r['error']) for r in driver.results] == [
+        ('three', 'ZeroDivisionError'), ('nope', 'CellDoesNotExist'), ('four', None)]
+
+
+def test_run_notebooks(tmpdir):
+    paths = [
+        make_notebook(tmpdir, 'ok-{}.py'.format(i), "#: a\nprint('a')\n")
+        for i in range(3)
+    ]
+    paths.insert(1, make_notebook(tmpdir))
+    reported = []
+
+    results = run_notebooks(
+        paths, jobs=2, report=lambda path, result: reported.append(path))
+
+    assert [path for path, _ in results] == paths
+    assert [driver.failed for _, driver in results] == [False, True, False, False]
+    assert sorted(reported) == sorted(paths[:1] + [paths[1]] * 3 + paths[2:])
+
+
+def test_main(tmpdir, capfd):
+    ok = make_notebook(tmpdir, 'ok.py', "#: a\nprint('a')\n")
+    timings = str(tmpdir.join('timings.json'))
+
+    assert main([ok, '--timings', timings]) == 0
+    assert main([ok, make_notebook(tmpdir), '--jobs', '2']) == 1
+    assert main([make_notebook(tmpdir), '--cell', 'one', '--cell', 'two']) == 0
+
+    with open(timings) as f:
+        data = json.load(f)
+    assert [d['path'] for d in data] == [ok]
+    assert [c['name'] for c in data[0]['cells']] == ['a']
+    assert data[0]['cells'][0]['wall_time'] >= 0
+
+    err = capfd.readouterr().err
+    assert "ok.py: 'a' ok" in err
+    assert "notebook.py: 'three' ZeroDivisionError" in err
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from intercessor.cache import ResultCache
+
+
+def test_cache(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')))
+    assert cache.get('one') is None
+    assert cache.entries() == []
+
+    assert cache.put('one', {'x': 1, 'os': os})
+    assert cache.get('one') == {'x': 1, 'os': os}
+    assert not cache.put('two', {'x': 1, 'f': lambda: None})
+    assert cache.get('two') is None
+    assert [e.key for e in cache.entries()] == ['one']
+
+    cache.clear()
+    assert cache.get('one') is None
+
+
+def test_cache_broken_entry(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')))
+    assert cache.put('one', {'x': list(range(1000))})
+    path = os.path.join(cache._entry_path('one'), 'values.pickle')
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    assert cache.get('one') is None
+    assert cache.entries() == []
+
+    # a module that isn't there anymore
+    assert cache.put('two', {'x': 1, 'os': os})
+    path = os.path.join(cache._entry_path('two'), 'values.pickle')
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data.replace(b'os', b'no'))
+    assert cache.get('two') is None
+    assert cache.entries() == []
+
+
+def test_cache_evict(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')), max_size=2500)
+    for key in 'abc':
+        assert cache.put(key, {'x': b'x' * 1000})
+        os.utime(cache._entry_path(key), (0, {'a': 1, 'b': 3, 'c': 2}[key]))
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+    assert sorted(e.key for e in cache.entries()) == ['b', 'c']
+
+
+def test_cache_numpy(tmpdir):
+    numpy = pytest.importorskip('numpy')
+    cache = ResultCache(str(tmpdir.join('cache')))
+    assert cache.put('one', {'a': numpy.arange(10)})
+    assert (cache.get('one')['a'] == numpy.arange(10)).all()
+    assert len(os.listdir(cache._entry_path('one'))) == 2
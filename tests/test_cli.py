@@ -71,3 +71,39 @@ def test_cli(tmpdir, monkeypatch):
     time.sleep(.1)
     assert not p.isalive()
 
+
+
+def test_completer():
+    from intercessor.cli import Completer
+
+    calls = []
+
+    def get_names():
+        calls.append(None)
+        return ['one_value', 'data', 'two']
+
+    completer = Completer(get_names)
+    completer.update_words(['two', 'one', 'three', 'one more'])
+
+    def complete(text):
+        rv = []
+        while True:
+            match = completer(text, len(rv))
+            if match is None:
+                return rv
+            rv.append(match)
+
+    assert complete('t') == ['three', 'two']
+    assert complete('one') == ['one', 'one more', 'one_value']
+    assert complete('d') == ['data ']
+    assert complete('x') == []
+    assert len(calls) == 1
+
+    completer.update_words(['four'], ['three'])
+    assert complete('t') == ['two ']
+    assert complete('f') == ['four ']
+    assert len(calls) == 1
+
+    completer.invalidate_names()
+    assert complete('') == ['four', 'one', 'one more', 'two', 'data', 'one_value']
+    assert len(calls) == 2
@@ -0,0 +1,55 @@
+import textwrap
+
+import pytest
+
+from intercessor.deps import cell_names, Dependencies
+from intercessor.notebook import parse_notebook_cells
+
+
+@pytest.mark.parametrize('text, defines, reads', [
+    ("x = 1\nprint(x)", {'x'}, {'print'}),
+    ("x += y", {'x'}, {'x', 'y'}),
+    ("import os.path, sys as system\nfrom a import b", {'os', 'system', 'b'}, set()),
+    ("def f(a, b=c):\n    return a + d", {'f'}, {'c', 'd'}),
+    ("class C(B):\n    def m(self):\n        return q", {'C'}, {'B', 'q'}),
+    ("[i * k for i in r]", set(), {'k', 'r'}),
+    ("with open(p) as f:\n    pass", {'f'}, {'open', 'p'}),
+    ("del x", {'x'}, set()),
+    ("syntax error(", set(), set()),
+])
+def test_cell_names(text, defines, reads):
+    names = cell_names(text)
+    assert names.defines == defines
+    assert names.reads == reads
+
+
+@pytest.mark.parametrize('text, mutates, imports', [
+    ("data.append(4)", {'data'}, set()),
+    ("x.a = 1\ny[0] += 1\ndel z[1]", {'x', 'y', 'z'}, set()),
+    ("a = np.mean(data)", {'np'}, set()),
+    ("d = []\nd.append(1)", set(), set()),
+    ("f = lambda: q.pop()", {'q'}, set()),
+    ("import numpy as np\nfrom a import b\nb = 1", set(), {'np'}),
+])
+def test_cell_names_mutates(text, mutates, imports):
+    names = cell_names(text)
+    assert names.mutates == mutates
+    assert names.imports == imports
+
+
+def test_dependencies():
+    cells = parse_notebook_cells(textwrap.dedent("""\
+        #: one
+        x = 1
+        #: two
+        y = x + 1
+        #: three
+        x = 2
+        #: four
+        print(x, y)
+    """))
+    deps = Dependencies()
+    upstream = deps.upstream(cells)
+    assert upstream == {
+        'one': [], 'two': ['one'], 'three': [], 'four': ['two', 'three']}
+    assert deps.ancestors(upstream, 'four') == {'one', 'two', 'three'}
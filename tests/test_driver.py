@@ -0,0 +1,695 @@
+import os
+import threading
+import time
+import linecache
+import textwrap
+
+import pytest
+
+from intercessor.driver import Target, BaseDriver
+from intercessor.driver import CacheOptions, CheckpointOptions, StatsOptions, AutoRunOptions
+from intercessor.cli import DummyCompleter
+
+
+def test_target_code_cache(monkeypatch):
+    target = Target()
+    monkeypatch.setattr(target, 'code_cache_size', 2)
+
+    target('x = 1', 'notebook.py', 1)
+    code = target.compile('x = 1', 'notebook.py', 1)
+    assert target.compile('x = 1', 'notebook.py', 1) is code
+
+    target('y = x + 1', 'notebook.py', 3)
+    target('z = y + 1', 'notebook.py', 5)
+    assert target.context['z'] == 3
+    assert len(target._code_cache) == 2
+    assert target.compile('x = 1', 'notebook.py', 1) is not code
+
+
+def test_target_traceback_lines(capsys):
+    target = Target()
+    target('x = 1\n', 'other-notebook.py', 2)
+    target('y = 2\n\n1 / 0\n', 'other-notebook.py', 4)
+
+    err = capsys.readouterr().err
+    assert 'File "other-notebook.py", line 6' in err
+    assert '1 / 0' in err
+
+    assert linecache.getline('other-notebook.py', 2) == 'x = 1\n'
+    assert linecache.getline('other-notebook.py', 6) == '1 / 0\n'
+    assert linecache.getline('other-notebook.py', 3) == '\n'
+
+
+class ScriptedDriver(BaseDriver):
+
+    # Reads commands from a list, and records what it's told about.
+    # Items of the list can also be:
+    #   ('write', text): write the notebook and reload it, so the next
+    #     command sees the new cells
+    #   ('save', text): write the notebook and wait for the watch to notice
+    #   ('later', seconds, text): write the notebook after a while,
+    #     meanwhile going on with the next command
+    #   ('module', text): write helper.py, next to the notebook
+    #   ('sleep', seconds): e.g. to give the worker time to start
+
+    def __init__(self, notebook_path, commands, **kwargs):
+        super(ScriptedDriver, self).__init__(
+            str(notebook_path), DummyCompleter(), **kwargs)
+        self.commands = list(commands)
+        self.ran = []
+        self.run_calls = 0
+        self.printed = []
+        self.cached = []
+        self.stats_shown = []
+        self.timings = None
+        self.not_exported = []
+        self.not_run = []
+        self.dropped = []
+        self.reloaded = []
+        self.queues = []
+        self.commands_cancelled = []
+        self.auto_run_cancelled = []
+        self.recoverable = []
+        self.progress = []
+        self.replayed = []
+
+    def read_command(self):
+        while self.commands:
+            command = self.commands.pop(0)
+            if not isinstance(command, tuple):
+                return command
+            getattr(self, 'script_' + command[0])(*command[1:])
+        raise EOFError
+
+    def write(self, text):
+        with open(self.notebook_path, 'w') as f:
+            f.write(text)
+
+    def script_write(self, text):
+        self.write(text)
+        self.reload_notebook()
+
+    def script_save(self, text):
+        self.write(text)
+        time.sleep(10)
+        assert False, "the watch did not notice"
+
+    def script_later(self, seconds, text):
+        threading.Timer(seconds, self.write, (text, )).start()
+
+    def script_module(self, text):
+        with open(os.path.join(os.path.dirname(self.notebook_path), 'helper.py'), 'w') as f:
+            f.write(text)
+        time.sleep(.3)
+
+    def script_sleep(self, seconds):
+        time.sleep(seconds)
+
+    def run_cells(self, names):
+        self.run_calls += 1
+        super(ScriptedDriver, self).run_cells(names)
+
+    def confirm_restart(self):
+        return True
+
+    def notify_cell_running(self, name, cell):
+        self.ran.append(name)
+
+    def notify_output(self, stream_name, text):
+        self.printed.append(text)
+
+    def notify_cell_cached(self, name):
+        self.cached.append(name)
+
+    def notify_cell_stats(self, name, stats):
+        self.stats_shown.append(name)
+
+    def notify_parallel_done(self, timings):
+        self.timings = timings
+
+    def notify_cell_not_exported(self, name, names):
+        self.not_exported.append((name, names))
+
+    def notify_cells_not_run(self, failed, names):
+        self.not_run.append((failed, names))
+
+    def notify_checkpoint_dropped(self, label):
+        self.dropped.append(label)
+
+    def notify_modules_reloaded(self, modules, error, duration, restart_time):
+        self.reloaded.append((modules, error))
+
+    def notify_queue(self, running, pending):
+        self.queues.append((running, pending))
+
+    def notify_commands_cancelled(self, commands):
+        self.commands_cancelled.append(commands)
+
+    def notify_auto_run_cancelled(self, name):
+        self.auto_run_cancelled.append(name)
+
+    def notify_recoverable(self, count, duration):
+        self.recoverable.append(count)
+
+    def notify_replay_progress(self, done, total, elapsed, remaining):
+        self.progress.append((done, total))
+
+    def notify_replay_done(self, count, duration, error, failed):
+        self.replayed.append((count, error, failed))
+
+
+@pytest.fixture
+def make_driver(tmpdir):
+    # makes ScriptedDrivers for notebook.py in tmpdir
+    def make_driver(commands, **kwargs):
+        return ScriptedDriver(tmpdir.join('notebook.py'), commands, **kwargs)
+    return make_driver
+
+
+STALE_NOTEBOOK = textwrap.dedent("""\
+    #: load
+    data = [1, 2, 3]
+    #: other
+    other = 1
+    #: total
+    total = sum(data)
+    #: show
+    print(total, other)
+""")
+
+
+def test_driver_stale(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(STALE_NOTEBOOK)
+
+    driver = make_driver([
+        '!stale',
+        'load', 'other', 'total', 'show',
+        '!stale',
+        ('write', STALE_NOTEBOOK.replace('[1, 2, 3]', '[1, 2]')),
+        '!stale',
+        'other',
+        '!stale show',
+        ('write', STALE_NOTEBOOK.replace('[1, 2, 3]', '[1, 2]\n1 / 0')),
+        'load',
+        '!stale',
+    ])
+    driver.loop()
+
+    assert driver.ran == [
+        'load', 'other', 'total', 'show',
+        'load', 'total', 'show',
+        'other',
+        'show',
+        'load',
+        'load', 'total', 'show',
+    ]
+
+
+def test_driver_rename(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(STALE_NOTEBOOK)
+
+    driver = make_driver([
+        'load', 'total',
+        ('write', STALE_NOTEBOOK.replace('#: total', '#: sum')),
+        '!stale',
+    ])
+    driver.loop()
+
+    assert sorted(driver.runs) == ['load', 'sum']
+    assert sorted(driver.run_times) == ['load', 'sum']
+
+
+def test_driver_cache(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(STALE_NOTEBOOK)
+    cache_path = str(tmpdir.join('cache'))
+
+    def run(commands):
+        driver = make_driver(
+            commands, cache_options=CacheOptions(path=cache_path, min_time=0))
+        driver.loop()
+        return driver.cached
+
+    assert run(['load', 'total']) == []
+    assert run(['load', 'total', 'other', 'show']) == ['load', 'total']
+    # running a cell again runs it
+    assert run(['load', 'load', 'total', 'total']) == ['load', 'total']
+
+    path.write(STALE_NOTEBOOK.replace('[1, 2, 3]', '[1, 2]'))
+    assert run(['load', 'total', 'other']) == ['other']
+
+    assert run(['!cache clear', 'load']) == []
+
+
+PARALLEL_NOTEBOOK = textwrap.dedent("""\
+    #: load
+    import os
+    data = [1, 2, 3]
+    #: fit a
+    a = sum(data)
+    #: fit b
+    b = max(data)
+    #: fit c
+    c = lambda: min(data)
+    #: both
+    both = a + b
+    #: show
+    print(a, b, c(), both)
+""")
+
+
+def test_driver_parallel(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(PARALLEL_NOTEBOOK)
+
+    driver = make_driver([
+        'load', '!parallel fit a, fit b, fit c, both', 'show',
+    ], jobs=2)
+
+    driver.loop()
+
+    # 'both' depends on 'fit a' and 'fit b', so it ran after them, serially;
+    # 'fit c' ran in parallel, but its lambda can't be pickled
+    assert driver.ran == ['load', 'fit c', 'both', 'show']
+    assert driver.not_exported == [('fit c', ['c'])]
+    assert driver.printed == ['6 3 1 9\n']
+
+    assert len(driver.timings) == 2
+    assert sorted(n for t in driver.timings for n in t.cells) == ['fit a', 'fit b', 'fit c']
+    # forked from the current kernel, so nothing to replay
+    assert all(t.replayed == 0 for t in driver.timings)
+
+    assert driver.independent_cells(['both', 'fit a', 'fit c']) == (
+        ['fit a', 'fit c'], ['both'])
+
+
+def test_driver_parallel_no_names(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(PARALLEL_NOTEBOOK.replace('#: show', '#: log\nprint(len(data))\n#: show'))
+
+    # 'log' defines no names, so it runs serially
+    driver = make_driver(['load', '!parallel fit a, fit b, log'], jobs=2)
+    driver.loop()
+
+    assert driver.ran == ['load', 'log']
+    assert driver.printed == ['3\n']
+    assert sorted(driver.runs) == ['fit a', 'fit b', 'load', 'log']
+
+
+MUTATE_NOTEBOOK = textwrap.dedent("""\
+    #: load
+    data = [1, 2, 3]
+    #: mutate
+    data.append(4)
+    #: a
+    a = len(data)
+    #: b
+    b = sum(data)
+    #: c
+    data.append(5)
+    c = 1
+    #: show
+    print(a, b, data)
+""")
+
+
+@pytest.mark.parametrize('fork', [True, False])
+def test_driver_parallel_mutations(tmpdir, make_driver, monkeypatch, fork):
+    path = tmpdir.join('notebook.py')
+    path.write(MUTATE_NOTEBOOK)
+    if not fork:
+        monkeypatch.setattr('intercessor.kernel.Kernel.checkpoint', lambda self, address: None)
+
+    # the workers start with the state of the current kernel, and 'c'
+    # changes data in place, so it runs here
+    driver = make_driver([
+        'load', 'mutate', '!parallel a, b, c', 'show'], jobs=2)
+    driver.loop()
+
+    assert driver.ran == ['load', 'mutate', 'c', 'show']
+    assert driver.printed == ['4 10 [1, 2, 3, 4, 5]\n']
+    assert sorted(n for t in driver.timings for n in t.cells) == ['a', 'b']
+    assert all(t.replayed == (0 if fork else 2) for t in driver.timings if t.cells)
+
+
+CHECKPOINT_NOTEBOOK = textwrap.dedent("""\
+    #: load
+    data = [1, 2, 3]
+    #: mutate
+    data.append(4)
+    #: show
+    print(data)
+""")
+
+
+def test_driver_checkpoint(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(CHECKPOINT_NOTEBOOK)
+
+    driver = make_driver([
+        '!checkpoint start', 'load', '!checkpoint', 'mutate', 'mutate',
+        '!rewind', 'show', '!rewind', '!stale', 'show',
+        '!rewind start', 'load', 'show',
+    ], checkpoint_options=CheckpointOptions(max_count=1))
+
+    kernel_pids = []
+    run_times = []
+
+    def notify_rewound(*args):
+        kernel_pids.append(driver.kernel.pid)
+        run_times.append(sorted(driver.run_times))
+
+    driver.notify_rewound = notify_rewound
+    driver.loop()
+
+    assert driver.printed == ['[1, 2, 3]\n', '[1, 2, 3]\n', '[1, 2, 3]\n']
+    # rewinding restores what ran, so nothing is stale
+    assert driver.ran == [
+        'load', 'mutate', 'mutate', 'show', 'show', 'load', 'show']
+    assert len(set(kernel_pids)) == 2
+    # and the run times, so 'mutate' doesn't count towards a restart
+    assert run_times == [['load'], ['load']]
+    # 'start' was dropped when the second checkpoint was taken
+    assert driver.dropped == ['start']
+    assert not driver.checkpoints
+
+
+def test_driver_profile(tmpdir, make_driver):
+    import pstats
+
+    path = tmpdir.join('notebook.py')
+    path.write(textwrap.dedent("""\
+        #: slow
+        import time
+        def slow_function():
+            time.sleep(.2)
+        slow_function()
+        #: fast
+        x = 1
+    """))
+    profile_path = str(tmpdir.join('profile.pstats'))
+
+    driver = make_driver([
+        'slow', 'fast', '!profile ' + profile_path,
+    ], stats_options=StatsOptions(min_time=.1))
+    driver.loop()
+
+    # only slow cells get their stats shown, if not profiling
+    assert driver.stats_shown == ['slow']
+    assert driver.stats['wall_time'] < .1
+    assert not tmpdir.join('profile.pstats').exists()
+
+    driver = make_driver([
+        'slow', '!profile ' + profile_path,
+    ], stats_options=StatsOptions(profile=True))
+    driver.loop()
+
+    assert driver.stats_shown == ['slow']
+    assert driver.stats['wall_time'] >= .2
+    stats = pstats.Stats(profile_path)
+    assert any(name == 'slow_function' for _, _, name in stats.stats)
+
+
+def test_driver_reload_modules(tmpdir, make_driver):
+    tmpdir.join('helper.py').write("def greet():\n    return 'hello'\n")
+    path = tmpdir.join('notebook.py')
+    path.write(textwrap.dedent("""\
+        #: load
+        import sys
+        sys.path.insert(0, {!r})
+        from helper import greet
+        data = [1, 2, 3]
+        #: show
+        print(greet(), data)
+    """.format(str(tmpdir))))
+
+    driver = make_driver([
+        'load', 'show',
+        ('module', "def greet():\n    return 'bye'\n"),
+        'show',
+        ('module', "def greet(:\n"),
+        'show',
+    ])
+    driver.loop()
+
+    assert driver.printed[:2] == ['hello [1, 2, 3]\n', 'bye [1, 2, 3]\n']
+    assert 'SyntaxError' in driver.printed[-2]
+    assert driver.printed[-1] == 'bye [1, 2, 3]\n'
+    assert driver.reloaded == [
+        (['helper'], None), ([], ('SyntaxError', 'helper'))]
+    assert driver.ran == ['load', 'show', 'show', 'show']
+
+
+def test_driver_attach(tmpdir, make_driver):
+    import multiprocessing
+    from intercessor.kernel import Kernel, KernelServer
+
+    path = tmpdir.join('notebook.py')
+    path.write(STALE_NOTEBOOK)
+    address = tmpdir.join('kernel.sock')
+
+    process = multiprocessing.get_context('spawn').Process(
+        target=Kernel.serve, args=(str(address), Target))
+    process.start()
+    try:
+        while not address.exists():
+            time.sleep(.01)
+
+        driver = make_driver(
+            ['load', 'other', 'total', 'show'], attach=str(address))
+        driver.loop()
+        assert driver.printed == ['6 1\n']
+
+        # the next driver gets the same kernel, and knows what ran in it
+        driver = make_driver([
+            '!stale', ('write', STALE_NOTEBOOK.replace('other = 1', 'other = 2')),
+            '!stale',
+        ], attach=str(address))
+        driver.loop()
+        assert driver.ran == ['other', 'show']
+        assert driver.printed == ['6 2\n']
+
+        KernelServer(str(address)).close()
+        process.join(5)
+        assert process.exitcode == 0
+    finally:
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+
+def test_driver_background(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(textwrap.dedent("""\
+        #: slow
+        import time
+        time.sleep(.5)
+        #: one
+        print(1)
+        #: two
+        print(2)
+        #: three
+        print(3)
+    """))
+
+    driver = make_driver([
+        'slow', ('sleep', .1), 'one', 'two', 'three', '!stale',
+        # all of these happen while 'slow' runs
+        '!queue', '!move 3 1', '!cancel 2', '!cancel 9',
+        ('write', path.read().replace('print(1)', 'print(11)')),
+        '!wait', '!queue',
+        'slow', ('sleep', .1), 'one', '!cancel',
+        '!wait',
+    ], background=True)
+    driver.loop()
+
+    assert driver.queues == [
+        ('slow', ['one', 'two', 'three', '!stale']),
+        ('slow', ['three', 'one', 'two', '!stale']),
+        (None, []),
+    ]
+    assert driver.commands_cancelled == [['one'], ['one']]
+    # the notebook changed, but not any cell that ran, so nothing is stale
+    assert driver.ran == ['slow', 'three', 'two', 'slow']
+    assert driver.printed == ['3\n', '2\n']
+
+
+RECOVER_NOTEBOOK = textwrap.dedent("""\
+    #: load
+    data = [1, 2, 3]
+    #: mutate
+    data.append(4)
+    #: show
+    print(data)
+    #: fail
+    1 / 0
+    #: die
+    import os
+    os._exit(1)
+""")
+
+
+def test_driver_recover(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(RECOVER_NOTEBOOK)
+    journal_path = str(tmpdir.join('journal.jsonl'))
+
+    driver = make_driver([
+        'load', 'mutate', 'show', 'fail', 'die',
+        '!recover', 'show', '!stale', '!recover',
+        ('write', RECOVER_NOTEBOOK.replace('[1, 2, 3]', '[1, 2]')),
+    ], journal_path=journal_path)
+    driver.loop()
+
+    # 'show' and 'fail' are not replayed
+    assert driver.recoverable == [2]
+    assert driver.progress == [(1, 2), (2, 2)]
+    assert driver.replayed == [(2, None, None)]
+    assert 'ZeroDivisionError' in driver.printed[1]
+    assert driver.printed[::2] == ['[1, 2, 3, 4]\n', '[1, 2, 3, 4]\n']
+    # replayed cells count as run
+    assert driver.ran == ['load', 'mutate', 'show', 'fail', 'die', 'show']
+
+    # the journal survives the driver (the replay is in it too), and has
+    # the cells as they ran, not as they are now
+    driver = make_driver(['!recover', 'show', '!stale'], journal_path=journal_path)
+    driver.loop()
+    assert driver.recoverable == [2]
+    assert driver.replayed == [(2, None, None)]
+    assert driver.printed == ['[1, 2, 3, 4]\n', '[1, 2, 4]\n']
+    assert driver.ran == ['show', 'load', 'mutate', 'show']
+
+
+SUPERSEDED_NOTEBOOK = textwrap.dedent("""\
+    #: load
+    data = [1, 2, 3]
+    #: count
+    n = len(data)
+    #: total
+    t = n * 2
+    #: inc
+    n += 1
+    #: show
+    print('{} {}'.format(n, t))
+    #: die
+    import os
+    os._exit(1)
+""")
+
+
+def test_driver_recover_superseded(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(SUPERSEDED_NOTEBOOK)
+
+    driver = make_driver([
+        'load', 'load', 'count', 'total', 'count', 'inc', 'inc', 'die',
+        '!recover', 'show',
+    ], journal_path=str(tmpdir.join('journal.jsonl')))
+    driver.loop()
+
+    # the first load is redone by the second; the first count is read
+    # by total, and inc reads what it defines, so they're all replayed
+    assert driver.recoverable == [6]
+    assert driver.replayed == [(6, None, None)]
+    assert driver.printed == ['5 6\n']
+
+
+RUN_NOTEBOOK = textwrap.dedent("""\
+    #: one
+    x = 1
+    print('one')
+    #: two
+    x += 1
+    print('two')
+    #: fail
+    1 / 0
+    #: three
+    print('three', x)
+""")
+
+
+def test_driver_run_cells(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(RUN_NOTEBOOK)
+
+    driver = make_driver([
+        '!run one..three', '!run three, one', '!run nope..two',
+    ])
+    driver.loop()
+
+    # a single call each; stops at the first cell that fails
+    assert driver.run_calls == 2
+    assert driver.ran == ['one', 'two', 'fail', 'three', 'one']
+    assert driver.not_run == [('fail', ['three'])]
+    assert 'ZeroDivisionError' in driver.printed.pop(2)
+    assert driver.printed == ['one\n', 'two\n', 'three 2\n', 'one\n']
+    assert driver.runs['fail'][0] is None
+    assert driver.runs['two'][0] == driver.cells['two'].hash
+    assert [r['name'] for r in driver.journal.session] == [
+        'one', 'two', 'fail', 'three', 'one']
+
+    driver = make_driver(['!run one..three'], keep_going=True)
+    driver.loop()
+    assert driver.ran == ['one', 'two', 'fail', 'three']
+    assert driver.not_run == []
+    assert driver.printed[-1] == 'three 2\n'
+
+
+AUTO_RUN_NOTEBOOK = textwrap.dedent("""\
+    #: setup
+    import time
+    #: slow
+    print('one')
+    #: other
+    pass
+""")
+
+
+def test_driver_auto_run(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(AUTO_RUN_NOTEBOOK)
+
+    slow = AUTO_RUN_NOTEBOOK.replace("print('one')", "print('two'); time.sleep(10)")
+    fast = AUTO_RUN_NOTEBOOK.replace("print('one')", "print('three')")
+    driver = make_driver([
+        'setup', 'slow',
+        # saving while 'slow' runs interrupts it, and runs it again
+        ('later', 1, fast),
+        ('save', slow),
+        # only 'other' changed
+        ('save', fast.replace('pass', 'pass\n')),
+    ], auto_run=AutoRunOptions(enabled=True, delay=.1))
+    start = time.time()
+    driver.loop()
+
+    assert time.time() - start < 5
+    assert driver.ran == ['setup', 'slow', 'slow', 'slow']
+    assert driver.auto_run_cancelled == ['slow']
+    assert driver.printed == ['one\n', 'two\n', 'three\n']
+    assert driver.runs['slow'][0] == driver.cells['slow'].hash
+
+
+def test_driver_auto_run_background(tmpdir, make_driver):
+    path = tmpdir.join('notebook.py')
+    path.write(AUTO_RUN_NOTEBOOK)
+
+    slow = AUTO_RUN_NOTEBOOK.replace("print('one')", "print('two'); time.sleep(10)")
+    fast = AUTO_RUN_NOTEBOOK.replace("print('one')", "print('three')")
+    driver = make_driver([
+        'setup', 'slow', '!wait',
+        ('save', slow), ('sleep', .5), '!stale',
+        # saving while 'slow' runs interrupts it, and queues it first
+        ('save', fast),
+        '!wait',
+    ], auto_run=AutoRunOptions(enabled=True, delay=.1), background=True)
+    start = time.time()
+    driver.loop()
+
+    assert time.time() - start < 5
+    assert driver.ran == ['setup', 'slow', 'slow', 'slow']
+    assert driver.auto_run_cancelled == ['slow']
+    assert driver.commands_cancelled == []
+    assert driver.printed == ['one\n', 'two\n', 'three\n']
+    assert driver.runs['slow'][0] == driver.cells['slow'].hash
@@ -0,0 +1,35 @@
+import time
+
+import pytest
+
+from intercessor.instrument import measure, cProfile, tracemalloc
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def test_measure():
+    with measure() as stats:
+        busy(.1)
+        time.sleep(.1)
+    assert .2 <= stats['wall_time'] < .5
+    assert .05 <= stats['cpu_time'] < .2
+    assert 'profile' not in stats
+    assert 'memory_top' not in stats
+
+
+@pytest.mark.skipif(cProfile is None or tracemalloc is None, reason="needs cProfile and tracemalloc")
+def test_measure_profile_memory():
+    with measure(profile=True, trace_memory=True) as stats:
+        busy(.01)
+        data = [bytearray(1024) for _ in range(1024)]
+
+    assert isinstance(stats['profile'], bytes)
+    assert stats['memory_peak'] >= 1024 ** 2
+    line, size, count = stats['memory_top'][0]
+    assert 'test_instrument.py' in line
+    assert size >= 1024 ** 2
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,40 @@
+from intercessor.journal import Journal
+from intercessor.deps import output_only
+
+
+def test_journal(tmpdir):
+    path = str(tmpdir.join('journal.jsonl'))
+
+    journal = Journal(path)
+    assert journal.start_session() == []
+    journal.record_run('one', 'h1', 'x = 1', 1, .5)
+    journal.record_run('two', 'h2', 'y = 2', 3, 1.5)
+    journal.rewind(1)
+    journal.record_run('three', 'h3', '1 / 0', 5, error='ZeroDivisionError')
+    assert [r['name'] for r in journal.session] == ['one', 'three']
+    journal.close()
+
+    # a crash can leave the last line cut short
+    with open(path, 'a') as f:
+        f.write('{"type": "ru')
+
+    journal = Journal(path)
+    lost = journal.start_session()
+    assert [(r['name'], r['wall_time'], r['error']) for r in lost] == [
+        ('one', .5, None), ('three', None, 'ZeroDivisionError')]
+    assert journal.session == []
+    journal.close()
+
+    assert Journal(path).session == []
+    assert Journal().start_session() == []
+
+
+def test_output_only():
+    assert output_only("print(x)\nx\nx.y\n'text'\n")
+    assert output_only("print(a, b.c, sep='-')")
+    assert output_only("")
+    assert not output_only("x = 1")
+    assert not output_only("data.append(1)")
+    assert not output_only("print(data.pop())")
+    assert not output_only("show(x)")
+    assert not output_only("print(")
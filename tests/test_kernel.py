@@ -2,11 +2,15 @@ import threading
 import os
 import signal
 import time
+import pickle
 from datetime import datetime, timedelta
 
 import pytest
 
-from intercessor.kernel import run_kernel, KernelError
+import intercessor.kernel as kernel_module
+from intercessor.kernel import run_kernel, KernelError, KernelPool
+from intercessor.kernel import forkserver_context, Channel
+from intercessor.serialize import SerializationError, get_serializer
 
 
 def setup_module(module):
@@ -47,13 +51,42 @@ def test_kernel_exception():
 
 
 def make_return_unpickleable():
-    def return_unpickleable():
-        return lambda: None
+    def return_unpickleable(value=None):
+        if value is not None:
+            return value
+        return lambda: 1
     return return_unpickleable
 
+def load_in_parent_only(pid):
+    if os.getpid() != pid:
+        raise RuntimeError("can't load this here")
+    return BadOnLoad()
+
+class BadOnLoad(object):
+    def __reduce__(self):
+        return load_in_parent_only, (os.getpid(), )
+
 def test_kernel_unpickleable():
     with run_kernel(make_return_unpickleable) as kernel:
-        assert kernel() is None
+        with pytest.raises(SerializationError) as excinfo:
+            kernel()
+        assert excinfo.value.where == 'reply'
+        assert excinfo.value.error in ('PicklingError', 'AttributeError')
+        with pytest.raises(SerializationError) as excinfo:
+            kernel(threading.Lock())
+        assert excinfo.value.where == 'request'
+        # pickles fine, but can't be unpickled in the kernel
+        with pytest.raises(SerializationError) as excinfo:
+            kernel(BadOnLoad())
+        assert excinfo.value.where == 'request'
+        assert excinfo.value.error == 'RuntimeError'
+        # still works
+        assert kernel(2) == 2
+
+    serializer = get_serializer('cloudpickle+zlib')
+    with kernel_module.Kernel(make_return_unpickleable, serializer=serializer) as kernel:
+        assert kernel()() == 1
+        assert kernel(b'x' * 1024 ** 2) == b'x' * 1024 ** 2
 
 
 def make_kill_self():
@@ -87,6 +120,17 @@ def test_kernel_interrupt():
         assert end - start < timedelta(seconds=2)
 
 
+def test_kernel_interrupt_kernel_only():
+    with run_kernel(make_sleep) as kernel:
+        kernel.wait_ready()
+        threading.Timer(.5, kernel.interrupt).start()
+        with pytest.raises(KeyboardInterrupt):
+            kernel()
+        threading.Timer(.5, kernel.interrupt).start()
+        with pytest.raises(KeyboardInterrupt):
+            kernel()
+
+
 def make_sleep_forever():
     def sleep_forever():
         while True:
@@ -106,3 +150,258 @@ def test_kernel_terminate():
         end = datetime.now()
         assert end - start < timedelta(seconds=3)
 
+
+
+def test_kernel_pool():
+    with KernelPool(make_double, size=1) as pool:
+        kernel = pool.get()
+        with pytest.raises(AssertionError):
+            kernel.start()
+        assert kernel(2) == 4
+        assert kernel.start_time > 0
+        assert kernel.handoff_time > 0
+        kernel.shutdown()
+
+        # get() started a standby kernel to replace the one it handed
+        # off, and hands that one off next
+        assert len(pool._standby) == 1
+        standby = pool._standby[0]
+        assert standby._process.is_alive()
+        kernel = pool.get()
+        assert kernel is standby
+        assert len(pool._standby) == 1 and pool._standby[0] is not standby
+        assert kernel(3) == 6
+        kernel.shutdown()
+
+
+def make_get_modules():
+    def get_modules(*names):
+        import sys
+        return [name in sys.modules for name in names]
+    return get_modules
+
+@pytest.mark.skipif(forkserver_context() is None, reason="needs forkserver")
+def test_kernel_pool_preload():
+    with KernelPool(make_get_modules, size=0, preload=['wave']) as pool:
+        kernel = pool.get()
+        assert kernel('wave') == [True]
+        kernel.shutdown()
+
+
+@pytest.mark.skipif(forkserver_context() is None, reason="needs forkserver")
+def test_forkserver_context_preload():
+    # the fork server is shared, so preloads add up
+    forkserver_context(['wave'])
+    forkserver_context(['colorsys'])
+    forkserver_context()
+    assert {'wave', 'colorsys'} <= set(kernel_module._forkserver_preload)
+
+
+def make_echo():
+    def echo(value):
+        return value
+    return echo
+
+class Blob(object):
+
+    # like numpy arrays, supports out-of-band pickling
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return make_blob, (pickle.PickleBuffer(self.data), )
+        return make_blob, (bytes(self.data), )
+
+    def __eq__(self, other):
+        return bytes(self.data) == bytes(other.data)
+
+def make_blob(buffer):
+    return Blob(memoryview(buffer))
+
+@pytest.mark.skipif(pickle.HIGHEST_PROTOCOL < 5, reason="needs pickle protocol 5")
+def test_kernel_out_of_band(monkeypatch):
+    sent = []
+    original_write_buffer = Channel._write_buffer
+    def write_buffer(self, buffer):
+        sent.append(buffer.nbytes)
+        return original_write_buffer(self, buffer)
+    monkeypatch.setattr(Channel, '_write_buffer', write_buffer)
+
+    kernel = run_kernel(make_echo, buffer_threshold=1000)
+    with kernel:
+        buffer_dir = kernel.buffer_dir
+        assert kernel(Blob(b'x' * 10)) == Blob(b'x' * 10)
+        assert sent == []
+        value = kernel([Blob(b'x' * 2000), Blob(bytearray(b'y' * 3000))])
+        assert value == [Blob(b'x' * 2000), Blob(b'y' * 3000)]
+        # only the parent's sends are counted, the kernel is another process
+        assert sent == [2000, 3000]
+        assert os.listdir(buffer_dir) == []
+    assert not os.path.exists(buffer_dir)
+
+
+def make_send_and_die():
+    def send_and_die(value):
+        os.kill(os.getpid(), signal.SIGKILL)
+    return send_and_die
+
+@pytest.mark.skipif(pickle.HIGHEST_PROTOCOL < 5, reason="needs pickle protocol 5")
+def test_kernel_out_of_band_death():
+    kernel = run_kernel(make_send_and_die, buffer_threshold=1000)
+    with kernel:
+        buffer_dir = kernel.buffer_dir
+        with pytest.raises(KernelError):
+            kernel(Blob(b'x' * 2000))
+    assert not os.path.exists(buffer_dir)
+
+
+def test_kernel_out_of_band_numpy():
+    numpy = pytest.importorskip('numpy')
+    with run_kernel(make_echo, buffer_threshold=1000) as kernel:
+        array = numpy.arange(1000)
+        rv = kernel(array)
+        assert (rv == array).all()
+        rv[0] = 1
+
+
+def measure_kernel(monkeypatch, wait_for):
+    monkeypatch.setattr('intercessor.kernel._wait_for', wait_for)
+
+    with run_kernel(make_double) as kernel:
+        kernel(0)
+        calls = 500
+        start = time.time()
+        for i in range(calls):
+            kernel(i)
+        latency = (time.time() - start) / calls
+
+    with run_kernel(make_kill_self) as kernel:
+        kernel.wait_ready()
+        start = time.time()
+        with pytest.raises(KernelError):
+            kernel()
+        death = time.time() - start
+
+    return latency, death
+
+@pytest.mark.skipif(kernel_module._wait_for is None, reason="needs connection.wait()")
+def test_kernel_latency_benchmark(monkeypatch):
+    # Round-trip latency of trivial calls, and how long it takes to notice
+    # a dead kernel; polling the connection every 100ms (the old way)
+    # vs. waiting on the connection and process sentinel at the same time.
+    # Run with -s to see the numbers.
+    wait_for = kernel_module._wait_for
+    polling = measure_kernel(monkeypatch, None)
+    sentinel = measure_kernel(monkeypatch, wait_for)
+
+    print()
+    print("latency: polling {:.3f}ms, sentinel {:.3f}ms".format(
+        polling[0] * 1000, sentinel[0] * 1000))
+    print("death: polling {:.3f}ms, sentinel {:.3f}ms".format(
+        polling[1] * 1000, sentinel[1] * 1000))
+
+    # relative, so a slow or busy machine doesn't fail it
+    assert sentinel[0] < polling[0] * 3
+    assert sentinel[1] < polling[1] / 2
+
+
+def make_counter():
+    state = {'n': 0}
+    def counter(action=None):
+        if action == 'die':
+            os.kill(os.getpid(), signal.SIGKILL)
+        if action == 'sleep':
+            time.sleep(10)
+        state['n'] += 1
+        return state['n'], os.getpid()
+    return counter
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork()")
+def test_kernel_checkpoint(tmpdir):
+    address = str(tmpdir.join('checkpoint.sock'))
+    with run_kernel(make_counter) as kernel:
+        assert kernel()[0] == 1
+        checkpoint = kernel.checkpoint(address)
+        assert checkpoint.memory() is not None
+        assert kernel() == (2, kernel.pid)
+
+        # every kernel forked from the checkpoint starts from the same state
+        with checkpoint.kernel() as forked:
+            assert forked()[0] == 2
+            assert forked() == (3, forked.pid)
+            assert forked.pid not in (kernel.pid, checkpoint.pid)
+
+            threading.Timer(.5, forked.interrupt).start()
+            with pytest.raises(KeyboardInterrupt):
+                forked('sleep')
+
+        with checkpoint.kernel() as forked:
+            assert forked()[0] == 2
+            with pytest.raises(KernelError):
+                forked('die')
+
+        # the checkpoint survives the kernel it was taken from
+        kernel.terminate()
+        kernel.join()
+
+    with checkpoint.kernel() as forked:
+        assert forked()[0] == 2
+
+    checkpoint.close()
+    for _ in range(100):
+        if not tmpdir.join('checkpoint.sock').exists():
+            break
+        time.sleep(.01)
+    with pytest.raises(KernelError):
+        checkpoint.kernel().start()
+
+
+def wait_for_path(path, exists=True):
+    for _ in range(500):
+        if path.exists() == exists:
+            return
+        time.sleep(.01)
+    assert False, "timed out waiting for {}".format(path)
+
+
+def test_kernel_server(tmpdir):
+    import multiprocessing
+    from intercessor.kernel import Kernel, KernelServer
+
+    path = tmpdir.join('kernel.sock')
+    process = multiprocessing.get_context('spawn').Process(
+        target=Kernel.serve, args=(str(path), make_counter))
+    process.start()
+    try:
+        wait_for_path(path)
+        server = KernelServer(str(path))
+
+        with server.kernel() as kernel:
+            assert kernel() == (1, process.pid)
+            assert kernel()[0] == 2
+
+            threading.Timer(.5, kernel.interrupt).start()
+            with pytest.raises(KeyboardInterrupt):
+                kernel('sleep')
+
+        # the state survives detaching, and going away without detaching
+        kernel = server.kernel()
+        kernel.start()
+        assert kernel()[0] == 3
+        kernel._parent_conn.close()
+
+        with server.kernel() as kernel:
+            assert kernel()[0] == 4
+
+        server.close()
+        wait_for_path(path, exists=False)
+        process.join(5)
+        assert process.exitcode == 0
+        with pytest.raises(KernelError):
+            server.kernel().start()
+    finally:
+        if process.is_alive():
+            process.terminate()
+            process.join()
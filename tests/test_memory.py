@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import textwrap
+
+import pytest
+
+from intercessor.kernel import run_kernel
+from intercessor.memory import process_rss, deep_size, largest_objects, MemoryMonitor
+
+from intercessor.driver import MemoryLimits
+from test_driver import ScriptedDriver
+
+
+needs_proc = pytest.mark.skipif(
+    process_rss(os.getpid()) is None, reason="needs /proc/PID/statm")
+
+
+@needs_proc
+def test_process_rss():
+    before = process_rss(os.getpid())
+    data = bytearray(100 * 1024 ** 2)
+    data[::4096] = b'x' * len(data[::4096])
+    assert process_rss(os.getpid()) - before >= 90 * 1024 ** 2
+    assert process_rss(2 ** 22 + 12345) is None
+
+
+def test_deep_size():
+    data = [bytearray(1000) for _ in range(100)]
+    assert deep_size(data) >= 100 * 1000
+    assert deep_size(data, limit=10) < 10 * 1100
+    assert deep_size({'key': 'value'}) > sys.getsizeof({})
+
+    namespace = {'big': data, 'small': 1, 'os': os, '__builtins__': {}}
+    assert [name for name, _, _ in largest_objects(namespace)] == ['big', 'small']
+
+
+def make_allocate():
+    def allocate(megabytes, wait=0):
+        import time
+        data = bytearray(megabytes * 1024 ** 2)
+        data[::4096] = b'x' * len(data[::4096])
+        time.sleep(wait)
+        return len(data)
+    return allocate
+
+
+@needs_proc
+def test_memory_monitor():
+    hits = []
+    with run_kernel(make_allocate) as kernel:
+        kernel.wait_ready()
+        base = process_rss(kernel.pid)
+        monitor = MemoryMonitor(
+            lambda: kernel.pid, base + 50 * 1024 ** 2, base + 150 * 1024 ** 2,
+            lambda rss: hits.append('soft'),
+            lambda rss: (hits.append('hard'), kernel.interrupt()))
+        monitor.interval = .01
+        with monitor:
+            kernel(100, .2)
+            assert hits == ['soft']
+            with pytest.raises(KeyboardInterrupt):
+                kernel(200, 10)
+            # memory went down after the first call, so the soft limit
+            # warns again
+            assert hits == ['soft', 'soft', 'hard']
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="RLIMIT_AS is Linux-specific")
+def test_kernel_rlimits():
+    limit = 1024 ** 3
+    with run_kernel(make_allocate, rlimits={'RLIMIT_AS': (limit, limit)}) as kernel:
+        assert kernel(10) == 10 * 1024 ** 2
+        # the kernel logs the exception and returns None
+        assert kernel(2000) is None
+        assert kernel(10) == 10 * 1024 ** 2
+
+
+class MemoryDriver(ScriptedDriver):
+
+    def __init__(self, *args, **kwargs):
+        super(MemoryDriver, self).__init__(*args, **kwargs)
+        self.events = []
+
+    def notify_memory(self, rss, objects):
+        self.events.append(('memory', rss, objects))
+
+    def notify_memory_hard_limit(self, rss):
+        self.events.append(('hard limit', ))
+
+    def notify_kernel_started(self):
+        self.events.append(('started', ))
+
+    def read_command(self):
+        # numbers are seconds to wait before the next command
+        command = super(MemoryDriver, self).read_command()
+        while isinstance(command, float):
+            time.sleep(command)
+            command = super(MemoryDriver, self).read_command()
+        return command
+
+
+@needs_proc
+def test_driver_memory(tmpdir):
+    path = tmpdir.join('notebook.py')
+    path.write(textwrap.dedent("""\
+        #: small
+        small = list(range(10))
+        #: big
+        big = bytearray(10 * 1024 ** 2)
+        #: huge
+        import time
+        huge = bytearray(1024 ** 3)
+        huge[::4096] = b'x' * len(huge[::4096])
+        time.sleep(10)
+    """))
+
+    driver = MemoryDriver(path, [
+        'small', 'big', '!memory', 'huge', 'small',
+    ], memory_limits=MemoryLimits(hard=500 * 1024 ** 2, action='restart'))
+    driver.loop()
+
+    _, (_, rss, objects), _, _ = driver.events
+    assert rss > 10 * 1024 ** 2
+    assert [name for name, _, _ in objects] == ['big', 'small']
+    assert objects[0][2] >= 10 * 1024 ** 2
+    # the kernel got restarted without asking
+    assert [e[0] for e in driver.events] == [
+        'started', 'memory', 'hard limit', 'started']
+
+
+@needs_proc
+def test_driver_memory_idle(tmpdir):
+    path = tmpdir.join('notebook.py')
+    path.write(textwrap.dedent("""\
+        #: small
+        small = list(range(10))
+        #: huge
+        import mmap, threading
+        # not resident until touched
+        huge = mmap.mmap(-1, 1024 ** 3)
+        def touch():
+            for i in range(0, len(huge), 4096):
+                huge[i] = 1
+        threading.Timer(.2, touch).start()
+    """))
+
+    # the memory is used (and the kernel killed) after 'huge' is done,
+    # while the kernel is idle
+    driver = MemoryDriver(path, [
+        'huge', 1., 'small', 'small',
+    ], memory_limits=MemoryLimits(hard=500 * 1024 ** 2, action='restart'))
+    driver.loop()
+
+    assert [e[0] for e in driver.events] == ['started', 'hard limit', 'started']
+    assert driver.ran == ['huge', 'small', 'small']
@@ -0,0 +1,95 @@
+import io
+import json
+import time
+import threading
+
+import pytest
+
+from intercessor.kernel import run_kernel, KernelError
+from intercessor.metrics import Histogram, KernelMetrics
+
+from test_kernel import make_echo, make_sleep, make_kill_self
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    for value in [0, 1, 2, 3, 100, 1000]:
+        histogram.add(value)
+    assert histogram.to_dict() == {
+        'count': 6, 'total': 1106, 'mean': 1106 / 6., 'min': 0, 'max': 1000,
+        'p50': 4, 'p90': 1000, 'p99': 1000,
+    }
+    assert histogram.percentile(10) == 0
+    assert histogram.percentile(30) == 2
+
+
+def make_echo_slowly():
+    def echo_slowly(value, seconds=0):
+        time.sleep(seconds)
+        return value
+    return echo_slowly
+
+
+def test_kernel_metrics():
+    export = io.StringIO()
+    metrics = KernelMetrics(export)
+
+    with run_kernel(make_echo_slowly, metrics=metrics) as kernel:
+        assert kernel(b'x' * 10000, .1) == b'x' * 10000
+        assert kernel(1) == 1
+
+    calls = [json.loads(line) for line in export.getvalue().splitlines()]
+    assert [c['status'] for c in calls] == ['returned', 'returned']
+    first = calls[0]
+    assert first['bytes_sent'] > 10000
+    assert first['bytes_received'] > 10000
+    assert .1 <= first['target_time'] < .2
+    assert first['total_time'] >= (
+        first['serialize_time'] + first['queue_wait'] +
+        first['target_time'] + first['reply_wait'])
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['calls'] == 2
+    assert snapshot['counters']['bytes_sent'] == sum(c['bytes_sent'] for c in calls)
+    assert snapshot['histograms']['target_time']['count'] == 2
+    assert snapshot['histograms']['target_time']['max'] == first['target_time']
+
+
+def test_kernel_metrics_interrupt_death():
+    metrics = KernelMetrics()
+
+    with run_kernel(make_sleep, metrics=metrics) as kernel:
+        kernel.wait_ready()
+        threading.Timer(.2, kernel.interrupt).start()
+        with pytest.raises(KeyboardInterrupt):
+            kernel()
+
+    with run_kernel(make_kill_self, metrics=metrics) as kernel:
+        with pytest.raises(KernelError):
+            kernel()
+
+    counters = metrics.snapshot()['counters']
+    assert counters['interrupted'] == 1
+    assert counters['died'] == 1
+    assert metrics.histograms['target_time'].count == 1
+
+
+def measure_latency(metrics, calls=2000):
+    with run_kernel(make_echo, metrics=metrics) as kernel:
+        kernel.wait_ready()
+        start = time.time()
+        for i in range(calls):
+            kernel(i)
+        return (time.time() - start) / calls
+
+
+def test_kernel_metrics_overhead_benchmark():
+    # Run with -s to see the numbers.
+    disabled = measure_latency(None)
+    enabled = measure_latency(KernelMetrics())
+    print()
+    print("latency: metrics disabled {:.3f}ms, enabled {:.3f}ms".format(
+        disabled * 1000, enabled * 1000))
+    # generous, since both depend on how busy the machine is
+    assert enabled < disabled * 3
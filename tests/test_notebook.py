@@ -0,0 +1,159 @@
+import random
+import re
+import textwrap
+from collections import OrderedDict
+
+import pytest
+
+from intercessor.notebook import parse_notebook, parse_notebook_cells
+from intercessor.notebook import NotebookParser
+
+
+NOTEBOOK = textwrap.dedent("""\
+
+    #: one
+
+    x = 1
+
+    #: two
+    print(x)
+    #: three
+    y = 2
+""")
+
+
+def test_parse_notebook():
+    assert parse_notebook(NOTEBOOK) == {
+        'one': 'x = 1',
+        'two': 'print(x)',
+        'three': 'y = 2\n\n',
+    }
+    assert list(parse_notebook(NOTEBOOK)) == ['one', 'two', 'three']
+
+    with pytest.raises(AssertionError):
+        parse_notebook("x = 1\n#: one\n")
+
+
+def test_parse_notebook_cells():
+    cells = parse_notebook_cells(NOTEBOOK)
+    assert [(c.name, c.lineno) for c in cells.values()] == [
+        ('one', 4), ('two', 7), ('three', 9)]
+    assert NOTEBOOK[cells['two'].offset:].startswith('print(x)')
+    assert cells['one'].hash != cells['two'].hash
+
+
+def reference_cells(text):
+    # a straightforward parse of the whole text, to check the parser
+    # against; like a dict built from the cells, a duplicate name keeps
+    # the position of the first cell and the value of the last one
+    text = '\n' + text + '\n'
+    cells = OrderedDict()
+    matches = list(re.finditer(r'\s*\n#: +(.*)\n\s*', text))
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else len(text)
+        offset = match.end() - 1
+        lineno = text.count('\n', 0, match.end())
+        cells[match.group(1)] = (text[match.end():end], lineno, offset)
+    return cells
+
+
+def check_parser(parser, text):
+    diff = parser.update(text)
+    cells = parser.cells
+    assert list(parse_notebook(text).items()) == [
+        (c.name, c.text) for c in cells.values()]
+    assert [(c.name, (c.text, c.lineno, c.offset)) for c in cells.values()] \
+        == list(reference_cells(text).items())
+    return diff
+
+
+def test_notebook_parser():
+    parser = NotebookParser()
+
+    diff = check_parser(parser, NOTEBOOK)
+    assert diff == (['one', 'two', 'three'], [], [], [])
+
+    assert check_parser(parser, NOTEBOOK) == ([], [], [], [])
+
+    cells = parser.cells
+    one = cells['one']
+    text = NOTEBOOK.replace('print(x)', 'print(x)\nprint(x + 1)')
+    assert check_parser(parser, text) == ([], [], ['two'], [])
+    assert parser.cells is cells
+    assert cells['one'] is one
+    assert cells['three'].lineno == 10
+
+    text = text.replace('#: two', '#: two and a half')
+    assert check_parser(parser, text) == ([], [], [], [('two', 'two and a half')])
+    assert list(parser.cells) == ['one', 'two and a half', 'three']
+
+    text = text.replace('y = 2', 'y = 2\n#: four\nz = 3')
+    assert check_parser(parser, text) == (['four'], [], ['three'], [])
+
+    text = text.replace('#: one\n\nx = 1\n\n', '')
+    assert check_parser(parser, text) == ([], ['one'], [], [])
+
+    # duplicate names
+    text = text.replace('#: four', '#: three')
+    assert check_parser(parser, text) == ([], ['four'], ['three'], [])
+    assert parser.cells['three'].text == 'z = 3\n\n'
+
+
+def test_notebook_parser_reorder():
+    parser = NotebookParser()
+    text = '#: a\nx = 1\n#: b\ny = 2\n#: c\nz = 3\n'
+    check_parser(parser, text)
+
+    text = '#: b\nx = 1\n#: a\ny = 2\n#: c\nz = 3\n'
+    assert check_parser(parser, text) == ([], [], ['b', 'a'], [])
+    assert list(parser.cells) == ['b', 'a', 'c']
+
+    # the same name again moves the value, but not the position
+    text = '#: b\nx = 1\n#: a\ny = 2\n#: b\nz = 3\n'
+    assert check_parser(parser, text) == ([], ['c'], ['b'], [])
+    assert list(parser.cells) == ['b', 'a']
+    assert parser.cells['b'].text == 'z = 3\n\n'
+
+    text = '#: c\nx = 1\n#: a\ny = 2\n#: b\nz = 3\n'
+    assert check_parser(parser, text) == (['c'], [], [], [])
+    assert list(parser.cells) == ['c', 'a', 'b']
+
+    text = '#: c\nx = 1\n#: a\ny = 2\n#: a\nz = 3\n'
+    assert check_parser(parser, text) == ([], ['b'], ['a'], [])
+    assert list(parser.cells) == ['c', 'a']
+
+
+class SmallBlockParser(NotebookParser):
+    block_size = 3
+
+
+def test_notebook_parser_random_edits():
+    rng = random.Random(0)
+    pieces = ['\n#: a\n', '\n#: b\n', '\n#: c\n', 'x = 1\n', 'y\n', '\n', ' ', '#']
+    parser = SmallBlockParser()
+    text = ''.join('\n#: cell{0}\nx = {0}\ny = x * 2\nprint(x, y)\n'.format(i)
+                   for i in range(100))
+    check_parser(parser, text)
+    for _ in range(500):
+        headers = list(re.finditer(r'(?m)^#: +(.*)$', text))
+        if len(headers) > 1 and rng.random() < .1:
+            # swap the names of two nearby cells
+            i = rng.randrange(len(headers) - 1)
+            j = rng.randrange(i + 1, min(i + 4, len(headers)))
+            first, second = headers[i], headers[j]
+            text = (text[:first.start(1)] + second.group(1) +
+                    text[first.end(1):second.start(1)] + first.group(1) +
+                    text[second.end(1):])
+            check_parser(parser, text)
+            continue
+        start = rng.randrange(len(text) + 1)
+        end = min(len(text), start + rng.randrange(10))
+        if rng.random() < .2:
+            end = start
+        text = text[:start] + rng.choice(pieces) * rng.randrange(3) + text[end:]
+        try:
+            parse_notebook(text)
+        except AssertionError:
+            # not a notebook (something before the first header)
+            text = '#: first\n' + text
+        check_parser(parser, text)
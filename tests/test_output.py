@@ -0,0 +1,95 @@
+import textwrap
+
+from intercessor.kernel import run_kernel
+from intercessor.driver import Target
+from intercessor.output import OutputBuffer
+
+from test_driver import ScriptedDriver
+
+
+def test_output_buffer():
+    output = OutputBuffer(max_lines=3, tail_lines=2)
+    output.start()
+    assert output.write('one\ntw') == 'one\ntw'
+    assert output.write('o\nthree\nfour\nfi') == 'o\nthree\n'
+    assert output.write('ve\nsix\nseven') == ''
+    assert output.finish() == (2, 'six\nseven')
+
+    path = output.path
+    with open(path) as f:
+        assert f.read() == 'one\ntwo\nthree\nfour\nfive\nsix\nseven'
+
+    output.start()
+    assert output.path != path
+    assert output.write('a\nb\nc\nd\n') == 'a\nb\nc\n'
+    assert output.finish() == (0, 'd\n')
+    output.close()
+    assert output.path is None
+
+
+def test_output_buffer_save(tmpdir):
+    output = OutputBuffer(max_lines=1)
+    output.start()
+    output.write('one\ntwo\n')
+    output.save(str(tmpdir.join('saved.txt')))
+    output.close()
+    assert tmpdir.join('saved.txt').read() == 'one\ntwo\n'
+
+
+def test_target_output_events():
+    events = []
+    with run_kernel(Target) as kernel:
+        kernel.on_event = events.append
+        rv = kernel(textwrap.dedent("""\
+            import sys
+            for i in range(1000):
+                print(i)
+            print('error', file=sys.stderr)
+            1 / 0
+        """))
+        assert rv['error'] == 'ZeroDivisionError'
+
+    chunks = [c for kind, value in events if kind == 'output' for c in value]
+    stdout = ''.join(t for n, t in chunks if n == 'stdout')
+    stderr = ''.join(t for n, t in chunks if n == 'stderr')
+    assert stdout == ''.join('{}\n'.format(i) for i in range(1000))
+    assert stderr.startswith('error\nTraceback')
+    assert 'ZeroDivisionError' in stderr
+    # consecutive writes to the same stream are batched
+    assert len(chunks) < 10
+
+
+class OutputDriver(ScriptedDriver):
+
+    def __init__(self, *args, **kwargs):
+        super(OutputDriver, self).__init__(*args, **kwargs)
+        self.shown = []
+        self.collapsed = []
+
+    def notify_output(self, stream_name, text):
+        self.shown.append(text)
+
+    def notify_output_collapsed(self, hidden, tail):
+        self.collapsed.append((hidden, tail))
+
+
+def test_driver_output(tmpdir):
+    path = tmpdir.join('notebook.py')
+    path.write(textwrap.dedent("""\
+        #: few
+        print('hello')
+        #: many
+        for i in range(100):
+            print(i)
+    """))
+
+    driver = OutputDriver(path, [
+        'few', 'many',
+        '!output save {}'.format(tmpdir.join('saved.txt')),
+    ], max_output_lines=10)
+    driver.loop()
+
+    assert driver.shown[0] == 'hello\n'
+    assert ''.join(driver.shown[1:]) == ''.join('{}\n'.format(i) for i in range(10))
+    assert driver.collapsed == [(70, ''.join('{}\n'.format(i) for i in range(80, 100)))]
+    assert tmpdir.join('saved.txt').read() == ''.join('{}\n'.format(i) for i in range(100))
@@ -0,0 +1,86 @@
+import sys
+import importlib
+import textwrap
+
+import pytest
+
+from intercessor.reload import reload_order, reload_modules, user_modules
+
+
+def test_reload_order():
+    deps = {
+        'base': set(),
+        'util': set(['base']),
+        'model': set(['base', 'util']),
+        'other': set(),
+    }
+    assert reload_order(['base'], deps) == ['base', 'util', 'model']
+    assert reload_order(['util'], deps) == ['util', 'model']
+    assert reload_order(['other', 'missing'], deps) == ['other']
+
+    # cycles get broken in name order
+    deps = {'a': set(['b']), 'b': set(['a']), 'c': set(['b'])}
+    assert reload_order(['c', 'a'], deps) == ['a', 'b', 'c']
+
+
+@pytest.fixture
+def modules(tmpdir):
+    sys.path.insert(0, str(tmpdir))
+    try:
+        yield tmpdir
+    finally:
+        sys.path.remove(str(tmpdir))
+        for name in ('rl_base', 'rl_user'):
+            sys.modules.pop(name, None)
+
+
+def test_reload_modules(modules):
+    base = modules.join('rl_base.py')
+    base.write("def value():\n    return 1\n")
+    modules.join('rl_user.py').write(textwrap.dedent("""\
+        from rl_base import value
+        def double():
+            return value() * 2
+    """))
+
+    namespace = {}
+    exec("import rl_base\nfrom rl_user import double", namespace)
+    assert set(['rl_base', 'rl_user']) <= set(user_modules())
+    assert namespace['double']() == 2
+
+    old_double = namespace['double']
+    base.write("def value():\n    return 10\n")
+    rv = reload_modules(['rl_base'], namespace)
+
+    assert rv['reloaded'] == ['rl_base', 'rl_user']
+    assert rv['rebound'] == ['double']
+    assert rv['error'] is None
+    assert namespace['double'] is not old_double
+    assert namespace['double']() == 20
+    assert namespace['rl_base'].value() == 10
+
+    base.write("1 / 0\n")
+    rv = reload_modules(['rl_base'], namespace)
+    assert rv['reloaded'] == []
+    assert rv['error'] == ('ZeroDivisionError', 'rl_base')
+
+
+def test_user_modules(modules):
+    modules.join('rl_base.py').write("x = 1\n")
+    assert 'rl_base' not in user_modules()
+
+    importlib.import_module('rl_base')
+    assert user_modules()['rl_base'] == str(modules.join('rl_base.py').realpath())
+
+    del sys.modules['rl_base']
+    assert 'rl_base' not in user_modules()
+
+    # a different module with the same name
+    other = modules.mkdir('other')
+    other.join('rl_base.py').write("x = 2\n")
+    sys.path.insert(0, str(other))
+    try:
+        importlib.import_module('rl_base')
+        assert user_modules()['rl_base'] == str(other.join('rl_base.py').realpath())
+    finally:
+        sys.path.remove(str(other))
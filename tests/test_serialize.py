@@ -0,0 +1,54 @@
+import os
+import pickle
+
+import pytest
+
+from intercessor.serialize import get_serializer, CompressedSerializer
+from intercessor.serialize import cloudpickle, lz4_block
+
+
+def test_serializers():
+    specs = ['pickle', 'pickle+zlib']
+    if cloudpickle:
+        specs += ['cloudpickle', 'cloudpickle+zlib']
+    if lz4_block:
+        specs += ['pickle+lz4']
+
+    text = 'some text\n' * 100000
+    noise = os.urandom(1024 ** 2)
+    for spec in specs:
+        serializer = get_serializer(spec)
+        for value in [None, {'a': [1, 2.5, 'b']}, text, noise]:
+            assert serializer.loads(serializer.dumps(value)) == value
+
+    if cloudpickle:
+        serializer = get_serializer('cloudpickle')
+        assert serializer.loads(serializer.dumps(lambda x: x + 1))(1) == 2
+
+    with pytest.raises(ValueError):
+        get_serializer('marshal')
+    with pytest.raises(ValueError):
+        get_serializer('pickle+bz2')
+
+
+def test_compressed_serializer():
+    serializer = CompressedSerializer(get_serializer('pickle'), threshold=1024)
+    small = serializer.dumps('x' * 100)
+    text = serializer.dumps('x' * 1024 ** 2)
+    noise = serializer.dumps(os.urandom(1024 ** 2))
+    # codec
+    assert small[:1] == b'-'
+    assert text[:1] == b'z'
+    assert len(text) < 1024 * 10
+    # doesn't compress, so it isn't
+    assert noise[:1] == b'-'
+
+
+@pytest.mark.skipif(pickle.HIGHEST_PROTOCOL < 5, reason="needs pickle protocol 5")
+def test_compressed_serializer_out_of_band():
+    serializer = get_serializer('pickle+zlib')
+    buffers = []
+    data = serializer.dumps(
+        pickle.PickleBuffer(bytearray(b'x' * 1024 ** 2)), buffers.append)
+    assert len(buffers) == 1
+    assert bytes(serializer.loads(data, buffers)) == b'x' * 1024 ** 2
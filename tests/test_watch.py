@@ -0,0 +1,178 @@
+import os
+import time
+
+import pytest
+
+from intercessor.watch import StatWatch, InotifyWatch, watch_file
+
+
+WATCH_CLASSES = [StatWatch]
+if watch_file is InotifyWatch:
+    WATCH_CLASSES.append(InotifyWatch)
+
+
+def count_alarms(watch):
+    alarms = []
+    original_alarm = watch._alarm
+    def _alarm():
+        alarms.append(time.time())
+        original_alarm()
+    watch._alarm = _alarm
+    return alarms
+
+
+@pytest.mark.parametrize('cls', WATCH_CLASSES)
+def test_watch_write(tmpdir, cls):
+    path = tmpdir.join('notebook.py')
+    path.write('one')
+
+    with cls(str(path)) as watch:
+        time.sleep(.2)
+        assert not watch.changed
+        path.write('two')
+        time.sleep(.3)
+        assert watch.changed
+        assert not watch.changed
+
+
+@pytest.mark.parametrize('cls', WATCH_CLASSES)
+def test_watch_rename_over(tmpdir, cls):
+    path = tmpdir.join('notebook.py')
+    path.write('one')
+
+    with cls(str(path)) as watch:
+        time.sleep(.2)
+        tmp_path = tmpdir.join('.notebook.py.swp')
+        tmp_path.write('two')
+        os.rename(str(tmp_path), str(path))
+        time.sleep(.3)
+        assert watch.changed
+
+
+@pytest.mark.parametrize('cls', WATCH_CLASSES)
+def test_watch_callback(tmpdir, cls):
+    path = tmpdir.join('notebook.py')
+    path.write('one')
+    called = []
+
+    with cls(str(path)) as watch:
+        time.sleep(.2)
+        with watch.callback(lambda: called.append(True)):
+            path.write('two')
+            time.sleep(.3)
+        assert called
+        assert watch.changed
+
+        del called[:]
+        path.write('three')
+        time.sleep(.3)
+        assert not called
+        assert watch.changed
+
+
+@pytest.mark.skipif(watch_file is not InotifyWatch, reason="needs inotify")
+def test_inotify_watch_coalesce(tmpdir):
+    path = tmpdir.join('notebook.py')
+    path.write('')
+
+    with InotifyWatch(str(path)) as watch:
+        alarms = count_alarms(watch)
+        with open(str(path), 'w') as f:
+            for i in range(20):
+                f.write('line\n')
+                f.flush()
+        time.sleep(.2)
+        assert len(alarms) == 1
+        assert watch.changed
+
+        tmpdir.join('other.py').write('other')
+        time.sleep(.2)
+        assert len(alarms) == 1
+        assert not watch.changed
+
+
+@pytest.mark.parametrize('cls', WATCH_CLASSES)
+def test_watch_paths(tmpdir, cls):
+    path = tmpdir.join('notebook.py')
+    path.write('')
+    near = tmpdir.join('near.py')
+    near.write('')
+    far = tmpdir.mkdir('package').join('far.py')
+    far.write('')
+
+    with cls(str(path)) as watch:
+        alarms = count_alarms(watch)
+        watch.watch_paths([str(near), str(far)])
+        time.sleep(.2)
+        assert not watch.changed_paths
+
+        near.write('one')
+        far.write('one')
+        time.sleep(.3)
+        assert watch.changed_paths == set([str(near), str(far)])
+        assert not watch.changed_paths
+        assert not alarms
+
+        watch.watch_paths([str(far)])
+        time.sleep(.2)
+        near.write('two')
+        far.write('two')
+        time.sleep(.3)
+        assert watch.changed_paths == set([str(far)])
+        assert not watch.changed
+
+
+@pytest.mark.skipif(watch_file is not InotifyWatch, reason="needs inotify")
+def test_inotify_watch_busy_directory(tmpdir):
+    import threading
+
+    path = tmpdir.join('notebook.py')
+    path.write('')
+    log_path = tmpdir.join('log.txt')
+    done = threading.Event()
+
+    def write_log():
+        with open(str(log_path), 'w') as f:
+            while not done.wait(.005):
+                f.write('line\n')
+                f.flush()
+
+    with InotifyWatch(str(path)) as watch:
+        alarms = count_alarms(watch)
+        thread = threading.Thread(target=write_log)
+        thread.start()
+        try:
+            time.sleep(.2)
+            assert not alarms
+            # a file that keeps changing doesn't hold off the alarm either
+            start = time.time()
+            with open(str(path), 'w') as f:
+                for i in range(100):
+                    f.write('line\n')
+                    f.flush()
+                    time.sleep(.005)
+            assert len(alarms) >= 2
+            assert alarms[0] - start < InotifyWatch.max_coalesce_delay + .1
+            time.sleep(.3)
+            assert watch.changed
+        finally:
+            done.set()
+            thread.join()
+
+
+@pytest.mark.skipif(watch_file is not InotifyWatch, reason="needs inotify")
+def test_inotify_watch_replaced_file_wds(tmpdir):
+    path = tmpdir.join('notebook.py')
+    path.write('one')
+
+    with InotifyWatch(str(path)) as watch:
+        time.sleep(.2)
+        for i in range(3):
+            tmp_path = tmpdir.join('.notebook.py.swp')
+            tmp_path.write(str(i))
+            os.rename(str(tmp_path), str(path))
+            time.sleep(.1)
+        time.sleep(.2)
+        assert watch.changed
+        # the watches of the replaced inodes are gone
+        assert list(watch._file_wds.values()) == [str(path)]